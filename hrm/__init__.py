@@ -1,3 +1,4 @@
+import collections
 import inspect
 import json
 import pathlib
@@ -56,13 +57,292 @@ class HRMStepsError(HRMError):
     pass
 
 
+class HRMCycleError(HRMError):
+    pass
+
+
+def _deref(st, addr):
+    # tile number stored on tile addr, checked like in HRM.__getitem__
+    ptr = st.get(addr)
+    HRMError.check(ptr is not None, f"tile {addr} is empty")
+    if not isinstance(ptr, int):
+        raise ValueError(f"invalid address {ptr!r}")
+    return ptr
+
+
+class _Cycles:
+    "detection of repeated execution states, following Brent's algorithm"
+
+    def __init__(self):
+        self.saved = None
+        self.power = 1
+        self.lam = 0
+
+    def __call__(self, hrm, ip):
+        # called when the execution jumps backward to ip, return whether
+        # the state was already seen, the saved state being replaced every
+        # time the number of comparisons reaches a power of 2
+        head = (ip, len(hrm.inbox), len(hrm.outbox), hrm.state["hands"])
+        if self.saved is not None and self.saved[0] == head \
+                and self.saved[1] == hrm.state:
+            return True
+        self.lam += 1
+        if self.saved is None or self.lam == self.power:
+            self.saved = (head, dict(hrm.state))
+            self.power *= 2
+            self.lam = 0
+        return False
+
+
+# marks the end of a streamed inbox
+_END = object()
+
+# number of backward jumps after which a loop is traced, and maximum number
+# of operations in a trace
+_HOT, _TRACE = 32, 1024
+
+
+class _Stream:
+    "inbox pulling its values lazily from an iterator, used like a deque"
+
+    def __init__(self, values):
+        self._values = iter(values)
+        self._head = []
+
+    def __bool__(self):
+        if not self._head:
+            value = next(self._values, _END)
+            if value is _END:
+                return False
+            self._head.append(value)
+        return True
+
+    def __iter__(self):
+        yield from self._head
+
+    def popleft(self):
+        if self._head:
+            return self._head.pop()
+        return next(self._values)
+
+
+class _Writer:
+    "source code of straight-line operations, see HRM.basic_blocks"
+
+    def __init__(self, hrm, fresh=True, steps="", depth=1):
+        self.prog = hrm.prog
+        self.operand = hrm._operand
+        self.body, self.entry = [], []
+        self.inputs, self.output = 0, False
+        # the number of operations written, that is added to steps when
+        # leaving the code
+        self.count, self.steps = 0, steps
+        self.depth = depth
+        # whether hands have not been assigned yet, and whether they are
+        # known to hold a value and an integer
+        self.fresh, self.held, self.number = fresh, False, False
+        # tiles known to hold a value => whether it is known to be an integer
+        self.tiles = {}
+
+    def emit(self, *lines):
+        self.body.extend("    " * self.depth + line for line in lines)
+
+    def leave(self, pos, count=None):
+        # lines that stop at pos after count operations (all by default)
+        if count is None:
+            count = self.count
+        return ["st['hands'] = h",
+                f"return {pos}, {self.steps}{count}"]
+
+    def fail(self, cond, pos):
+        self.emit(f"if {cond}:", *(f"    {line}" for line in self.leave(pos)))
+
+    def head(self, signature, start):
+        # function definition, up to the checks made when it is entered
+        lines = [f"def {signature}:",
+                 "    h = st['hands']"]
+        if self.entry:
+            lines.extend([f"    if {' or '.join(self.entry)}:",
+                          f"        return {start}, 0"])
+        if self.inputs:
+            lines.append("    pop = hrm.inbox.popleft")
+        if self.output:
+            lines.append("    push = hrm.outbox.append")
+        return lines
+
+    def hands(self, pos):
+        if self.held:
+            return
+        elif self.fresh:
+            self.entry.append("h is None")
+        else:
+            self.fail("h is None", pos)
+        self.held = True
+
+    def tile(self, addr):
+        if addr not in self.tiles:
+            self.entry.append(f"st.get({addr}) is None")
+            self.tiles[addr] = False
+        return f"st[{addr}]"
+
+    def deref(self, addr, pos):
+        # tile number stored on tile addr, as p
+        self.emit(f"p = {self.tile(addr)}")
+        if not self.tiles[addr]:
+            self.fail("not isinstance(p, int)", pos)
+
+    def load(self, ptr, addr, pos):
+        # expression for the value of a tile, and whether it is an integer
+        if not ptr:
+            return self.tile(addr), self.tiles[addr]
+        self.deref(addr, pos)
+        self.emit("v = st.get(p)")
+        self.fail("v is None", pos)
+        return "v", False
+
+    def test(self, op):
+        # condition for a conditional jump to be taken
+        if op == "jumpz":
+            return "h == 0"
+        return "h < 0" if self.number else "isinstance(h, int) and h < 0"
+
+    def op(self, pos):
+        # an operation that is not a jump
+        op, *args = self.prog[pos]
+        ptr, addr = self.operand(op, args)
+        if op == "inbox":
+            self.inputs += 1
+            self.emit("h = pop()")
+            self.fresh, self.held, self.number = False, True, False
+        elif op == "outbox":
+            self.hands(pos)
+            self.output = True
+            self.emit("push(h)",
+                      "h = None")
+            self.fresh, self.held, self.number = False, False, False
+        elif op == "copyfrom":
+            val, self.number = self.load(ptr, addr, pos)
+            self.emit(f"h = {val}")
+            self.fresh, self.held = False, True
+        elif op == "copyto":
+            self.hands(pos)
+            if ptr:
+                self.deref(addr, pos)
+                self.emit("st[p] = h")
+                if not self.number:
+                    self.tiles = dict.fromkeys(self.tiles, False)
+            else:
+                self.emit(f"st[{addr}] = h")
+                self.tiles[addr] = self.number
+        elif op == "add":
+            self.hands(pos)
+            if not self.number:
+                self.fail("not isinstance(h, int)", pos)
+            val, isnum = self.load(ptr, addr, pos)
+            if not isnum:
+                self.fail(f"not isinstance({val}, int)", pos)
+            self.emit(f"h += {val}")
+            self.fresh, self.number = False, True
+        elif op == "sub":
+            self.hands(pos)
+            val, isnum = self.load(ptr, addr, pos)
+            if self.number and isnum:
+                self.emit(f"h -= {val}")
+            else:
+                self.emit(f"if isinstance(h, int) and isinstance({val}, int):",
+                          f"    h -= {val}",
+                          f"elif isinstance(h, str) and isinstance({val}, str)"
+                          f" and len(h) == len({val}) == 1:",
+                          f"    h = ord(h) - ord({val})",
+                          "else:",
+                          *(f"    {line}" for line in self.leave(pos)))
+            self.fresh, self.number = False, True
+        else:
+            val, isnum = self.load(ptr, addr, pos)
+            if not isnum:
+                self.fail(f"not isinstance({val}, int)", pos)
+            delta = "+ 1" if op == "bumpup" else "- 1"
+            if ptr:
+                self.emit(f"h = st[p] = v {delta}")
+            else:
+                self.emit(f"h = st[{addr}] = {val} {delta}")
+                self.tiles[addr] = True
+            self.fresh, self.held, self.number = False, True, True
+        self.count += 1
+
+    def jump(self, pos, target):
+        # a jump that ends a block
+        op = self.prog[pos][0]
+        if op != "jump":
+            self.hands(pos)
+        self.count += 1
+        self.emit("st['hands'] = h")
+        if op != "jump":
+            self.emit(f"if {self.test(op)}:",
+                      f"    return {target}, {self.steps}{self.count}")
+            target = pos + 1
+        self.emit(f"return {target}, {self.steps}{self.count}")
+
+    def branch(self, pos, target, taken):
+        # a jump along a trace, that leaves it if not taken as recorded
+        op = self.prog[pos][0]
+        if op != "jump":
+            self.hands(pos)
+            test = self.test(op)
+            self.count += 1
+            if taken:
+                self.fail(f"not ({test})", pos + 1)
+            else:
+                self.fail(test, target)
+        else:
+            self.count += 1
+
+
+class _Tracer:
+    "detection and recording of hot loops, see HRM.run"
+
+    def __init__(self, hrm, thread):
+        self.hrm = hrm
+        self.thread = thread
+        # loop head => compiled trace, or None if it could not be compiled
+        self.traces = hrm._hot(thread)
+        self.counts = collections.Counter()
+        self.head = self.path = None
+
+    def jumped(self, nxt):
+        # a backward jump to nxt, starting to record when it becomes hot
+        if nxt in self.traces:
+            return
+        self.counts[nxt] += 1
+        if self.counts[nxt] >= _HOT:
+            self.head, self.path = nxt, []
+
+    def step(self, ip, nxt):
+        # an operation executed while recording
+        self.path.append((ip, nxt))
+        if nxt == self.head:
+            self.traces[self.head] = self.hrm._trace(self.path, self.thread)
+        elif len(self.path) >= _TRACE:
+            self.traces[self.head] = None
+        else:
+            return
+        self.path = None
+
+
 class HRM (object):
     def __init__(self, prog, labels):
         self.prog = tuple((op.sub(op.lower()), *args) for op, *args in prog)
         self.labels = dict(labels)
+        self._code = None
+        self._blocks = None
+        self._traces = None
 
     @classmethod
-    def parse(cls, src):
+    def parse(cls, src, cache=False):
+        if cache:
+            from .cache import parse
+            prog, labels, _ = parse(src, cache)
+            return cls(prog, labels)
         return cls(*hrmparse(src))
 
     @classmethod
@@ -74,13 +354,17 @@ class HRM (object):
         raise ValueError(f"level {level} not found")
 
     @classmethod
-    def from_level(cls, level):
+    def solution(cls, level):
         strlvl = str(level)
         path = pathlib.Path(__file__).parent / "solutions.json"
         solutions = json.load(path.open())
         if strlvl not in solutions:
             raise ValueError(f"missing level {level!r}")
-        sol = solutions[strlvl]
+        return solutions[strlvl]["source"]
+
+    @classmethod
+    def from_level(cls, level):
+        src = cls.solution(level)
         lvl = cls.level(level)
         if lvl is None:
             raise ValueError(f"missing level {level}")
@@ -89,7 +373,7 @@ class HRM (object):
         else:
             floor = []
         inbox = lvl["examples"][0]["inbox"]
-        return cls.parse(sol["source"]), inbox, floor
+        return cls.parse(src), inbox, floor
 
     def runlevel(self, level, example=0, verbose=0):
         if isinstance(level, int):
@@ -112,7 +396,7 @@ class HRM (object):
             self.state.update((int(k), v) for k, v in floor.items())
         else:
             self.state.update(enumerate(floor))
-        self.inbox = list(inbox)
+        self.inbox = collections.deque(inbox)
         self.outbox = []
         while 0 <= self.ip < len(self.prog):
             yield self.ip
@@ -130,6 +414,449 @@ class HRM (object):
             maxsteps -= 1
             HRMStepsError.check(maxsteps != 0, "too many steps")
 
+    def compile(self, thread=False):
+        """Compile the program into a list of closures
+
+        Each closure executes one operation, taking the HRM instance and its
+        state, and returning the address of the next operation, or `None` to
+        stop the program. Operands are resolved once for all, which saves
+        the dispatch performed on every step by `iter`, while errors are
+        exactly the same. The result is cached until `prog` or `labels` are
+        changed.
+
+        If `thread` is `True`, jumps to unconditional jumps are threaded,
+        that is they go directly to the end of the chain of jumps, which
+        is the same except that fewer steps are counted.
+        """
+        if self._code is not None:
+            prog, labels, code, threaded = self._code
+            if prog is self.prog and labels == self.labels:
+                return threaded if thread else code
+        code = [self._compile(pos, op, *args)
+                for pos, (op, *args) in enumerate(self.prog)]
+        threaded = [self._compile(pos, op, *args, thread=True)
+                    if op.startswith("jump") else run
+                    for run, (pos, (op, *args)) in zip(code, enumerate(self.prog))]
+        self._code = (self.prog, dict(self.labels), code, threaded)
+        return threaded if thread else code
+
+    def _target(self, lbl, thread):
+        # position of label lbl, None for the end of the program, following
+        # chains of unconditional jumps if thread is set, but not up to the
+        # end so that the program stops at the same position
+        target = self.labels[lbl]
+        seen = set()
+        while thread and 0 <= target < len(self.prog) and target not in seen:
+            op, *args = self.prog[target]
+            if op != "jump" or len(args) != 1 or args[0] not in self.labels \
+                    or not 0 <= self.labels[args[0]] < len(self.prog):
+                break
+            seen.add(target)
+            target = self.labels[args[0]]
+        return None if target == len(self.prog) else target
+
+    def _operand(self, op, args):
+        # (ptr, addr) for the operand of a well-formed operation, that is a
+        # tile number (ptr is False), a pointer (ptr is True), a label (ptr
+        # is None) or nothing (addr is None), or None if ill-formed
+        ptr = addr = None
+        if len(args) == 1 and isinstance(args[0], int):
+            ptr, addr = False, args[0]
+        elif len(args) == 1 and isinstance(args[0], list) \
+                and len(args[0]) == 1 and isinstance(args[0][0], int):
+            ptr, addr = True, args[0][0]
+        elif len(args) == 1 and isinstance(args[0], str):
+            addr = args[0]
+        if addr is None and (args or op not in ("inbox", "outbox")) \
+                or isinstance(addr, str) != op.startswith("jump"):
+            return None
+        return ptr, addr
+
+    def _compile(self, pos, op, *args, thread=False):
+        nxt = pos + 1
+        size = len(self.prog)
+        operand = self._operand(op, args)
+        if operand is None:
+            # ill-formed operation, left to the handler to fail as in iter
+            def run(hrm, st):
+                st["ip"] = nxt
+                if getattr(hrm, f"op_{op}")(*args):
+                    return None
+                return st["ip"]
+            return run
+        ptr, addr = operand
+        if op.startswith("jump"):
+            if addr not in self.labels:
+                def run(hrm, st):
+                    raise HRMError(f"labels {addr} is not defined")
+                return run
+            if not 0 <= self.labels[addr] <= size:
+                def run(hrm, st):
+                    if op != "jump":
+                        HRMError.check(st["hands"] is not None,
+                                       f"you don't hold any value")
+                    raise HRMError(f"invalid program position")
+                return run
+            target = self._target(addr, thread)
+        if op == "inbox":
+            def run(hrm, st):
+                if hrm.inbox:
+                    st["hands"] = hrm.inbox.popleft()
+                    return nxt
+        elif op == "outbox":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                hrm.outbox.append(hands)
+                st["hands"] = None
+                return nxt
+        elif op == "copyfrom":
+            def run(hrm, st):
+                tile = _deref(st, addr) if ptr else addr
+                val = st.get(tile)
+                HRMError.check(val is not None, f"tile {tile} is empty")
+                st["hands"] = val
+                return nxt
+        elif op == "copyto":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                st[_deref(st, addr) if ptr else addr] = hands
+                return nxt
+        elif op == "add":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                HRMError.check(isinstance(hands, int),
+                               f"cannot add to value {hands!r}")
+                tile = _deref(st, addr) if ptr else addr
+                val = st.get(tile)
+                HRMError.check(val is not None, f"tile {tile} is empty")
+                HRMError.check(isinstance(val, int), f"cannot add value {val!r}")
+                st["hands"] = hands + val
+                return nxt
+        elif op == "sub":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                tile = _deref(st, addr) if ptr else addr
+                val = st.get(tile)
+                HRMError.check(val is not None, f"tile {tile} is empty")
+                if isinstance(hands, int) and isinstance(val, int):
+                    st["hands"] = hands - val
+                elif isinstance(hands, str) and isinstance(val, str):
+                    st["hands"] = ord(hands) - ord(val)
+                else:
+                    raise HRMError(f"cannot sub {val!r} from {hands!r}")
+                return nxt
+        elif op in ("bumpup", "bumpdn"):
+            delta, verb = (1, "increment") if op == "bumpup" else (-1, "decrement")
+            def run(hrm, st):
+                tile = _deref(st, addr) if ptr else addr
+                val = st.get(tile)
+                HRMError.check(val is not None, f"tile {tile} is empty")
+                HRMError.check(isinstance(val, int),
+                               f"cannot {verb} value {st['hands']!r}")
+                st["hands"] = st[tile] = val + delta
+                return nxt
+        elif op == "jump":
+            def run(hrm, st):
+                return target
+        elif op == "jumpz":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                return target if hands == 0 else nxt
+        elif op == "jumpn":
+            def run(hrm, st):
+                hands = st["hands"]
+                HRMError.check(hands is not None, f"you don't hold any value")
+                if isinstance(hands, int) and hands < 0:
+                    return target
+                return nxt
+        else:
+            def run(hrm, st):
+                st["ip"] = nxt
+                if getattr(hrm, f"op_{op}")(*args):
+                    return None
+                return st["ip"]
+        return run
+
+    def basic_blocks(self, thread=False):
+        """Compile the program into basic blocks
+
+        The program is split into blocks of operations that are always
+        executed in a row (they are entered by the first one and left after
+        the last one), each being translated into a single Python function.
+        Checks that can be performed before executing a block are made once
+        for all when it is entered: tiles read before being assigned must
+        not be empty, nor hands if they are read first, and the caller is
+        responsible for checking that there are enough values in the inbox
+        and enough steps left. Other checks are made along the operations,
+        and when one fails, the block stops right before the failing
+        operation, that can then be executed using `compile` to raise the
+        error. The result is cached until `prog` or `labels` are changed.
+
+        Ill-formed operations, as well as jumps to the end of the program or
+        to invalid positions, are left out of the blocks in the same way.
+        Jumps are threaded if `thread` is `True`, as in `compile`.
+
+        Return: a list that holds, at the position of the first operation of
+        each block, a tuple `(run, count, inputs)`, and `None` at the other
+        positions. `count` is the number of operations in the block, and
+        `inputs` the number of values it takes from the inbox. `run(hrm, st)`
+        executes the block like the closures returned by `compile`, returning
+        `(ip, steps)` with the position of the next operation and the number
+        of operations executed, which is `0` if the checks made when the
+        block was entered have failed.
+        """
+        if self._blocks is None or self._blocks[0] is not self.prog \
+                or self._blocks[1] != self.labels:
+            self._blocks = (self.prog, dict(self.labels), {})
+        cache = self._blocks[2]
+        if thread not in cache:
+            cache[thread] = self._split(thread)
+        return cache[thread]
+
+    def _split(self, thread):
+        size = len(self.prog)
+        # blocks start at program start, at jumps targets and after jumps,
+        # while excluded operations are single-stepped
+        leaders, excluded, targets = {0}, set(), {}
+        for pos, (op, *args) in enumerate(self.prog):
+            operand = self._operand(op, args)
+            if operand is None:
+                excluded.add(pos)
+                leaders.add(pos + 1)
+            elif op.startswith("jump"):
+                leaders.add(pos + 1)
+                lbl = operand[1]
+                if lbl in self.labels and 0 <= self.labels[lbl] < size:
+                    targets[pos] = self._target(lbl, thread)
+                if targets.get(pos) is None:
+                    excluded.add(pos)
+                else:
+                    leaders.add(targets[pos])
+        leaders = sorted(pos for pos in leaders if pos < size)
+        source, found = [], []
+        for start, stop in zip(leaders, leaders[1:] + [size]):
+            if start in excluded:
+                continue
+            if stop - 1 in excluded:
+                stop -= 1
+            lines, inputs = self._block(start, stop, targets)
+            source.extend(lines)
+            found.append((start, stop - start, inputs))
+        env = {}
+        exec(compile("\n".join(source), "<hrm blocks>", "exec"), env)
+        blocks = [None] * size
+        for start, count, inputs in found:
+            blocks[start] = (env[f"b{start}"], count, inputs)
+        return blocks
+
+    def _block(self, start, stop, targets):
+        # source code of the block of operations from start to stop
+        code = _Writer(self)
+        for pos in range(start, stop):
+            if pos in targets:
+                code.jump(pos, targets[pos])
+                break
+            code.op(pos)
+        else:
+            code.emit(*code.leave(stop))
+        return code.head(f"b{start}(hrm, st)", start) + code.body, code.inputs
+
+    def _hot(self, thread):
+        # compiled traces (or None when they cannot be) for the loops heads
+        if self._traces is None or self._traces[0] is not self.prog \
+                or self._traces[1] != self.labels:
+            self._traces = (self.prog, dict(self.labels), {})
+        return self._traces[2].setdefault(thread, {})
+
+    def _trace(self, path, thread):
+        # compile the operations recorded along one iteration of a loop
+        size = len(self.prog)
+        head = path[0][0]
+        code = _Writer(self, fresh=False, steps="n + ", depth=2)
+        for pos, nxt in path:
+            op, *args = self.prog[pos]
+            operand = self._operand(op, args)
+            if operand is None:
+                return None
+            elif not op.startswith("jump"):
+                code.op(pos)
+                continue
+            lbl = operand[1]
+            if lbl not in self.labels or not 0 <= self.labels[lbl] < size:
+                return None
+            target = self._target(lbl, thread)
+            if target is None:
+                return None
+            code.branch(pos, target, nxt == target)
+        loop = f"budget <= 0 or n + {code.count} < budget"
+        if code.inputs:
+            loop = f"({loop}) and len(inbox) >= {code.inputs}"
+        lines = code.head(f"t{head}(hrm, st, budget)", head)
+        if code.inputs:
+            lines.append("    inbox = hrm.inbox")
+        lines.extend(["    n = 0",
+                      f"    while {loop}:",
+                      *code.body,
+                      f"        n += {code.count}",
+                      "    st['hands'] = h",
+                      f"    return {head}, n"])
+        env = {}
+        exec(compile("\n".join(lines), f"<hrm trace {head}>", "exec"), env)
+        return env[f"t{head}"]
+
+    def run(self, inbox, floor=[], maxsteps=0, detect=False, blocks=False,
+            trace=False):
+        """Execute the program using its compiled form
+
+        Arguments and state after execution are like for `iter`, but
+        operations are executed without being yield nor logged. Jumps are
+        threaded (see `compile`) when steps are not counted.
+
+        If `detect` is `True`, the state (position, hands, tiles, inbox and
+        outbox lengths) is compared with a previously saved one every time
+        the execution jumps backward, and `HRMCycleError` is raised as soon
+        as it repeats, since the program would then loop forever.
+
+        If `blocks` is `True`, the program is executed by basic blocks (see
+        `basic_blocks`), counting the steps of a whole block at once. Blocks
+        are single-stepped when there are not enough values in the inbox
+        or steps left to execute them completely, or when their checks fail,
+        so that the result and errors are exactly the same.
+
+        If `trace` is `True`, backward jumps are counted, and when a loop has
+        been jumped to often enough, its next iteration is recorded and
+        compiled into a Python function that executes as many iterations as
+        possible, as long as conditional jumps go in the same direction as
+        recorded. When they do not, the trace is left right after the jump,
+        and execution continues as usual. Traces are cached like compiled
+        code, they are not used when `detect` is `True`.
+
+        Return: the produced outbox
+        """
+        code = self.compile(maxsteps == 0)
+        blocks = self.basic_blocks(maxsteps == 0) if blocks else None
+        tracer = _Tracer(self, maxsteps == 0) if trace and not detect else None
+        self.state = st = {"ip": 0, "hands": None}
+        if isinstance(floor, dict):
+            st.update((int(k), v) for k, v in floor.items())
+        else:
+            st.update(enumerate(floor))
+        self.inbox = collections.deque(inbox)
+        self.outbox = []
+        cycles = _Cycles() if detect else None
+        ip, size = 0, len(code)
+        try:
+            while ip < size:
+                if tracer is not None and tracer.path is None \
+                        and tracer.traces.get(ip) is not None:
+                    nxt, done = tracer.traces[ip](self, st, maxsteps)
+                    if done:
+                        ip = nxt
+                        maxsteps -= done
+                        continue
+                if blocks is not None and blocks[ip] is not None \
+                        and (tracer is None or tracer.path is None):
+                    block, count, inputs = blocks[ip]
+                    if (maxsteps <= 0 or maxsteps > count) \
+                            and len(self.inbox) >= inputs:
+                        nxt, done = block(self, st)
+                        if done:
+                            if cycles is not None and nxt <= ip \
+                                    and cycles(self, nxt):
+                                ip = nxt
+                                raise HRMCycleError("infinite loop at"
+                                                    f" position {ip}")
+                            if tracer is not None and nxt <= ip:
+                                tracer.jumped(nxt)
+                            ip = nxt
+                            maxsteps -= done
+                            continue
+                nxt = code[ip](self, st)
+                if nxt is None:
+                    ip += 1
+                    break
+                if cycles is not None and nxt <= ip and cycles(self, nxt):
+                    ip = nxt
+                    raise HRMCycleError(f"infinite loop at position {ip}")
+                if tracer is not None:
+                    if tracer.path is not None:
+                        tracer.step(ip, nxt)
+                    elif nxt <= ip:
+                        tracer.jumped(nxt)
+                ip = nxt
+                maxsteps -= 1
+                if maxsteps == 0:
+                    raise HRMStepsError("too many steps")
+        except (HRMStepsError, HRMCycleError):
+            raise
+        except Exception:
+            ip += 1
+            raise
+        finally:
+            st["ip"] = ip
+        return self.outbox
+
+    def stream(self, inbox, floor=[], maxsteps=0, chunk=1024):
+        """Execute the program on a stream of values
+
+        Like `run`, but `inbox` is consumed lazily, one value each time the
+        program needs one, and the outbox is delivered by chunks as soon as
+        they are full, so that memory is bounded whatever the lengths of
+        the inbox and outbox, and results flow out while the program is
+        still running.
+
+        Arguments:
+         - `inbox: Iterable[int | str]`: the values of the inbox
+         - `floor`, `maxsteps`: like for `run`
+         - `chunk: int = 1024`: maximum number of values in a chunk of the
+           outbox
+
+        Return: a generator of the chunks of the outbox, as lists of values,
+        `HRMError` being raised when the program fails, after the values
+        output before the error have been delivered
+        """
+        if chunk < 1:
+            raise ValueError("invalid chunk size")
+        code = self.compile(maxsteps == 0)
+        self.state = st = {"ip": 0, "hands": None}
+        if isinstance(floor, dict):
+            st.update((int(k), v) for k, v in floor.items())
+        else:
+            st.update(enumerate(floor))
+        self.inbox = _Stream(inbox)
+        self.outbox = out = []
+        ip, size = 0, len(code)
+        error = None
+        try:
+            while ip < size:
+                nxt = code[ip](self, st)
+                if nxt is None:
+                    ip += 1
+                    break
+                ip = nxt
+                maxsteps -= 1
+                if maxsteps == 0:
+                    raise HRMStepsError("too many steps")
+                if len(out) >= chunk:
+                    yield out
+                    self.outbox = out = []
+        except HRMStepsError as err:
+            error = err
+        except Exception as err:
+            ip += 1
+            error = err
+        finally:
+            st["ip"] = ip
+        if out:
+            yield out
+        if error is not None:
+            raise error
+
     def __call__(self, inbox, floor=[], verbose=0, delay=0.0, maxsteps=0):
         if verbose:
             rprint("[bold green]INBOX:[/] ",
@@ -142,7 +869,7 @@ class HRM (object):
                     time.sleep(delay)
         else:
             try:
-                list(self.iter(inbox, floor, None, maxsteps))
+                self.run(inbox, floor, maxsteps)
             except HRMError as error:
                 if verbose:
                     rprint(f"[red bold]error:[/] {error}")
@@ -200,7 +927,7 @@ class HRM (object):
 
     def op_inbox(self):
         if self.inbox:
-            self.hands = self.inbox.pop(0)
+            self.hands = self.inbox.popleft()
         else:
             return True
 
@@ -269,7 +996,7 @@ class HRM (object):
         pos = self.labels[lbl]
         HRMError.check(self.hands is not None, f"you don't hold any value")
         HRMError.check(0 <= pos <= len(self.prog), f"invalid program position")
-        if self.hands < 0:
+        if isinstance(self.hands, int) and self.hands < 0:
             if pos >= len(self.prog):
                 return True
             self.ip = pos
@@ -7,11 +7,15 @@ from pathlib import Path
 
 from typer import Typer, Option, Argument, Exit
 from rich import print as rprint
+from rich.table import Table
+from rich.text import Text
 
 from . import HRM, HRMError
 from .parse import ParseError
 from .tui import main as tui
 from .hrmx import HRMX, HRMProgramError
+from .engine import Engine
+from .ops import colors
 
 
 app = Typer(context_settings={"help_option_names": ["-h", "--help"]})
@@ -141,9 +145,10 @@ def run(
     hrm, inbox, tiles = build(prog, inbox, tiles,
                               length, negative, chars, maxval)
     try:
-        outbox = hrm(inbox, tiles, verbose, delay)
-        if not verbose:
-            print(*outbox)
+        if verbose:
+            hrm(inbox, tiles, verbose, delay)
+        else:
+            print(*Engine(hrm.prog, hrm.labels)(inbox, tiles))
     except HRMError:
         raise Exit(1)
 
@@ -182,6 +187,12 @@ def xrun(
             "-n", "--negative",
             help="allow negative numbers in generated inbox"
         )] = False,
+    chars: Annotated[
+        bool,
+        Option(
+            "--chars",
+            help="allow characters in generated inbox"
+        )] = False,
     length: Annotated[
         int,
         Option(
@@ -201,18 +212,160 @@ def xrun(
         Option(
             "-c", "--capacity",
             metavar="INT",
-            help="maximum size of inbox/outbox/tiles"
-        )] = 512):
+            help="number of tiles and maximum size of outbox"
+        )] = 512,
+    native: Annotated[
+        bool,
+        Option(
+            "-N", "--native",
+            help="compile the program to native code (requires a C compiler)"
+        )] = False):
     hrm, inbox, tiles = build(prog, inbox, tiles,
-                              length, negative, False, maxval)
-    hrmx = HRMX.compile(hrm.prog, hrm.labels, capacity)
+                              length, negative, chars, maxval)
+    hrmx = HRMX(hrm.prog, hrm.labels, capacity)
+    if native:
+        hrmx.aot()
     try:
-        print(*hrmx(inbox, tiles, 2 if verbose else 1))
+        if verbose:
+            hrmx.boot(inbox, tiles)
+            for addr, lineno, op, arg, hands in hrmx:
+                rprint(f"[dim][{lineno}@{addr}][/]",
+                       f"[{colors[op]}]{op}[/]",
+                       "" if arg is None else f"[{colors[op]}]{arg}[/]",
+                       "" if hands is None else f"[dim]=>[/] {hands}")
+            print(*hrmx.outbox)
+        else:
+            print(*hrmx(inbox, tiles, 0))
     except HRMProgramError as err:
         rprint(f"[red]error:[/] {err}")
         raise Exit(1)
 
 
+def heat(ratio):
+    # background color going from dark blue (cold) to red (hot)
+    r, b = int(40 + 200 * ratio), int(90 * (1 - ratio))
+    return f"on rgb({r},30,{b})"
+
+
+@app.command(help="profile a program and print its source with step counts")
+def profile(
+    prog: Annotated[
+        str,
+        Argument(
+            help="program to profile: either a PATH to source or 'lvl:NUM'")],
+    level: Annotated[
+        Optional[int],
+        Option(
+            "-L", "--level",
+            metavar="NUM",
+            help="run the examples of level NUM (default with 'lvl:NUM')"
+        )] = None,
+    runs: Annotated[
+        int,
+        Option(
+            "-r", "--runs",
+            metavar="INT",
+            help="run INT generated inboxes instead of level examples"
+        )] = 0,
+    tiles: Annotated[
+        list,
+        Option(
+            "-t", "--tiles",
+            metavar="LIST",
+            parser=parse_tiles,
+            help="tiles to be used (eg, '1,,,0' with empty slots allowed)"
+        )] = [],
+    negative: Annotated[
+        bool,
+        Option(
+            "-n", "--negative",
+            help="allow negative numbers in generated inboxes"
+        )] = False,
+    chars: Annotated[
+        bool,
+        Option(
+            "--chars",
+            help="allow characters in generated inboxes"
+        )] = False,
+    length: Annotated[
+        int,
+        Option(
+            "-l", "--length",
+            metavar="INT",
+            help="generate inboxes with INT items"
+        )] = 10,
+    maxval: Annotated[
+        int,
+        Option(
+            "-m", "--max",
+            metavar="INT",
+            help="generate inboxes with |values| <= INT"
+        )] = 10,
+    capacity: Annotated[
+        int,
+        Option(
+            "-c", "--capacity",
+            metavar="INT",
+            help="number of tiles and maximum size of outbox"
+        )] = 512,
+    maxsteps: Annotated[
+        int,
+        Option(
+            "-s", "--maxsteps",
+            metavar="INT",
+            help="stop every run after INT operations (0 for no limit)"
+        )] = 100000):
+    try:
+        if match := re.match(r"^(lvl|level):(\d+)$", prog, re.I):
+            src = HRM.solution(int(match.group(2)))
+            if level is None:
+                level = int(match.group(2))
+        else:
+            src = Path(prog).read_text()
+        hrmx = HRMX.parse(src, capacity)
+        lvl = None if level is None else HRM.level(level)
+    except (ParseError, OSError, ValueError) as err:
+        rprint(f"[bold red]{err}")
+        raise Exit(1)
+    if lvl is not None and not runs:
+        inboxes = [ex["inbox"] for ex in lvl["examples"]]
+        if not tiles:
+            tiles = lvl.get("floor", {}).get("tiles", [])
+    else:
+        inboxes = [gen_inbox(length, negative, chars, maxval)
+                   for _ in range(runs or 100)]
+    hrmx.profile()
+    batch = hrmx.run_batch(inboxes, tiles, maxsteps)
+    hits, taken = hrmx.hits, hrmx.taken
+    lines = hrmx.profile_lines()
+    total = sum(hits) or 1
+    hottest = max(hits, default=0) or 1
+    table = Table(box=None, pad_edge=False)
+    table.add_column("line", justify="right", style="dim")
+    table.add_column("steps", justify="right")
+    table.add_column("%", justify="right")
+    table.add_column("taken", justify="right", style="dim")
+    table.add_column("source")
+    for num, line in enumerate(src.splitlines(), start=1):
+        if num in lines:
+            count, jumps = lines[num]
+            style = heat(count / hottest)
+            table.add_row(str(num), str(count), f"{100 * count / total:.1f}",
+                          str(jumps) if jumps else "",
+                          Text(line, style=style))
+        else:
+            table.add_row(str(num), "", "", "", Text(line, style="dim"))
+    rprint(table)
+    summary = [f"[bold]{len(batch)}[/] runs,",
+               f"[bold]{sum(batch.steps)}[/] steps,",
+               f"[bold]{sum(batch.steps) / max(1, len(batch)):.1f}[/] steps per run"]
+    if failed := sum(1 for e in batch.errors if e and e != HRMProgramError.STEPS):
+        summary.append(f"([red]{failed} failed[/])")
+    if stopped := sum(1 for e in batch.errors if e == HRMProgramError.STEPS):
+        summary.append(f"([red]{stopped} stopped after {maxsteps} steps[/])")
+    rprint(*summary)
+
+
 @app.command(help="run a program interactively")
 def play(prog: Annotated[
             str,
@@ -0,0 +1,327 @@
+"""Static analysis of HRMX programs
+
+The kinds of values (nothing, a number or a letter) that the hands and the
+tiles may hold before each operation are computed by a forward dataflow
+analysis over the control-flow graph of the program, starting from a known
+initial floor. Only the tiles whose number appears in the program are
+tracked, values are not. This allows to find the operations whose checks
+(empty hands or tiles, kinds of values, tiles out of capacity, arguments
+out of the program) can never fail, so that `HRMX` may execute unchecked
+versions of them. Indirect accesses `[A]` are never unchecked.
+
+The counting loops of a program are also recognised by symbolic execution
+of their bodies, so that `HRMX` may execute many of their iterations at
+once, see `loops`.
+"""
+
+from .hrmx import CODES
+
+# abstract values are sets of kinds, encoded as bit masks
+EMPTY, NUM, CHAR = 1, 2, 4
+_KINDS = {CODES["NUM"]: NUM, CODES["CHAR"]: CHAR}
+
+
+def _ops(program):
+    # decode program as {addr: (op, arg, next)}, arg being None, an int,
+    # a list [int], or the target address of a jump
+    ops = {}
+    for addr in program.source:
+        _, op, arg = program.decode(addr)
+        if op.startswith("jump"):
+            arg = program.labels[arg]
+        ops[addr] = (op, arg, addr + (1 if arg is None else 2))
+    return ops
+
+
+def _join(old, new):
+    if old is None:
+        return new
+    return old[0] | new[0], tuple(a | b for a, b in zip(old[1], new[1]))
+
+
+def kinds(program, floor, chars):
+    """Compute the possible kinds of values before each operation
+
+    Arguments:
+     - `program: Program`: the encoded program
+     - `floor: tuple[tuple[int, int]]`: the initial tiles, as pairs of a
+       tile number and the kind of its value (`CODES["NUM"]` or `CODES["CHAR"]`)
+     - `chars: bool`: whether the inbox may hold letters
+
+    Return: a pair `(tiles, states)` where `tiles` is the list of the tracked
+    tile numbers, and `states` maps the address of each reachable operation
+    to a pair `(hands, tiles)` of the possible kinds for the hands and for
+    each tracked tile, or `None` if the program jumps in the middle of an
+    operation
+    """
+    ops = _ops(program)
+    size = len(program)
+    tracked = sorted({arg[0] if isinstance(arg, list) else arg
+                      for op, arg, _ in ops.values()
+                      if arg is not None and not op.startswith("jump")})
+    pos = {t: i for i, t in enumerate(tracked)}
+    init = dict(floor)
+    # any value comes from the floor, the inbox, or is computed
+    known = NUM | (CHAR if chars or CODES["CHAR"] in init.values() else 0)
+    inbox = NUM | (CHAR if chars else 0)
+    start = (EMPTY, tuple(_KINDS[init[t]] if t in init else EMPTY for t in tracked))
+    states = {}
+    if 0 in ops:
+        states[0] = start
+    todo = list(states)
+    while todo:
+        addr = todo.pop()
+        if addr not in ops:
+            if addr != size:
+                return tracked, None
+            continue
+        op, arg, nxt = ops[addr]
+        hands, tiles = states[addr]
+        tiles = list(tiles)
+        succ = [nxt]
+        if isinstance(arg, list):
+            # the pointer tile must hold a number for the operation to succeed
+            ptr = pos[arg[0]]
+            if not tiles[ptr] & NUM:
+                continue
+            tiles[ptr] = NUM
+        if op == "inbox":
+            hands = inbox
+        elif op == "outbox":
+            hands = EMPTY if hands & ~EMPTY else 0
+        elif op == "copyfrom" and isinstance(arg, int):
+            hands = tiles[pos[arg]] = tiles[pos[arg]] & ~EMPTY
+        elif op == "copyfrom":
+            hands = known
+        elif op == "copyto":
+            hands &= ~EMPTY
+            if isinstance(arg, int):
+                tiles[pos[arg]] = hands
+            else:
+                tiles = [t | hands for t in tiles]
+                tiles[ptr] |= NUM
+        elif op == "add":
+            if not hands & NUM:
+                continue
+            hands = NUM
+            if isinstance(arg, int):
+                tiles[pos[arg]] &= NUM
+        elif op == "sub":
+            if isinstance(arg, int):
+                hands = tiles[pos[arg]] = hands & tiles[pos[arg]] & ~EMPTY
+            hands = NUM if hands & ~EMPTY else 0
+        elif op in ("bumpup", "bumpdn"):
+            hands = NUM
+            if isinstance(arg, int):
+                tiles[pos[arg]] &= NUM
+        elif op == "jump":
+            succ = [arg]
+        else:
+            hands &= ~EMPTY
+            succ = [arg, nxt]
+        if not hands or not all(tiles):
+            # the operation always fails
+            continue
+        for s in succ:
+            new = _join(states.get(s), (hands, tuple(tiles)))
+            if new != states.get(s):
+                states[s] = new
+                todo.append(s)
+    return tracked, {a: s for a, s in states.items() if a in ops}
+
+
+def unchecked(program, floor, chars, capacity):
+    """Find the operations that cannot fail
+
+    Arguments:
+     - `program`, `floor`, `chars`: like for `kinds`
+     - `capacity: int`: the number of tiles
+
+    Return: the set of the addresses of the operations that may be executed
+    without their checks, the capacity of the outbox and its expected
+    contents being still checked
+    """
+    tracked, states = kinds(program, floor, chars)
+    if states is None:
+        return set()
+    pos = {t: i for i, t in enumerate(tracked)}
+    ops = _ops(program)
+    safe = set()
+    for addr, (hands, tiles) in states.items():
+        op, arg, nxt = ops[addr]
+        if nxt > len(program) or isinstance(arg, list):
+            continue
+        if isinstance(arg, int) and not op.startswith("jump"):
+            if arg >= capacity:
+                continue
+            tile = tiles[pos[arg]]
+        if op == "outbox" or op in ("jumpz", "jumpn"):
+            ok = not hands & EMPTY
+        elif op == "copyfrom":
+            ok = not tile & EMPTY
+        elif op == "copyto":
+            ok = not hands & EMPTY
+        elif op == "add":
+            ok = hands == NUM and tile == NUM
+        elif op == "sub":
+            ok = hands == tile and hands in (NUM, CHAR)
+        elif op in ("bumpup", "bumpdn"):
+            ok = tile == NUM
+        else:
+            ok = False
+        if ok:
+            safe.add(addr)
+    return safe
+
+
+# hands, as a variable of linear expressions
+HANDS = -1
+# longest loop body, and largest coefficient or constant, that are accelerated
+_MAXLEN = 64
+_MAXCOEF = 2**15
+
+
+def _lin(*terms):
+    # sum of linear expressions given as pairs (factor, expr), an expression
+    # being a dict that maps variables to coefficients, and None to a constant
+    res = {}
+    for factor, expr in terms:
+        for var, coef in expr.items():
+            res[var] = res.get(var, 0) + factor * coef
+    return {var: coef for var, coef in res.items() if coef}
+
+
+def _path(ops, head, taken):
+    # the operations executed from head until it is reached again, following
+    # the branch of the single conditional jump chosen by taken, and the
+    # index of this jump in the path, or None if there is no such loop
+    path, cond, addr = [], None, head
+    while len(path) < _MAXLEN:
+        if addr not in ops:
+            return None
+        op, arg, nxt = ops[addr]
+        path.append(addr)
+        if op == "jump":
+            addr = arg
+        elif op in ("jumpz", "jumpn"):
+            if cond is not None:
+                return None
+            cond = len(path) - 1
+            addr = arg if taken else nxt
+        elif op in ("inbox", "outbox") or isinstance(arg, list):
+            return None
+        else:
+            addr = nxt
+        if addr == head:
+            return None if cond is None else (path, cond)
+        elif addr in path:
+            return None
+
+
+def _summary(ops, head):
+    # summary of the counting loop starting at head, see loops
+    found = [(taken, p) for taken in (True, False)
+             if (p := _path(ops, head, taken)) is not None]
+    if len(found) != 1:
+        return None
+    taken, (path, cond) = found[0]
+    op = ops[path[cond]][0]
+    if op == "jumpz" and taken:
+        return None
+    elif op == "jumpz":
+        exit = "zero"
+    else:
+        exit = "nonnegative" if taken else "negative"
+    # symbolic execution of the body, in terms of the values at its start,
+    # values collecting those computed by arithmetic operations
+    env, read, values = {}, set(), []
+
+    def get(var):
+        if var not in env:
+            read.add(var)
+            return {var: 1}
+        return env[var]
+
+    for idx, addr in enumerate(path):
+        op, arg, _ = ops[addr]
+        if op == "copyfrom":
+            env[HANDS] = get(arg)
+        elif op == "copyto":
+            env[arg] = get(HANDS)
+        elif op == "add":
+            env[HANDS] = _lin((1, get(HANDS)), (1, get(arg)))
+            values.append(env[HANDS])
+        elif op == "sub":
+            env[HANDS] = _lin((1, get(HANDS)), (-1, get(arg)))
+            values.append(env[HANDS])
+        elif op in ("bumpup", "bumpdn"):
+            one = {None: 1 if op == "bumpup" else -1}
+            env[HANDS] = env[arg] = _lin((1, get(arg)), (1, one))
+            values.append(env[HANDS])
+        elif idx == cond:
+            test = get(HANDS)
+    # the variables that are both read and written have to be incremented
+    # by loop invariants, those that are written first are dead on entry
+    deltas = {}
+    for var in read & set(env):
+        deltas[var] = _lin((1, env[var]), (-1, {var: 1}))
+        if any(v is not None and (v in env) for v in deltas[var]):
+            return None
+    dtest = _lin(*((coef, deltas[var]) for var, coef in test.items()
+                   if var in deltas))
+    # so do the computed values, that may thus be checked for overflows
+    # only at the first and last of a number of iterations
+    bounds = []
+    for value in values:
+        change = _lin(*((coef, deltas[var]) for var, coef in value.items()
+                        if var in deltas))
+        if (value, change) not in bounds:
+            bounds.append((value, change))
+    exprs = [test, dtest, *deltas.values(), *(e for b in bounds for e in b)]
+    if not dtest or any(abs(c) > _MAXCOEF for e in exprs for c in e.values()):
+        return None
+    tiles = [v for v in set(env) | read if v != HANDS]
+    return (len(path), path[-1], exit, max(tiles, default=-1) + 1, sorted(read),
+            test, dtest, bounds, sorted(deltas.items()))
+
+
+def loops(program):
+    """Find the counting loops that may be accelerated
+
+    A counting loop is a path from its head back to it, without inbox,
+    outbox or indirect accesses, and with a single conditional jump whose
+    other branch exits the loop. Moreover, every tile (or the hands) that
+    is both read and written along the path has to be incremented by the
+    same amount at every iteration, that is a linear combination of the
+    values that are not written. The value tested by the conditional jump
+    thus also evolves linearly, so that the number of iterations before
+    the loop exits can be computed at once, as well as the values of the
+    incremented tiles after a given number of iterations.
+
+    Linear expressions are given as `dict` that map variables (tile numbers,
+    or `HANDS`) to their coefficients, and `None` to a constant.
+
+    Arguments:
+     - `program: Program`: the encoded program
+
+    Return: a `dict` that maps the address of the head of every counting
+    loop to a tuple with
+     - `steps: int`: the number of operations executed at every iteration
+     - `last: int`: the address of the last one, that jumps back to the head
+     - `exit: str`: when the loop is exited, that is when the tested value
+       is `"zero"`, `"negative"`, or `"nonnegative"`
+     - `top: int`: the number of tiles needed by the loop
+     - `read: list[int]`: the variables that must hold numbers at the head
+     - `test: dict`: the tested value, in terms of the values at the head
+     - `dtest: dict`: how much the tested value changes at every iteration
+     - `values: list[tuple[dict, dict]]`: the values computed by the
+       arithmetic operations, each with how much it changes at every
+       iteration
+     - `deltas: list[tuple[int, dict]]`: how much every incremented variable
+       changes at every iteration
+    """
+    ops = _ops(program)
+    heads = {arg for addr, (op, arg, _) in ops.items()
+             if op.startswith("jump") and arg <= addr}
+    return {head: summary for head in sorted(heads)
+            if (summary := _summary(ops, head)) is not None}
@@ -0,0 +1,285 @@
+"""Ahead-of-time compilation of HRMX programs into native code
+
+A program is translated into a C function `hrm_run` that behaves exactly
+like `HRMX._run`: each address of the program becomes a C label, jumps
+become `goto`s, and the hands are held in local variables, as well as the
+tiles if the program does not use pointers (otherwise, the executor's
+tiles are used directly). The function is compiled with the system C
+compiler into a shared object that is cached on disk, keyed by the hash of
+the generated code, so that a program is compiled only once.
+
+The native code is used through `Program.aot` or `HRMX.aot`, after which
+`HRMX.__call__`, `run_batch`, etc., transparently run it instead of the
+interpreter. When the native code meets something it does not handle
+(malformed operations, jumps into the middle of an operation, a full
+outbox, ...), it hands over the execution to the interpreter.
+"""
+
+import hashlib
+import os
+import pathlib
+import subprocess
+import tempfile
+
+from .cache import cache_dir
+from .hrmx import CODES
+
+# compiler flags
+CFLAGS = ["-O2", "-fPIC", "-shared"]
+
+_HEADER = """/* generated by hrm.aot */
+#include <limits.h>
+
+enum {%s};
+
+struct hrm_state {
+    int* inbox;
+    unsigned char* inbox_kind;
+    unsigned int inbox_pos;
+    unsigned int inbox_len;
+    int* outbox;
+    unsigned char* outbox_kind;
+    unsigned int outbox_pos;
+    unsigned int outbox_size;
+    int* tiles;
+    unsigned char* tiles_kind;
+    unsigned int* tiles_epoch;
+    unsigned int epoch;
+    unsigned int tiles_top;
+    int hands;
+    unsigned char hands_kind;
+    unsigned int ip;
+    unsigned int capacity;
+    int hold;
+    int expecting;
+    const int* expect;
+    const unsigned char* expect_kind;
+    unsigned int expect_len;
+};
+
+#define FAIL(code, addr, next) { stop = code; *ip = addr; s->ip = next; goto out; }
+#define RANGE(value) ((value) < INT_MIN || (value) > INT_MAX)
+
+int hrm_run(struct hrm_state* s, unsigned int maxsteps,
+            unsigned int* steps, unsigned int* ip)
+{
+    const int* in = s->inbox;
+    const unsigned char* ink = s->inbox_kind;
+    int* out = s->outbox;
+    unsigned char* outk = s->outbox_kind;
+    int* tl = s->tiles;
+    unsigned char* kd = s->tiles_kind;
+    unsigned int* ep = s->tiles_epoch;
+    const unsigned int E = s->epoch, cap = s->capacity;
+    unsigned int ipos = s->inbox_pos, ilen = s->inbox_len;
+    unsigned int opos = s->outbox_pos, osz = s->outbox_size, top = s->tiles_top;
+    unsigned int n = 0, last = s->ip, idx = 0;
+    long long r;
+    int h = s->hands;
+    unsigned char hk = s->hands_kind;
+    int stop;
+    (void) tl; (void) kd; (void) ep; (void) idx; (void) r;
+"""
+
+
+class _Tiles:
+    "access to the tiles stored in the executor's arrays"
+
+    def used(self, x):
+        return f"ep[{x}] == E"
+
+    def val(self, x):
+        return f"tl[{x}]"
+
+    def kind(self, x):
+        return f"kd[{x}]"
+
+    def store(self, x):
+        return (f"tl[{x}] = h; kd[{x}] = hk; ep[{x}] = E;"
+                f" if ({x} >= top) top = {x} + 1;")
+
+
+class _Locals:
+    "access to the tiles held in local variables"
+
+    def used(self, x):
+        return f"k{x}"
+
+    def val(self, x):
+        return f"v{x}"
+
+    def kind(self, x):
+        return f"k{x}"
+
+    def store(self, x):
+        return f"v{x} = h; k{x} = hk;"
+
+
+def _ops(program):
+    # decode program as a list of (addr, op, arg, size), arg being
+    # None, an int, a list [int], or the target address of a jump
+    ops = []
+    for addr in sorted(program.source):
+        _, op, arg = program.decode(addr)
+        if op.startswith("jump"):
+            arg = program.labels[arg]
+        ops.append((addr, op, arg, 1 if arg is None else 2))
+    return ops
+
+
+def source(program):
+    """Generate the C source code for a program
+
+    Arguments:
+     - `program: Program`: the encoded program
+
+    Return: the C source code, as a `str`
+    """
+    ops = _ops(program)
+    size = len(program)
+    addrs = {a for a, *_ in ops} | {size}
+    direct = sorted({arg for _, op, arg, _ in ops
+                     if not op.startswith("jump") and isinstance(arg, int)})
+    if any(isinstance(arg, list) for _, _, arg, _ in ops):
+        tiles = _Tiles()
+        local = []
+    else:
+        tiles = _Locals()
+        local = direct
+    enum = ", ".join(f"{k} = {v}" for k, v in CODES.items())
+    lines = [_HEADER % enum]
+    code = lines.append
+    for t in local:
+        code(f"    int v{t} = 0;")
+        code(f"    unsigned char k{t} = 0;")
+        code(f"    if ({t}u < cap && ep[{t}] == E) {{ v{t} = tl[{t}]; k{t} = kd[{t}]; }}")
+    code("    switch (s->ip) {")
+    for a in sorted(addrs):
+        code(f"    case {a}: goto L{a};")
+    code("    default: return NATIVE;")
+    code("    }")
+    for addr, op, arg, width in ops:
+        nxt = addr + width
+        code(f"L{addr}:")
+        code(f"    if (maxsteps && n == maxsteps) {{ s->ip = {addr}; goto limit; }}")
+        if nxt > size or op.startswith("jump") and arg not in addrs:
+            # let the interpreter deal with it
+            code(f"    s->ip = {addr}; *ip = last; stop = NATIVE; goto out;")
+            continue
+        fail = lambda err, at=nxt: code(f"    FAIL({err}, {addr}, {at})")
+        # operand tile
+        if isinstance(arg, list):
+            t = arg[0]
+            code(f"    if ({t}u >= cap) FAIL(OUTBOUND, {addr}, {nxt})")
+            code(f"    if (ep[{t}] != E) FAIL(EMPTY, {addr}, {nxt})")
+            code(f"    if (kd[{t}] != NUM) FAIL(BADVALUE, {addr}, {nxt})")
+            code(f"    idx = (unsigned int) tl[{t}];")
+            code(f"    if (idx >= cap) FAIL(OUTBOUND, {addr}, {nxt})")
+            x = "idx"
+        elif isinstance(arg, int) and not op.startswith("jump"):
+            code(f"    if ({arg}u >= cap) FAIL(OUTBOUND, {addr}, {nxt})")
+            x = str(arg)
+        if op == "inbox":
+            code("    if (ipos == ilen) {")
+            code(f"        if (s->hold) {{ stop = INPUT; *ip = {addr}; s->ip = {addr}; goto out; }}")
+            code(f"        stop = DONE; *ip = {addr}; s->ip = {nxt}; goto out;")
+            code("    }")
+            code("    h = in[ipos]; hk = ink[ipos++];")
+        elif op == "outbox":
+            code("    if (hk == NOTHING)"), fail("EMPTY")
+            # the interpreter grows the outbox or fails
+            code(f"    if (opos == osz) {{ s->ip = {addr}; *ip = last; stop = NATIVE; goto out; }}")
+            code("    if (s->expecting && (opos == s->expect_len || s->expect[opos] != h"
+                 " || s->expect_kind[opos] != hk))"), fail("MISMATCH")
+            code("    out[opos] = h; outk[opos++] = hk; hk = NOTHING;")
+        elif op == "copyfrom":
+            code(f"    if (!({tiles.used(x)}))"), fail("EMPTY")
+            code(f"    h = {tiles.val(x)}; hk = {tiles.kind(x)};")
+        elif op == "copyto":
+            code("    if (hk == NOTHING)"), fail("EMPTY")
+            code(f"    {tiles.store(x)}")
+        elif op == "add":
+            code("    if (hk == NOTHING)"), fail("EMPTY")
+            code("    if (hk != NUM)"), fail("BADVALUE")
+            code(f"    if (!({tiles.used(x)}))"), fail("EMPTY")
+            code(f"    if ({tiles.kind(x)} != NUM)"), fail("BADVALUE")
+            code(f"    r = (long long) h + {tiles.val(x)};")
+            code("    if (RANGE(r))"), fail("OVERFLOW")
+            code("    h = (int) r;")
+        elif op == "sub":
+            code("    if (hk == NOTHING)"), fail("EMPTY")
+            code(f"    if (!({tiles.used(x)}))"), fail("EMPTY")
+            code(f"    if ({tiles.kind(x)} != hk)"), fail("BADVALUE")
+            code(f"    r = (long long) h - {tiles.val(x)};")
+            code("    if (RANGE(r))"), fail("OVERFLOW")
+            code("    h = (int) r; hk = NUM;")
+        elif op in ("bumpup", "bumpdn"):
+            code(f"    if (!({tiles.used(x)}))"), fail("EMPTY")
+            code(f"    if ({tiles.kind(x)} != NUM)"), fail("BADVALUE")
+            delta = "+ 1" if op == "bumpup" else "- 1"
+            code(f"    r = (long long) {tiles.val(x)} {delta};")
+            code("    if (RANGE(r))"), fail("OVERFLOW")
+            code(f"    h = {tiles.val(x)} = (int) r; hk = NUM;")
+        elif op == "jump":
+            code(f"    n++; last = {addr}; goto L{arg};")
+            continue
+        elif op in ("jumpz", "jumpn"):
+            code("    if (hk == NOTHING)"), fail("EMPTY", addr + 1)
+            test = "h == 0" if op == "jumpz" else "h < 0"
+            code(f"    if (hk == NUM && {test}) {{ n++; last = {addr}; goto L{arg}; }}")
+        code(f"    n++; last = {addr};")
+    code(f"L{size}:")
+    code(f"    if (maxsteps && n == maxsteps) {{ s->ip = {size}; goto limit; }}")
+    code(f"    stop = DONE; *ip = {size}; s->ip = {size}; goto out;")
+    code("limit:")
+    code("    stop = STEPS; *ip = last;")
+    code("out:")
+    code("    if (stop == DONE && s->expecting && opos < s->expect_len)")
+    code("        stop = MISMATCH;")
+    for t in local:
+        code(f"    if (k{t}) {{ tl[{t}] = v{t}; kd[{t}] = k{t}; ep[{t}] = E;"
+             f" if ({t}u >= top) top = {t} + 1; }}")
+    code("    s->inbox_pos = ipos; s->outbox_pos = opos; s->tiles_top = top;")
+    code("    s->hands = h; s->hands_kind = hk;")
+    code("    *steps = n;")
+    code("    return stop;")
+    code("}")
+    return "\n".join(lines) + "\n"
+
+
+def build(program, cache=None, cc=None):
+    """Compile a program into a shared object, unless it is already cached
+
+    Arguments:
+     - `program: Program`: the encoded program
+     - `cache: str = None`: directory where compiled programs are stored,
+       defaulting to `cache_dir()`
+     - `cc: str = None`: C compiler to be used, defaulting to `$CC` if set,
+       or `cc` otherwise
+
+    Return: the path of the shared object, as a `str`
+    """
+    cc = cc or os.environ.get("CC", "cc")
+    src = source(program)
+    key = hashlib.sha256("\0".join([cc, *CFLAGS, src]).encode()).hexdigest()
+    cache = pathlib.Path(cache) if cache is not None else cache_dir()
+    path = cache / f"hrm-{key[:32]}.so"
+    if path.exists():
+        return str(path)
+    cache.mkdir(parents=True, exist_ok=True)
+    fd, csrc = tempfile.mkstemp(suffix=".c", dir=cache)
+    with os.fdopen(fd, "w") as out:
+        out.write(src)
+    fd, tmp = tempfile.mkstemp(suffix=".so", dir=cache)
+    os.close(fd)
+    try:
+        res = subprocess.run([cc, *CFLAGS, "-o", tmp, csrc],
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            raise OSError(f"compilation failed:\n{res.stderr}")
+        os.replace(tmp, path)
+    finally:
+        for name in (csrc, tmp):
+            if os.path.exists(name):
+                os.unlink(name)
+    return str(path)
@@ -0,0 +1,223 @@
+"""Persistent cache of parsed programs
+
+Programs are cached on disk, keyed by the hash of their source, so that a
+program whose source has already been seen is not parsed again. The parse
+result is stored in a compact binary form: only the operations, the kinds
+of their arguments and the positions of the tokens in the source are
+saved, tokens being rebuilt from the source itself, so that they carry
+the same information (line, position, file name) as freshly parsed ones.
+`hrm.hrmx.Program` also stores its encoding alongside the parse result,
+see `Program.parse`.
+
+The cache is used through `HRM.parse`, `Program.parse`, `HRMX.parse` and
+`Engine.parse` by passing them argument `cache`, that may be `True` to use
+the default directory (see `cache_dir`), or the path of a directory.
+"""
+
+import array
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+
+from .parse import OPS, Int, Str, parse as hrmparse
+
+# header of cached parse results, with the version of their format
+MAGIC = b"HRM\x01"
+
+# operations and kinds of arguments, as numbered in cached parse results
+_OPS = list(OPS)
+NONE, IDX, PTR, LABEL = range(4)
+
+
+def cache_dir():
+    """Default directory for cached programs
+
+    Return: `$HRM_CACHE` if set, otherwise `hrm` within `$XDG_CACHE_HOME`
+    (defaulting to `~/.cache`)
+    """
+    if "HRM_CACHE" in os.environ:
+        return pathlib.Path(os.environ["HRM_CACHE"])
+    xdg = os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")
+    return pathlib.Path(xdg) / "hrm"
+
+
+def _dir(cache):
+    return cache_dir() if cache is True else pathlib.Path(cache)
+
+
+def read(src):
+    """Read a program source
+
+    Arguments:
+     - `src`: program source as expected by parser
+
+    Return: a pair `(text, path)` with the source text and the file name to
+    be reported in errors (or `None`)
+    """
+    hrmparse.path = None
+    text = hrmparse.read(src)
+    return text, hrmparse.path
+
+
+def digest(text):
+    """Key of a program source in the cache
+
+    Return: the SHA-256 of `text`, as a `str`
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def load(kind, key, cache=True):
+    """Load data from the cache
+
+    Arguments:
+     - `kind: str`: kind of data, used as the file suffix
+     - `key: str`: key of the data, see `digest`
+     - `cache: str | bool = True`: cache directory, `True` for `cache_dir()`
+
+    Return: the data as `bytes`, or `None` if it is not cached
+    """
+    try:
+        return (_dir(cache) / f"hrm-{key[:32]}.{kind}").read_bytes()
+    except OSError:
+        return None
+
+
+def save(kind, key, data, cache=True):
+    """Store data into the cache
+
+    The file is written atomically, so that concurrent processes never
+    load partial data.
+
+    Arguments:
+     - `kind`, `key`, `cache`: like for `load`
+     - `data: bytes`: the data to be stored
+    """
+    path = _dir(cache) / f"hrm-{key[:32]}.{kind}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=f".{kind}", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _span(tok):
+    return [tok.lineno, tok.start, tok.end]
+
+
+def dumps(prog, labels):
+    """Encode a parse result
+
+    Arguments:
+     - `prog: list`, `labels: dict`: the program as returned by the parser
+
+    Return: the encoded program as `bytes`
+    """
+    data = [len(prog), len(labels)]
+    for op, *args in prog:
+        data.append(_OPS.index(op))
+        if not args:
+            data.extend([NONE, *_span(op)])
+        elif isinstance(args[0], list):
+            data.extend([PTR, *_span(op), *_span(args[0][0])])
+        elif isinstance(args[0], int):
+            data.extend([IDX, *_span(op), *_span(args[0])])
+        else:
+            data.extend([LABEL, *_span(op), *_span(args[0])])
+    for lbl, pos in labels.items():
+        data.extend([pos, *_span(lbl)])
+    return MAGIC + array.array("i", data).tobytes()
+
+
+def loads(data, text, path=None):
+    """Decode a parse result
+
+    Arguments:
+     - `data: bytes`: the encoded program, see `dumps`
+     - `text: str`: the source of the program
+     - `path: str = None`: the file name to be reported in errors
+
+    Return: a pair `(prog, labels)` like the parser, or raise `ValueError`
+    if `data` is invalid
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("invalid cached program")
+    values = array.array("i")
+    values.frombytes(data[len(MAGIC):])
+    lines = text.splitlines()
+    pos = 0
+
+    def take(count):
+        nonlocal pos
+        if pos + count > len(values):
+            raise ValueError("invalid cached program")
+        pos += count
+        return values[pos - count:pos]
+
+    def token(cls, kind):
+        lineno, start, end = take(3)
+        line = lines[lineno - 1]
+        value = line[start:end]
+        if cls is Str:
+            value = value.lower()
+        return cls(value, kind, lineno, line, start, end, path)
+
+    try:
+        nops, nlabels = take(2)
+        prog = []
+        for _ in range(nops):
+            num, spec = take(2)
+            op = token(Str, "cmd")
+            if spec == NONE:
+                prog.append([op])
+            elif spec == IDX:
+                prog.append([op, token(Int, "int")])
+            elif spec == PTR:
+                prog.append([op, [token(Int, "int")]])
+            else:
+                prog.append([op, token(Str, "str")])
+            if op != _OPS[num]:
+                raise ValueError("invalid cached program")
+        labels = {}
+        for _ in range(nlabels):
+            at, = take(1)
+            labels[token(Str, "lbl")] = at
+    except IndexError:
+        raise ValueError("invalid cached program")
+    if pos != len(values):
+        raise ValueError("invalid cached program")
+    return prog, labels
+
+
+def parse(src, cache=True):
+    """Parse a program, unless its parse result is cached
+
+    Arguments:
+     - `src`: program source as expected by parser
+     - `cache: str | bool = True`: cache directory, `True` for `cache_dir()`
+
+    Return: a triple `(prog, labels, key)` with the program as returned by
+    the parser, and its key in the cache
+    """
+    text, path = read(src)
+    key = digest(text)
+    data = load("prog", key, cache)
+    if data is not None:
+        try:
+            return (*loads(data, text, path), key)
+        except ValueError:
+            pass
+    hrmparse.path = path
+    prog, labels = hrmparse(io.StringIO(text))
+    # the cache is only an optimisation, it may not be writable
+    try:
+        save("prog", key, dumps(prog, labels), cache)
+    except OSError:
+        pass
+    return prog, labels, key
@@ -0,0 +1,145 @@
+from . import HRM
+from .parse import parse as hrmparse
+from .transpile import transpile
+
+try:
+    from .hrmx import HRMX, HRMProgramError, Program
+except ImportError:
+    HRMX = HRMProgramError = Program = None
+
+# values that HRMX can hold, larger ones are left to HRM
+INTMIN, INTMAX = -2**31, 2**31 - 1
+
+
+class Engine:
+    """Run programs on the fastest interpreter that supports them
+
+    Programs are executed using `HRMX` when it is available and when the
+    inbox and tiles fit into its memories, otherwise they are executed
+    by a translation into Python (see `hrm.transpile`), or using `HRM`
+    when execution is traced. In all cases, the outbox is returned as a
+    `list` and the errors raised are instances of `HRMError`.
+
+    Attributes:
+     - `hrm: HRM`: the pure Python interpreter
+     - `hrmx: HRMX | None`: the compiled interpreter, if available
+    """
+
+    def __init__(self, prog, labels, capacity=512, detect=False, program=None):
+        """Create a new engine
+
+        Arguments:
+         - `prog: list`: program as returned by the parser
+         - `labels: dict`: labels positions in the program, as returned by the parser
+         - `capacity: int = 512`: number of tiles and maximum outbox length for `HRMX`
+         - `detect: bool = False`: whether infinite loops are detected (see
+           `HRMX.detect`), in which case `HRM.run` is used instead of the
+           Python translation when `HRMX` cannot be used, executing the
+           program by basic blocks
+         - `program: Program = None`: the program already encoded for
+           `HRMX`, which is otherwise encoded from `prog` and `labels`
+        """
+        self.hrm = HRM(prog, labels)
+        self.capacity = capacity
+        self.detect = detect
+        self._python = None
+        if HRMX is None:
+            self.hrmx = None
+        else:
+            if program is None:
+                self.hrmx = HRMX(prog, labels, capacity)
+            else:
+                self.hrmx = HRMX(program, None, capacity)
+            self.hrmx.detect(detect)
+
+    @classmethod
+    def parse(cls, src, capacity=512, detect=False, cache=False):
+        """Create an engine from parsed source
+
+        Arguments:
+         - `src`: program source as expected by parser
+         - `capacity: int = 512`, `detect: bool = False`: like for `__init__`
+         - `cache: str | bool = False`: directory where parsed and encoded
+           programs are cached, `True` for the default one, or `False` to
+           disable caching (see `hrm.cache`)
+
+        Return: a new Engine instance
+        """
+        if not cache:
+            return cls(*hrmparse(src), capacity, detect)
+        from .cache import parse
+        prog, labels, key = parse(src, cache)
+        if Program is None:
+            return cls(prog, labels, capacity, detect)
+        return cls(prog, labels, capacity, detect,
+                   Program.cached(prog, labels, key, cache))
+
+    def _value(self, value):
+        if isinstance(value, str):
+            return len(value) == 1
+        return isinstance(value, int) and INTMIN <= value <= INTMAX
+
+    def supports(self, inbox, floor=[]):
+        """Check whether `inbox` and `floor` can be processed by `HRMX`
+
+        Arguments:
+         - `inbox: list`: inbox to be processed
+         - `floor: list | dict = []`: initial content of the tiles
+
+        Return: `True` if `HRMX` is available and can be used, `False` otherwise
+        """
+        if self.hrmx is None:
+            return False
+        if isinstance(floor, dict):
+            tiles = ((int(k), v) for k, v in floor.items())
+        else:
+            tiles = enumerate(floor)
+        for idx, val in tiles:
+            if val is None:
+                continue
+            if not (0 <= idx < self.capacity and self._value(val)):
+                return False
+        return all(self._value(val) for val in inbox)
+
+    @property
+    def python(self):
+        """The program translated into a Python function
+
+        It is translated on first access, if the program cannot be
+        translated, `HRM.run` is used instead.
+        """
+        if self._python is None:
+            try:
+                self._python = transpile(self.hrm.prog, self.hrm.labels)
+            except ValueError:
+                self._python = self.hrm.run
+        return self._python
+
+    def __call__(self, inbox, floor=[], maxsteps=0, verbose=0, delay=0.0):
+        """Execute the program
+
+        `HRM` is used when execution is traced (`verbose > 0`). Otherwise,
+        the Python translation is used when `HRMX` cannot be used, either
+        because of the inbox or tiles, or because it stopped with a capacity
+        error or an arithmetic overflow (which `HRM` does not have).
+
+        Arguments:
+         - `inbox: list`: inbox to be processed
+         - `floor: list | dict = []`: initial content of the tiles
+         - `maxsteps: int = 0`: maximum number of operations that can be
+           executed, `0` meaning no limit
+         - `verbose: int = 0`, `delay: float = 0.0`: like for `HRM.__call__`
+
+        Return: produced outbox, or raise `HRMError`
+        """
+        if not verbose and self.supports(inbox, floor):
+            try:
+                return self.hrmx(inbox, floor, maxsteps)
+            except HRMProgramError as err:
+                if err.errno not in (err.CAPACITY, err.OUTBOUND, err.OVERFLOW):
+                    raise
+        if not verbose and self.detect:
+            return self.hrm.run(inbox, floor, maxsteps, True, True)
+        elif not verbose:
+            return self.python(inbox, floor, maxsteps)
+        return self.hrm(inbox, floor, verbose, delay, maxsteps)
@@ -260,8 +260,8 @@ class Source:
                     patch = dict(zip(addr, version))
                     hrm.patch(patch)
                     try:
-                        if outbox == hrm(self.meta["inbox"]):
-                            break
+                        hrm(self.meta["inbox"], expected=outbox)
+                        break
                     except Exception:
                         pass
                 else:
@@ -1,10 +1,25 @@
-from libc.stdlib cimport malloc, free
-from libc.string cimport memcpy
+cimport cython
+from libc.stdlib cimport malloc, calloc, realloc, free
+from libc.string cimport memcpy, memset
+from libc.limits cimport UINT_MAX, INT_MIN, INT_MAX
 from cython.operator cimport postincrement as _pp, preincrement as pp_
+from cpython cimport array
+from cpython.buffer cimport PyObject_CheckBuffer
+from posix.dlfcn cimport dlopen, dlsym, dlerror, RTLD_NOW, RTLD_LOCAL
+import collections
+import hashlib
+import os
+import queue
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import array
 
 from rich import print as rprint
 from rich.text import Text
 
+from . import HRMError
 from .parse import parse as hrmparse, Tok
 from .ops import colors
 
@@ -74,6 +89,42 @@ cdef enum Op:
     JUMP
     JUMPN
     JUMPZ
+    # fused operations, executing two operations at once, see Program._encode
+    INBOX_COPYTO
+    INBOX_JUMPZ
+    COPYFROM_OUTBOX
+    COPYFROM_COPYTO
+    COPYFROM_ADD
+    COPYFROM_SUB
+    COPYTO_COPYFROM
+    ADD_JUMPN
+    SUB_JUMPN
+    SUB_JUMPZ
+    BUMPUP_COPYFROM
+    BUMPUP_JUMP
+    BUMPDN_JUMPZ
+    JUMPN_JUMP
+    JUMPZ_JUMP
+    # jumps to chains of jumps, see Program._thread
+    JUMP_THREAD
+    JUMPZ_THREAD
+    JUMPN_THREAD
+    # operations that are proved not to fail, see hrm.analysis
+    UOUTBOX
+    UCOPYFROM
+    UCOPYTO
+    UADD
+    USUB
+    UBUMPUP
+    UBUMPDN
+    UJUMPZ
+    UJUMPN
+
+# kind of the values, NOTHING is used for empty hands
+cdef enum Kind:
+    NOTHING = 0
+    NUM = 1
+    CHAR = 2
 
 # result of executing one operation
 cdef enum Stop:
@@ -83,13 +134,612 @@ cdef enum Stop:
     OUTBOUND = 3
     BADOP = 4
     STEPS = 5
+    BADVALUE = 6
+    INPUT = 7
+    MISMATCH = 8
+    NATIVE = 9
+    # both operations of a fused operation have been executed
+    FUSED = 10
+    # a threaded jump has been taken
+    THREADED = 11
+    # the outbox is full and has to be drained
+    OUTPUT = 12
+    # the execution state repeats, see HRMX.detect
+    CYCLE = 13
+    # an arithmetic operation yields a value that does not fit an int
+    OVERFLOW = 14
+
+# a jump to a chain of count-1 unconditional jumps, that ends at target,
+# last being the address of the last jump in the chain
+ctypedef struct Thread:
+    unsigned int target
+    unsigned int count
+    unsigned int last
+
+# when a counting loop exits, see hrm.analysis.loops
+cdef enum Exit:
+    ZERO = 0
+    NEGATIVE = 1
+    NONNEGATIVE = 2
+
+cdef dict exits = {"zero": Exit.ZERO,
+                   "negative": Exit.NEGATIVE,
+                   "nonnegative": Exit.NONNEGATIVE}
+
+# flag added to the Stop of the second operation of a fused operation
+# when it fails, meaning that the first one has been successful
+cdef enum:
+    HALF = 16
+
+# initial size of the inbox and outbox, that grow on demand
+cdef enum:
+    BOX_SIZE = 64
+
+# codes shared with the native code generated by hrm.aot
+CODES = {"DONE": Stop.DONE,
+         "EMPTY": Stop.EMPTY,
+         "CAPACITY": Stop.CAPACITY,
+         "OUTBOUND": Stop.OUTBOUND,
+         "BADOP": Stop.BADOP,
+         "STEPS": Stop.STEPS,
+         "BADVALUE": Stop.BADVALUE,
+         "INPUT": Stop.INPUT,
+         "MISMATCH": Stop.MISMATCH,
+         "NATIVE": Stop.NATIVE,
+         "OVERFLOW": Stop.OVERFLOW,
+         "NOTHING": Kind.NOTHING,
+         "NUM": Kind.NUM,
+         "CHAR": Kind.CHAR}
+
+# state of an executor as seen by native code, must be kept in sync
+# with the struct declared by hrm.aot
+ctypedef struct NativeState:
+    int* inbox
+    unsigned char* inbox_kind
+    unsigned int inbox_pos
+    unsigned int inbox_len
+    int* outbox
+    unsigned char* outbox_kind
+    unsigned int outbox_pos
+    unsigned int outbox_size
+    int* tiles
+    unsigned char* tiles_kind
+    unsigned int* tiles_epoch
+    unsigned int epoch
+    unsigned int tiles_top
+    int hands
+    unsigned char hands_kind
+    unsigned int ip
+    unsigned int capacity
+    int hold
+    int expecting
+    const int* expect
+    const unsigned char* expect_kind
+    unsigned int expect_len
+
+# native version of HRMX._run, it returns Stop.NATIVE to let the
+# interpreter execute the operation at state.ip
+ctypedef int (*NativeRun)(NativeState* state, unsigned int maxsteps,
+                          unsigned int* steps, unsigned int* ip) noexcept nogil
+
+# shared objects already loaded, they are never unloaded
+cdef dict native_libs = {}
+
+cdef NativeRun native_load(str path) except NULL:
+    cdef void* lib
+    cdef void* fun
+    cdef bytes name = os.fsencode(path)
+    if path not in native_libs:
+        lib = dlopen(name, RTLD_NOW | RTLD_LOCAL)
+        if lib == NULL:
+            raise OSError(f"cannot load {path}: {dlerror().decode()}")
+        native_libs[path] = <size_t> lib
+    lib = <void*> <size_t> native_libs[path]
+    fun = dlsym(lib, b"hrm_run")
+    if fun == NULL:
+        raise OSError(f"cannot load {path}: {dlerror().decode()}")
+    return <NativeRun> fun
+
+# read the tile number that is the argument of the current operation
+cdef inline Stop fetch(HRMX hrm, unsigned int* idx) noexcept nogil:
+    if hrm.ip >= hrm.prog_len:
+        return Stop.OUTBOUND
+    idx[0] = <unsigned int> hrm.prog[_pp(hrm.ip)]
+    if idx[0] >= hrm.capacity:
+        return Stop.OUTBOUND
+    return Stop.STEPS
+
+# replace tile number idx with the tile number stored on it
+cdef inline Stop deref(HRMX hrm, unsigned int* idx) noexcept nogil:
+    if hrm.tiles_epoch[idx[0]] != hrm.epoch:
+        return Stop.EMPTY
+    if hrm.tiles_kind[idx[0]] != Kind.NUM:
+        return Stop.BADVALUE
+    idx[0] = <unsigned int> hrm.tiles[idx[0]]
+    if idx[0] >= hrm.capacity:
+        return Stop.OUTBOUND
+    return Stop.STEPS
+
+# read the tile number that is the argument of the current operation,
+# following the pointer if the argument is [idx]
+cdef inline Stop operand(HRMX hrm, bint ptr, unsigned int* idx) noexcept nogil:
+    cdef Stop s = fetch(hrm, idx)
+    if s == Stop.STEPS and ptr:
+        return deref(hrm, idx)
+    return s
+
+cdef inline Stop do_copyfrom(HRMX hrm, unsigned int idx) noexcept nogil:
+    if hrm.tiles_epoch[idx] != hrm.epoch:
+        return Stop.EMPTY
+    hrm.hands = hrm.tiles[idx]
+    hrm.hands_kind = hrm.tiles_kind[idx]
+    return Stop.STEPS
+
+cdef inline Stop do_copyto(HRMX hrm, unsigned int idx) noexcept nogil:
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    hrm.tiles[idx] = hrm.hands
+    hrm.tiles_kind[idx] = hrm.hands_kind
+    hrm.tiles_epoch[idx] = hrm.epoch
+    if idx >= hrm.tiles_top:
+        hrm.tiles_top = idx + 1
+    return Stop.STEPS
+
+# values are ints while they are unbounded in HRM, so the executions of
+# an arithmetic operation whose result does not fit differ, these are
+# stopped with Stop.OVERFLOW, leaving the state unchanged
+cdef inline Stop set_hands(HRMX hrm, long long value) noexcept nogil:
+    if value < INT_MIN or value > INT_MAX:
+        return Stop.OVERFLOW
+    hrm.hands = <int> value
+    hrm.hands_kind = Kind.NUM
+    return Stop.STEPS
+
+cdef inline Stop set_bump(HRMX hrm, unsigned int idx, long long value) noexcept nogil:
+    if value < INT_MIN or value > INT_MAX:
+        return Stop.OVERFLOW
+    hrm.hands = hrm.tiles[idx] = <int> value
+    hrm.hands_kind = Kind.NUM
+    return Stop.STEPS
+
+cdef inline Stop do_add(HRMX hrm, unsigned int idx) noexcept nogil:
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    if hrm.hands_kind != Kind.NUM:
+        return Stop.BADVALUE
+    if hrm.tiles_epoch[idx] != hrm.epoch:
+        return Stop.EMPTY
+    if hrm.tiles_kind[idx] != Kind.NUM:
+        return Stop.BADVALUE
+    return set_hands(hrm, <long long> hrm.hands + hrm.tiles[idx])
+
+# like HRM.op_sub, letters can be subtracted to get their alphabet distance
+cdef inline Stop do_sub(HRMX hrm, unsigned int idx) noexcept nogil:
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    if hrm.tiles_epoch[idx] != hrm.epoch:
+        return Stop.EMPTY
+    if hrm.tiles_kind[idx] != hrm.hands_kind:
+        return Stop.BADVALUE
+    return set_hands(hrm, <long long> hrm.hands - hrm.tiles[idx])
+
+cdef inline Stop do_bump(HRMX hrm, unsigned int idx, int delta) noexcept nogil:
+    if hrm.tiles_epoch[idx] != hrm.epoch:
+        return Stop.EMPTY
+    if hrm.tiles_kind[idx] != Kind.NUM:
+        return Stop.BADVALUE
+    return set_bump(hrm, idx, <long long> hrm.tiles[idx] + delta)
+
+cdef inline Stop do_inbox(HRMX hrm) noexcept nogil:
+    if hrm.inbox_pos == hrm.inbox_len:
+        if hrm.hold:
+            hrm.ip -= 1
+            return Stop.INPUT
+        return Stop.DONE
+    hrm.hands = hrm.inbox[hrm.inbox_pos]
+    hrm.hands_kind = hrm.inbox_kind[_pp(hrm.inbox_pos)]
+    return Stop.STEPS
+
+# reallocate the values and kinds of a box to hold size items, return
+# whether it succeeded (otherwise the box is left unchanged)
+cdef bint resize_box(int** values, unsigned char** kinds,
+                     unsigned int size) noexcept nogil:
+    cdef void* more = realloc(values[0], size * sizeof(int))
+    if more == NULL:
+        return False
+    values[0] = <int*> more
+    more = realloc(kinds[0], size * sizeof(unsigned char))
+    if more == NULL:
+        return False
+    kinds[0] = <unsigned char*> more
+    return True
+
+# make room in the full outbox, whose operation has just been read
+#  - return Stop.OUTPUT if hrm.drain is set, in which case the outbox
+#    operation is left to be executed again once the outbox is drained
+#  - Stop.STEPS if the outbox could be doubled, up to hrm.max_outbox
+#  - Stop.CAPACITY otherwise
+cdef Stop grow_outbox(HRMX hrm) noexcept nogil:
+    cdef unsigned int size
+    if hrm.drain:
+        hrm.ip -= 1
+        return Stop.OUTPUT
+    if hrm.outbox_size >= hrm.max_outbox:
+        return Stop.CAPACITY
+    size = hrm.max_outbox if hrm.outbox_size > hrm.max_outbox // 2 \
+        else max(BOX_SIZE, 2 * hrm.outbox_size)
+    if not resize_box(&hrm.outbox, &hrm.outbox_kind, size):
+        return Stop.CAPACITY
+    hrm.outbox_size = size
+    return Stop.STEPS
+
+cdef inline Stop do_outbox(HRMX hrm) noexcept nogil:
+    cdef Stop s
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    if hrm.outbox_pos == hrm.outbox_size:
+        s = grow_outbox(hrm)
+        if s != Stop.STEPS:
+            return s
+    if hrm.expecting and (hrm.outbox_pos == hrm.expect_len
+                          or hrm.expect[hrm.outbox_pos] != hrm.hands
+                          or hrm.expect_kind[hrm.outbox_pos] != hrm.hands_kind):
+        return Stop.MISMATCH
+    hrm.outbox[hrm.outbox_pos] = hrm.hands
+    hrm.outbox_kind[_pp(hrm.outbox_pos)] = hrm.hands_kind
+    hrm.hands_kind = Kind.NOTHING
+    return Stop.STEPS
+
+cdef inline Stop do_jump(HRMX hrm) noexcept nogil:
+    if hrm.ip >= hrm.prog_len:
+        return Stop.OUTBOUND
+    if hrm.taken != NULL:
+        hrm.taken[hrm.ip - 1] += 1
+    hrm.ip = <unsigned int> hrm.prog[hrm.ip]
+    return Stop.STEPS
+
+cdef inline Stop do_jumpz(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    if hrm.ip >= hrm.prog_len:
+        return Stop.OUTBOUND
+    idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
+    if hrm.hands_kind == Kind.NUM and hrm.hands == 0:
+        if hrm.taken != NULL:
+            hrm.taken[hrm.ip - 2] += 1
+        hrm.ip = idx
+    return Stop.STEPS
+
+cdef inline Stop do_jumpn(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    if hrm.hands_kind == Kind.NOTHING:
+        return Stop.EMPTY
+    if hrm.ip >= hrm.prog_len:
+        return Stop.OUTBOUND
+    idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
+    if hrm.hands_kind == Kind.NUM and hrm.hands < 0:
+        if hrm.taken != NULL:
+            hrm.taken[hrm.ip - 2] += 1
+        hrm.ip = idx
+    return Stop.STEPS
+
+cdef inline Stop op_copyfrom(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s = fetch(hrm, &idx)
+    return do_copyfrom(hrm, idx) if s == Stop.STEPS else s
+
+cdef inline Stop op_copyto(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s = fetch(hrm, &idx)
+    return do_copyto(hrm, idx) if s == Stop.STEPS else s
+
+cdef inline Stop op_add(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s = fetch(hrm, &idx)
+    return do_add(hrm, idx) if s == Stop.STEPS else s
+
+cdef inline Stop op_sub(HRMX hrm) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s = fetch(hrm, &idx)
+    return do_sub(hrm, idx) if s == Stop.STEPS else s
+
+cdef inline Stop op_bump(HRMX hrm, int delta) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s = fetch(hrm, &idx)
+    return do_bump(hrm, idx, delta) if s == Stop.STEPS else s
+
+# after the first operation of a fused pair has returned s, check if the
+# second one, at addr, has to be executed (it is not if the first one
+# failed, or if it is a jump that was taken elsewhere), in which case its
+# opcode is skipped
+cdef inline bint then(HRMX hrm, Stop s, unsigned int addr) noexcept nogil:
+    if s != Stop.STEPS or hrm.ip != addr:
+        return False
+    hrm.ip += 1
+    return True
+
+# result of a fused operation given that of its second operation
+cdef inline Stop both(Stop s) noexcept nogil:
+    return Stop.FUSED if s == Stop.STEPS else <Stop> (s + HALF)
+
+# execute a fused operation whose opcode has just been read, returning
+#  - the Stop of the first operation if the second one was not executed
+#  - Stop.FUSED if both were successful
+#  - the Stop of the second one plus HALF if it failed
+cdef inline Stop fused(HRMX hrm, int op) noexcept nogil:
+    cdef unsigned int addr = hrm.ip + 1
+    cdef Stop s
+    if op == Op.INBOX_COPYTO:
+        s = do_inbox(hrm)
+        return both(op_copyto(hrm)) if then(hrm, s, addr - 1) else s
+    elif op == Op.INBOX_JUMPZ:
+        s = do_inbox(hrm)
+        return both(do_jumpz(hrm)) if then(hrm, s, addr - 1) else s
+    elif op == Op.COPYFROM_OUTBOX:
+        s = op_copyfrom(hrm)
+        return both(do_outbox(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.COPYFROM_COPYTO:
+        s = op_copyfrom(hrm)
+        return both(op_copyto(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.COPYFROM_ADD:
+        s = op_copyfrom(hrm)
+        return both(op_add(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.COPYFROM_SUB:
+        s = op_copyfrom(hrm)
+        return both(op_sub(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.COPYTO_COPYFROM:
+        s = op_copyto(hrm)
+        return both(op_copyfrom(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.ADD_JUMPN:
+        s = op_add(hrm)
+        return both(do_jumpn(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.SUB_JUMPN:
+        s = op_sub(hrm)
+        return both(do_jumpn(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.SUB_JUMPZ:
+        s = op_sub(hrm)
+        return both(do_jumpz(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.BUMPUP_COPYFROM:
+        s = op_bump(hrm, 1)
+        return both(op_copyfrom(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.BUMPUP_JUMP:
+        s = op_bump(hrm, 1)
+        return both(do_jump(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.BUMPDN_JUMPZ:
+        s = op_bump(hrm, -1)
+        return both(do_jumpz(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.JUMPN_JUMP:
+        s = do_jumpn(hrm)
+        return both(do_jump(hrm)) if then(hrm, s, addr) else s
+    elif op == Op.JUMPZ_JUMP:
+        s = do_jumpz(hrm)
+        return both(do_jump(hrm)) if then(hrm, s, addr) else s
+    return Stop.BADOP
+
+# execute a threaded jump whose opcode has just been read, returning
+# Stop.THREADED if it is taken, in which case it jumps directly to the end
+# of its chain
+cdef inline Stop thread(HRMX hrm, int op) noexcept nogil:
+    if op != Op.JUMP_THREAD:
+        if hrm.hands_kind == Kind.NOTHING:
+            return Stop.EMPTY
+        if hrm.hands_kind != Kind.NUM or (hrm.hands != 0 if op == Op.JUMPZ_THREAD
+                                          else hrm.hands >= 0):
+            hrm.ip += 1
+            return Stop.STEPS
+    hrm.ip = hrm.threads[hrm.ip - 1].target
+    return Stop.THREADED
+
+# execute an unchecked operation whose opcode has just been read, only the
+# checks on the outbox capacity and contents are performed
+cdef inline Stop unchecked(HRMX hrm, int op) noexcept nogil:
+    cdef unsigned int idx
+    cdef Stop s
+    if op == Op.UOUTBOX:
+        if hrm.outbox_pos == hrm.outbox_size:
+            s = grow_outbox(hrm)
+            if s != Stop.STEPS:
+                return s
+        if hrm.expecting and (hrm.outbox_pos == hrm.expect_len
+                              or hrm.expect[hrm.outbox_pos] != hrm.hands
+                              or hrm.expect_kind[hrm.outbox_pos] != hrm.hands_kind):
+            return Stop.MISMATCH
+        hrm.outbox[hrm.outbox_pos] = hrm.hands
+        hrm.outbox_kind[_pp(hrm.outbox_pos)] = hrm.hands_kind
+        hrm.hands_kind = Kind.NOTHING
+        return Stop.STEPS
+    idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
+    if op == Op.UCOPYFROM:
+        hrm.hands = hrm.tiles[idx]
+        hrm.hands_kind = hrm.tiles_kind[idx]
+    elif op == Op.UCOPYTO:
+        hrm.tiles[idx] = hrm.hands
+        hrm.tiles_kind[idx] = hrm.hands_kind
+        hrm.tiles_epoch[idx] = hrm.epoch
+        if idx >= hrm.tiles_top:
+            hrm.tiles_top = idx + 1
+    elif op == Op.UADD:
+        return set_hands(hrm, <long long> hrm.hands + hrm.tiles[idx])
+    elif op == Op.USUB:
+        return set_hands(hrm, <long long> hrm.hands - hrm.tiles[idx])
+    elif op == Op.UBUMPUP:
+        return set_bump(hrm, idx, <long long> hrm.tiles[idx] + 1)
+    elif op == Op.UBUMPDN:
+        return set_bump(hrm, idx, <long long> hrm.tiles[idx] - 1)
+    elif op == Op.UJUMPZ:
+        if hrm.hands_kind == Kind.NUM and hrm.hands == 0:
+            if hrm.taken != NULL:
+                hrm.taken[hrm.ip - 2] += 1
+            hrm.ip = idx
+    elif op == Op.UJUMPN:
+        if hrm.hands_kind == Kind.NUM and hrm.hands < 0:
+            if hrm.taken != NULL:
+                hrm.taken[hrm.ip - 2] += 1
+            hrm.ip = idx
+    return Stop.STEPS
+
+# whether the execution state is the one saved by save_state
+cdef bint same_state(HRMX hrm) noexcept nogil:
+    cdef unsigned int i
+    cdef unsigned char kind
+    if (hrm.ip != hrm.cyc_ip
+            or hrm.hands_kind != hrm.cyc_hands_kind
+            or (hrm.hands_kind != Kind.NOTHING and hrm.hands != hrm.cyc_hands)
+            or hrm.inbox_pos != hrm.cyc_inbox_pos
+            or hrm.inbox_len != hrm.cyc_inbox_len
+            or hrm.outbox_pos != hrm.cyc_outbox_pos
+            or hrm.tiles_top != hrm.cyc_top):
+        return False
+    for i in range(hrm.tiles_top):
+        kind = hrm.tiles_kind[i] if hrm.tiles_epoch[i] == hrm.epoch else Kind.NOTHING
+        if kind != hrm.cyc_kind[i] or (kind != Kind.NOTHING
+                                       and hrm.tiles[i] != hrm.cyc_tiles[i]):
+            return False
+    return True
+
+cdef void save_state(HRMX hrm) noexcept nogil:
+    cdef unsigned int i
+    hrm.cyc_ip = hrm.ip
+    hrm.cyc_hands = hrm.hands
+    hrm.cyc_hands_kind = hrm.hands_kind
+    hrm.cyc_inbox_pos = hrm.inbox_pos
+    hrm.cyc_inbox_len = hrm.inbox_len
+    hrm.cyc_outbox_pos = hrm.outbox_pos
+    hrm.cyc_top = hrm.tiles_top
+    for i in range(hrm.tiles_top):
+        if hrm.tiles_epoch[i] == hrm.epoch:
+            hrm.cyc_tiles[i] = hrm.tiles[i]
+            hrm.cyc_kind[i] = hrm.tiles_kind[i]
+        else:
+            hrm.cyc_kind[i] = Kind.NOTHING
+    hrm.cyc_saved = True
+
+# called after the execution has jumped backward, return whether its
+# state has already been seen, following Brent's algorithm: the state is
+# compared to a saved one, that is replaced every time the number of
+# comparisons reaches a power of 2
+cdef inline bint looping(HRMX hrm) noexcept nogil:
+    if hrm.cyc_saved and same_state(hrm):
+        return True
+    hrm.cyc_lam += 1
+    if not hrm.cyc_saved or hrm.cyc_lam == hrm.cyc_power:
+        save_state(hrm)
+        hrm.cyc_power *= 2
+        hrm.cyc_lam = 0
+    return False
+
+# value of a linear expression encoded at code[pos[0]] as a constant,
+# a number of terms, and pairs (variable, coefficient), moving pos after it
+cdef inline long long linear(HRMX hrm, const int* code,
+                             unsigned int* pos) noexcept nogil:
+    cdef long long value = code[pos[0]]
+    cdef unsigned int i, count = code[pos[0] + 1]
+    cdef int var
+    pos[0] += 2
+    for i in range(count):
+        var = code[pos[0]]
+        value += <long long> code[pos[0] + 1] * (hrm.hands if var < 0
+                                                 else hrm.tiles[var])
+        pos[0] += 2
+    return value
+
+# execute as many iterations as possible of the counting loop whose head
+# has just been jumped to (see Program._loops), without exceeding room
+# operations, returning the number of operations that have been skipped,
+# and storing into ip the address of the last one if there are some
+# iterations are executed at once only up to the one before the last, so
+# that the tiles that are written before being read in the body, which
+# are not updated, are computed again by the last iteration, which, as
+# the exit of the loop, is left to the interpreter
+# the values computed along the iterations executed at once must not
+# overflow, as they evolve linearly they are checked at the first and last
+# of these iterations
+@cython.cdivision(True)
+cdef unsigned int accelerate(HRMX hrm, unsigned int room,
+                             unsigned int* ip) noexcept nogil:
+    cdef unsigned int pos = hrm.loop_at[hrm.ip]
+    cdef const int* code = hrm.loops
+    cdef unsigned int length, last, exit, i, count
+    cdef int var
+    cdef long long t0, dt, k, iters, v0, dv
+    if pos == 0:
+        return 0
+    pos -= 1
+    length, last, exit = code[pos], code[pos + 1], code[pos + 2]
+    if <unsigned int> code[pos + 3] > hrm.capacity or room < 2 * length:
+        return 0
+    count = code[pos + 4]
+    pos += 5
+    for i in range(count):
+        if code[pos] < 0:
+            if hrm.hands_kind != Kind.NUM:
+                return 0
+        elif (hrm.tiles_epoch[code[pos]] != hrm.epoch
+              or hrm.tiles_kind[code[pos]] != Kind.NUM):
+            return 0
+        pos += 1
+    t0 = linear(hrm, code, &pos)
+    dt = linear(hrm, code, &pos)
+    # k is the number of iterations that are completed before the exit
+    if dt > INT_MAX or dt < INT_MIN:
+        return 0
+    elif exit == Exit.ZERO:
+        if t0 == 0 or dt == 0 or (t0 > 0) == (dt > 0) or t0 % dt != 0:
+            return 0
+        k = -t0 // dt
+    elif exit == Exit.NEGATIVE:
+        if t0 < 0 or dt >= 0:
+            return 0
+        k = t0 // -dt + 1
+    else:
+        if t0 >= 0 or dt <= 0:
+            return 0
+        k = (-t0 + dt - 1) // dt
+    # the tested value must fit an int up to the exit
+    if t0 < INT_MIN or t0 > INT_MAX or t0 + k * dt < INT_MIN or t0 + k * dt > INT_MAX:
+        return 0
+    iters = min(k - 1, room // length)
+    if iters <= 0:
+        return 0
+    count = code[pos]
+    pos += 1
+    for i in range(count):
+        v0 = linear(hrm, code, &pos)
+        dv = linear(hrm, code, &pos)
+        if v0 < INT_MIN or v0 > INT_MAX:
+            return 0
+        # otherwise the value goes through more than the range of int
+        if dv != 0 and iters - 1 > (<long long> INT_MAX - INT_MIN) // abs(dv):
+            return 0
+        if v0 + (iters - 1) * dv < INT_MIN or v0 + (iters - 1) * dv > INT_MAX:
+            return 0
+    count = code[pos]
+    pos += 1
+    for i in range(count):
+        var = code[pos]
+        pos += 1
+        dv = linear(hrm, code, &pos) * iters
+        if var < 0:
+            hrm.hands = <int> (hrm.hands + dv)
+        else:
+            hrm.tiles[var] = <int> (hrm.tiles[var] + dv)
+    ip[0] = last
+    return <unsigned int> iters * length
 
 # execute one operation
 #  - return Stop.STEPS if program may continue
 #  - Stop.DONE if program has fully executed
+#  - Stop.INPUT if the inbox is empty and hrm.hold is set, in which case
+#    the inbox operation is left to be executed again
+#  - Stop.OUTPUT if the outbox is full and hrm.drain is set, likewise
 #  - Stop.* if an error occurred
-cdef inline Stop step(HRMX hrm) noexcept nogil:
-    cdef int op, arg
+#  - Stop.FUSED, Stop.THREADED or a Stop plus HALF, if a fused operation
+#    or a threaded jump is executed as a whole, which is only done if room,
+#    the number of operations that may still be executed, allows it,
+#    otherwise only the original operation is executed
+cdef inline Stop step(HRMX hrm, unsigned int room) noexcept nogil:
+    cdef int op
     cdef Stop s
     cdef unsigned int idx
     if hrm.ip == hrm.prog_len:
@@ -97,226 +747,185 @@ cdef inline Stop step(HRMX hrm) noexcept nogil:
     elif hrm.ip > hrm.prog_len:
         return Stop.OUTBOUND
     op = hrm.prog[_pp(hrm.ip)]
+    if op > Op.JUMPZ:
+        if op >= Op.UOUTBOX:
+            return unchecked(hrm, op)
+        elif op < Op.JUMP_THREAD:
+            if room > 1:
+                return fused(hrm, op)
+        elif room >= hrm.threads[hrm.ip - 1].count:
+            return thread(hrm, op)
+        op = hrm.orig[hrm.ip - 1]
     if op == Op.INBOX:
-        if hrm.inbox_pos == hrm.inbox_len:
-            return Stop.DONE
-        hrm.hands = hrm.inbox[_pp(hrm.inbox_pos)]
-        hrm.hands_used = True
+        return do_inbox(hrm)
     elif op == Op.OUTBOX:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.outbox_pos == hrm.capacity:
-            return Stop.CAPACITY
-        hrm.outbox[_pp(hrm.outbox_pos)] = hrm.hands
-        hrm.hands_used = False
-    elif op == Op.COPYFROMIDX:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands = hrm.tiles[idx]
-        hrm.hands_used = True
-    elif op == Op.COPYFROMPTR:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        idx = <unsigned int> hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands = hrm.tiles[idx]
-        hrm.hands_used = True
-    elif op == Op.COPYTOIDX:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        hrm.tiles[idx] = hrm.hands
-        hrm.tiles_used[idx] = True
-    elif op == Op.COPYTOPTR:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        idx = <unsigned int> hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        hrm.tiles[idx] = hrm.hands
-        hrm.tiles_used[idx] = True
-    elif op == Op.ADDIDX:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands += hrm.tiles[idx]
-    elif op == Op.ADDPTR:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        idx = hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands += hrm.tiles[idx]
-    elif op == Op.SUBIDX:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands -= hrm.tiles[idx]
-    elif op == Op.SUBPTR:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        idx = hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if not hrm.tiles_used[idx]:
-            return Stop.EMPTY
-        hrm.hands -= hrm.tiles[idx]
-    elif op == Op.BUMPUPIDX:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        arg = hrm.tiles[idx]
-        hrm.hands = hrm.tiles[idx] = arg + 1
-        hrm.hands_used = True
-    elif op == Op.BUMPUPPTR:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        idx = hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        arg = hrm.tiles[idx]
-        hrm.hands = hrm.tiles[idx] = arg + 1
-        hrm.hands_used = True
-    elif op == Op.BUMPDNIDX:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        arg = hrm.tiles[idx]
-        hrm.hands = hrm.tiles[idx] = arg - 1
-        hrm.hands_used = True
-    elif op == Op.BUMPDNPTR:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        idx = hrm.tiles[idx]
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        if idx >= hrm.capacity:
-            return Stop.OUTBOUND
-        arg = hrm.tiles[idx]
-        hrm.hands = hrm.tiles[idx] = arg - 1
-        hrm.hands_used = True
+        return do_outbox(hrm)
+    elif op == Op.COPYFROMIDX or op == Op.COPYFROMPTR:
+        s = operand(hrm, op == Op.COPYFROMPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_copyfrom(hrm, idx)
+    elif op == Op.COPYTOIDX or op == Op.COPYTOPTR:
+        s = operand(hrm, op == Op.COPYTOPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_copyto(hrm, idx)
+    elif op == Op.ADDIDX or op == Op.ADDPTR:
+        s = operand(hrm, op == Op.ADDPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_add(hrm, idx)
+    elif op == Op.SUBIDX or op == Op.SUBPTR:
+        s = operand(hrm, op == Op.SUBPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_sub(hrm, idx)
+    elif op == Op.BUMPUPIDX or op == Op.BUMPUPPTR:
+        s = operand(hrm, op == Op.BUMPUPPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_bump(hrm, idx, 1)
+    elif op == Op.BUMPDNIDX or op == Op.BUMPDNPTR:
+        s = operand(hrm, op == Op.BUMPDNPTR, &idx)
+        if s != Stop.STEPS:
+            return s
+        return do_bump(hrm, idx, -1)
     elif op == Op.JUMP:
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[hrm.ip]
-        hrm.ip = idx
+        return do_jump(hrm)
     elif op == Op.JUMPZ:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if hrm.hands == 0:
-            hrm.ip = idx
+        return do_jumpz(hrm)
     elif op == Op.JUMPN:
-        if not hrm.hands_used:
-            return Stop.EMPTY
-        if hrm.ip >= hrm.prog_len:
-            return Stop.OUTBOUND
-        idx = <unsigned int> hrm.prog[_pp(hrm.ip)]
-        if hrm.hands < 0:
-            hrm.ip = idx
-    else:
-        return Stop.BADOP
-    return Stop.STEPS
+        return do_jumpn(hrm)
+    return Stop.BADOP
 
 #
 # errors during program execution
 #
 
-class HRMProgramError(Exception):
+class HRMProgramError(HRMError):
     """Error during a program execution
 
     Attributes:
-     - `errno`: error number
+     - `errno`: error number, one of the class attributes `EMPTY`,
+       `CAPACITY`, `OUTBOUND`, `BADOP`, `STEPS`, `BADVALUE`, `MISMATCH`,
+       `CYCLE`, or `OVERFLOW` (a value exceeds the range of HRMX, while
+       it would not in HRM)
+     - `position`: for `MISMATCH` errors, the position in the outbox of the
+       first value that differs from the expected outbox (or is missing
+       from it), for `CYCLE` errors, the address of the operation where
+       the execution state repeats, `None` otherwise
      - `strerror`: map error numbers to strings
     """
+    DONE = Stop.DONE
+    EMPTY = Stop.EMPTY
+    CAPACITY = Stop.CAPACITY
+    OUTBOUND = Stop.OUTBOUND
+    BADOP = Stop.BADOP
+    STEPS = Stop.STEPS
+    BADVALUE = Stop.BADVALUE
+    MISMATCH = Stop.MISMATCH
+    CYCLE = Stop.CYCLE
+    OVERFLOW = Stop.OVERFLOW
     strerror = {Stop.DONE: "no error",
                 Stop.EMPTY: "empty register",
                 Stop.CAPACITY: "capacity exceeded",
                 Stop.OUTBOUND: "out of boundary access",
                 Stop.BADOP: "invalid operation",
-                Stop.STEPS: "maximum number of steps exceeded"}
+                Stop.STEPS: "maximum number of steps exceeded",
+                Stop.BADVALUE: "invalid value",
+                Stop.MISMATCH: "unexpected outbox",
+                Stop.CYCLE: "infinite loop",
+                Stop.OVERFLOW: "arithmetic overflow"}
 
-    def __init__(self, errno, tok=None):
+    def __init__(self, errno, tok=None, position=None):
         msg = self.strerror.get(errno, "unknown error")
+        if position is not None:
+            msg = f"{msg} at position {position}"
         if tok is None:
             super().__init__(msg)
         else:
             super().__init__(tok.err(msg, False))
         self.errno = errno
+        self.position = position
+
+
+cdef object _error(frozendict source, stop, ip, position=None):
+    cdef int i
+    if stop == Stop.CYCLE and position is None:
+        position = ip
+    for i in reversed(range(ip+1)):
+        if i in source:
+            return HRMProgramError(stop, source[i][0], position)
+    return HRMProgramError(stop, None, position)
+
+#
+# results of batch executions
+#
+
+class Batch:
+    """Results from `HRMX.run_batch`
+
+    Attributes:
+     - `values: array[int]`: the outboxes of all the runs, concatenated
+     - `kinds: array[int]`: the kind of each value in `values`,
+       `1` for an integer and `2` for a letter (stored as its code)
+     - `offsets: array[int]`: outbox of run `i` is `values[offsets[i]:offsets[i+1]]`
+     - `steps: array[int]`: number of operations executed by each run
+     - `errors: array[int]`: error number of each run (`0` if no error)
+     - `ips: array[int]`: address of the last executed operation of each run
+    """
+
+    def __init__(self, source, values, kinds, offsets, steps, errors, ips):
+        self._source = source
+        self.values = values
+        self.kinds = kinds
+        self.offsets = offsets
+        self.steps = steps
+        self.errors = errors
+        self.ips = ips
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getitem__(self, idx):
+        """Outbox produced by run `idx`
+
+        Raise `HRMProgramError` if this run failed.
+        """
+        if self.errors[idx]:
+            raise self.error(idx)
+        start, stop = self.offsets[idx], self.offsets[idx+1]
+        return [decode(v, k) for v, k in zip(self.values[start:stop],
+                                             self.kinds[start:stop])]
+
+    def error(self, idx):
+        """Error raised by run `idx`, or `None` if it succeeded"""
+        if self.errors[idx] == Stop.MISMATCH:
+            return _error(self._source, self.errors[idx], self.ips[idx],
+                          self.offsets[idx+1] - self.offsets[idx])
+        elif self.errors[idx]:
+            return _error(self._source, self.errors[idx], self.ips[idx])
+
+    @classmethod
+    def concat(cls, batches):
+        """Merge several batches into one, preserving their order"""
+        values = array.array("i")
+        kinds = array.array("B")
+        offsets = array.array("I", [0])
+        steps = array.array("I")
+        errors = array.array("I")
+        ips = array.array("I")
+        source = None
+        for b in batches:
+            if source is None:
+                source = b._source
+            offsets.extend(len(values) + o for o in b.offsets[1:])
+            values.extend(b.values)
+            kinds.extend(b.kinds)
+            steps.extend(b.steps)
+            errors.extend(b.errors)
+            ips.extend(b.ips)
+        return cls(source, values, kinds, offsets, steps, errors, ips)
 
 #
 # static info to encode/decode operations
@@ -358,115 +967,373 @@ cdef dict opspec = {Op.INBOX: ("inbox", ArgSpec.NONE),
                     Op.JUMP: ("jump", ArgSpec.LABEL),
                     Op.JUMPZ: ("jumpz", ArgSpec.LABEL),
                     Op.JUMPN: ("jumpn", ArgSpec.LABEL)}
+
+# unchecked versions of operations
+cdef dict opunchecked = {Op.OUTBOX: Op.UOUTBOX,
+                         Op.COPYFROMIDX: Op.UCOPYFROM,
+                         Op.COPYTOIDX: Op.UCOPYTO,
+                         Op.ADDIDX: Op.UADD,
+                         Op.SUBIDX: Op.USUB,
+                         Op.BUMPUPIDX: Op.UBUMPUP,
+                         Op.BUMPDNIDX: Op.UBUMPDN,
+                         Op.JUMPZ: Op.UJUMPZ,
+                         Op.JUMPN: Op.UJUMPN}
+
+# threaded versions of jumps
+cdef dict opthread = {Op.JUMP: Op.JUMP_THREAD,
+                      Op.JUMPZ: Op.JUMPZ_THREAD,
+                      Op.JUMPN: Op.JUMPN_THREAD}
+
+# pairs of operations to be fused
+cdef dict opfuse = {(Op.INBOX, Op.COPYTOIDX): Op.INBOX_COPYTO,
+                    (Op.INBOX, Op.JUMPZ): Op.INBOX_JUMPZ,
+                    (Op.COPYFROMIDX, Op.OUTBOX): Op.COPYFROM_OUTBOX,
+                    (Op.COPYFROMIDX, Op.COPYTOIDX): Op.COPYFROM_COPYTO,
+                    (Op.COPYFROMIDX, Op.ADDIDX): Op.COPYFROM_ADD,
+                    (Op.COPYFROMIDX, Op.SUBIDX): Op.COPYFROM_SUB,
+                    (Op.COPYTOIDX, Op.COPYFROMIDX): Op.COPYTO_COPYFROM,
+                    (Op.ADDIDX, Op.JUMPN): Op.ADD_JUMPN,
+                    (Op.SUBIDX, Op.JUMPN): Op.SUB_JUMPN,
+                    (Op.SUBIDX, Op.JUMPZ): Op.SUB_JUMPZ,
+                    (Op.BUMPUPIDX, Op.COPYFROMIDX): Op.BUMPUP_COPYFROM,
+                    (Op.BUMPUPIDX, Op.JUMP): Op.BUMPUP_JUMP,
+                    (Op.BUMPDNIDX, Op.JUMPZ): Op.BUMPDN_JUMPZ,
+                    (Op.JUMPN, Op.JUMP): Op.JUMPN_JUMP,
+                    (Op.JUMPZ, Op.JUMP): Op.JUMPZ_JUMP}
+
+# signature of the encoding of programs, stored with those cached by
+# Program.cached, _FORMAT must be increased when the encoding changes in
+# a way that the tables above do not reflect (eg, in hrm.analysis.loops)
+cdef int _FORMAT = 2
+ENCODING = hashlib.sha256(repr([_FORMAT, sys.byteorder,
+                                *(sorted(table.items())
+                                  for table in (opop, opthread, opfuse,
+                                                opunchecked, exits))])
+                          .encode()).hexdigest()[:16]
 #
-# main class
+# values conversion
 #
 
-cdef class HRMX:
-    # arrays length
-    cdef unsigned int capacity
+# store a Python value as a number and its kind
+cdef int encode(object value, int* num, unsigned char* kind) except -1:
+    if isinstance(value, str):
+        if len(value) != 1:
+            raise ValueError(f"invalid value {value!r}")
+        num[0] = ord(value)
+        kind[0] = Kind.CHAR
+    else:
+        num[0] = value
+        kind[0] = Kind.NUM
+    return 0
+
+# flatten a list of inboxes into buffers (values, offsets, kinds)
+def flatten(inboxes):
+    cdef int num
+    cdef unsigned char kind
+    values = array.array("i")
+    kinds = array.array("B")
+    offsets = array.array("I", [0])
+    for box in inboxes:
+        for v in box:
+            encode(v, &num, &kind)
+            values.append(num)
+            kinds.append(kind)
+        offsets.append(len(values))
+    return values, offsets, kinds
+
+# get buffers (values, offsets, kinds) from a list of boxes or from a tuple
+# of buffers, kinds being None if all the values are integers
+def buffers(boxes):
+    if isinstance(boxes, tuple):
+        values, offsets, *more = boxes
+        return values, offsets, more[0] if more else None
+    return flatten(boxes)
+
+# the Python value corresponding to a number and its kind
+cdef inline object decode(int num, unsigned char kind):
+    if kind == Kind.CHAR:
+        return chr(num)
+    elif kind == Kind.NUM:
+        return num
+
+# whether a box or a floor is given as a buffer of C ints rather than as
+# a sequence of Python values
+cdef inline bint is_buffer(object obj):
+    return PyObject_CheckBuffer(obj) and not isinstance(obj, (bytes, bytearray))
+
+# enumerate the tiles of a floor, given either as a list or a dict like HRM
+cdef object floor_items(object tiles):
+    if isinstance(tiles, dict):
+        return ((int(k), v) for k, v in tiles.items())
+    else:
+        return enumerate(tiles)
+
+#
+# encoded programs
+#
+
+# position after the linear expression encoded at pos in loops (see
+# Program._loops), or -1 if it is truncated or uses tiles from top on
+cdef Py_ssize_t skip_linear(object loops, Py_ssize_t pos, int top):
+    cdef Py_ssize_t end
+    if pos < 0 or pos + 2 > len(loops) or loops[pos + 1] < 0:
+        return -1
+    end = pos + 2 + 2 * <Py_ssize_t> loops[pos + 1]
+    if end > len(loops) or any(var >= top for var in loops[pos + 2:end:2]):
+        return -1
+    return end
+
+# whether the counting loops encoded in loops and loop_at (see
+# Program._loops) are well formed, and only refer to the operations at
+# addrs and to tiles below their bound, since they are executed without
+# further checks
+cdef bint valid_loops(object loops, object loop_at, object addrs):
+    cdef Py_ssize_t pos, i, count, size = len(loops)
+    cdef int length, last, exit, top
+    for head, at in enumerate(loop_at):
+        if at == 0:
+            continue
+        elif at < 0 or head not in addrs or at - 1 + 5 > size:
+            return False
+        pos = at - 1
+        length, last, exit = loops[pos], loops[pos + 1], loops[pos + 2]
+        top, count = loops[pos + 3], loops[pos + 4]
+        pos += 5
+        if length <= 0 or last not in addrs or exit not in exits.values() \
+                or count < 0 or pos + count > size \
+                or any(var >= top for var in loops[pos:pos + count]):
+            return False
+        pos += count
+        # test and dtest
+        pos = skip_linear(loops, skip_linear(loops, pos, top), top)
+        # values
+        if pos < 0 or pos >= size or loops[pos] < 0:
+            return False
+        count = 2 * loops[pos]
+        pos += 1
+        for i in range(count):
+            pos = skip_linear(loops, pos, top)
+            if pos < 0:
+                return False
+        # deltas
+        if pos >= size or loops[pos] < 0:
+            return False
+        count = loops[pos]
+        pos += 1
+        for i in range(count):
+            if pos >= size or loops[pos] >= top:
+                return False
+            pos = skip_linear(loops, pos + 1, top)
+            if pos < 0:
+                return False
+    return True
+
+cdef class Code:
+    "owner of a code variant of a Program"
+    cdef int* code
+
+    def __cinit__(self):
+        self.code = NULL
+
+    def __dealloc__(self):
+        free(self.code)
+
+
+cdef class Program:
+    """Encoded program, together with information about its source
+
+    A `Program` is never modified once created, so that it may be shared
+    by as many `HRMX` executors as needed.
+    """
     # encoded program
     cdef int* prog
     cdef unsigned int prog_len
-    # instruction pointer
-    cdef unsigned int ip
-    # inbox
-    cdef int* inbox
-    cdef unsigned int inbox_pos
-    cdef unsigned int inbox_len
-    # outbox
-    cdef int* outbox
-    cdef unsigned int outbox_pos
-    # registers
-    cdef int* tiles
-    cdef bint* tiles_used
-    # hands
-    cdef int hands
-    cdef bint hands_used
+    # encoded program with fused operations, as executed by HRMX
+    cdef int* code
+    # threaded jumps, indexed by address, NULL if there is none
+    cdef Thread* threads
+    # summaries of counting loops, see _loops
+    cdef int* loops
+    cdef unsigned int loops_len
+    cdef unsigned int* loop_at
+    # code specialised for various initial states, see _variant
+    cdef dict variants
     # info about programm (labels => addr, addr => original op, addr => source line number)
     cdef readonly frozendict labels, source, lineno
     # inverse of labels
     cdef dict labels_inv
+    # native code compiled by hrm.aot, NULL if none is loaded
+    cdef NativeRun native
 
-    def __cinit__(self, prog=None, labels=None, unsigned int capacity=512):
-        self.capacity = capacity
-        self.prog = <int*> malloc(capacity * sizeof(int))
-        self.inbox = <int*> malloc(capacity * sizeof(int))
-        self.outbox = <int*> malloc(capacity * sizeof(int))
-        self.tiles = <int*> malloc(capacity * sizeof(int))
-        self.tiles_used = <bint*> malloc(capacity * sizeof(bint))
+    def __cinit__(self, *args, **kargs):
+        self.prog = NULL
+        self.prog_len = 0
+        self.code = NULL
+        self.threads = NULL
+        self.loops = NULL
+        self.loops_len = 0
+        self.loop_at = NULL
+        self.variants = {}
+        self.native = NULL
         self.labels = frozendict()
         self.labels_inv = {}
         self.source = frozendict()
         self.lineno = frozendict()
-        self.prog_len = self.ip = 0
-        self.inbox_len = self.inbox_pos = self.outbox_pos = 0
 
-    cpdef HRMX copy(self):
-        "Copy an HRMX instance."
-        copy = HRMX(capacity=self.capacity)
-        memcpy(copy.prog, self.prog, self.prog_len * sizeof(int))
-        copy.prog_len = self.prog_len
-        copy.ip = self.ip
-        memcpy(copy.inbox, self.inbox, self.inbox_len * sizeof(int))
-        copy.inbox_pos = self.inbox_pos
-        copy.inbox_len = self.inbox_len
-        memcpy(copy.outbox, self.outbox, self.outbox_pos * sizeof(int))
-        copy.outbox_pos = self.outbox_pos
-        memcpy(copy.tiles, self.tiles, self.capacity * sizeof(int))
-        memcpy(copy.tiles_used, self.tiles_used, self.capacity * sizeof(bint))
-        copy.hands = self.hands
-        copy.hands_used = self.hands_used
-        copy.labels.d.update(self.labels.d)
-        copy.source.d.update(self.source.d)
-        copy.lineno.d.update(self.lineno.d)
-        copy.labels_inv.update(self.labels_inv)
-        return copy
+    def __init__(self, prog=None, labels=None):
+        """Encode a program
+
+        Arguments:
+         - `prog: list = None`: program as returned by the parser
+         - `labels: dict = None`: labels positions in the program, as returned by the parser
+        """
+        if prog is not None:
+            self._load(prog, labels)
+        elif labels is not None:
+            raise ValueError("unexpected argument 'labels' when 'prog' is None")
 
     def __dealloc__(self):
         free(self.prog)
-        free(self.inbox)
-        free(self.outbox)
-        free(self.tiles)
-        free(self.tiles_used)
+        free(self.code)
+        free(self.threads)
+        free(self.loops)
+        free(self.loop_at)
+
+    def __len__(self):
+        return self.prog_len
 
     @classmethod
-    def parse(cls, src, unsigned int capacity=512):
-        """Create an HRMX instance from parsed source.
+    def parse(cls, src, cache=False):
+        """Create a Program instance from parsed source.
 
         Arguments:
          - `src`: program source as expected by parser
-         - `capacity: int = 512`: like for `__init__`
+         - `cache: str | bool = False`: directory where parsed and encoded
+           programs are cached, `True` for the default one, or `False` to
+           disable caching (see `hrm.cache`)
 
-        Return: a new HRMX instance
+        Return: a new Program instance
         """
-        return cls(*hrmparse(src), capacity)
+        if not cache:
+            return cls(*hrmparse(src))
+        from .cache import parse
+        return cls.cached(*parse(src, cache), cache)
 
-    def __init__(self, prog=None, labels=None, unsigned int capacity=512):
-        """Create a new HRM executor
+    @classmethod
+    def cached(cls, prog, labels, key, cache=True):
+        """Create a Program instance, reusing its cached encoding
 
-        If `prog` and `labels` are passed, the program is directly loaded,
-        otherwise method `load` has to be used to do so.
+        The counting loops, that are costly to find, are loaded from the
+        cache if they are there, otherwise the program is fully encoded and
+        stored into the cache. The encoding is stored along with a signature
+        of `HRMX` opcodes, so that it is never reused by a different version
+        of `HRMX`, and the rest of it (fused operations, threaded jumps) is
+        computed again and compared with the cached one, while the loops
+        are checked to refer only to existing operations and tiles, so that
+        altered cache files are not used.
 
         Arguments:
-         - `prog: list = None`: program as returned by the parser
-         - `labels: dict = None`: labels positions in the program, as returned by the parser
-         - `capacity: int = 512`: memories sizes (inbox, outbox, program, registers)
+         - `prog: list`: program as returned by the parser
+         - `labels: dict`: labels positions in the program, as returned by the parser
+         - `key: str`: key of the program in the cache, see `hrm.cache.parse`
+         - `cache: str | bool = True`: cache directory, `True` for the default one
+
+        Return: a new Program instance
         """
-        if prog is not None:
-            self.load(prog, labels)
-        elif labels is not None:
-            raise ValueError("unexpected argument 'labels' when 'prog' is None")
+        cdef Program new = cls()
+        cdef bint restored
+        from .cache import load, save
+        data = load(f"x{ENCODING}", key, cache)
+        restored = new._load(prog, labels, data)
+        if not restored:
+            # the cache is only an optimisation, it may not be writable
+            try:
+                save(f"x{ENCODING}", key, new._dump(), cache)
+            except OSError:
+                pass
+        return new
 
-    cpdef unsigned int load(self, prog, labels):
-        """Load a program into the executor
+    cdef bytes _dump(self):
+        # encoding of the program, restored by _restore, as a sequence of
+        # ints: prog_len, prog and code, then either 0 or 1 followed by
+        # (target, count, last) for each address in threads, loops_len and
+        # loops, and either 0 or 1 followed by loop_at
+        cdef unsigned int i, n = self.prog_len
+        cdef list flat = [n]
+        flat.extend([self.prog[i] for i in range(n)])
+        flat.extend([self.code[i] for i in range(n)])
+        if self.threads == NULL:
+            flat.append(0)
+        else:
+            flat.append(1)
+            for i in range(n):
+                flat.extend([self.threads[i].target, self.threads[i].count,
+                             self.threads[i].last])
+        flat.append(self.loops_len)
+        flat.extend([self.loops[i] for i in range(self.loops_len)])
+        if self.loop_at == NULL:
+            flat.append(0)
+        else:
+            flat.append(1)
+            flat.extend([self.loop_at[i] for i in range(n)])
+        return array.array("i", flat).tobytes()
 
-        Arguments:
-         - `prog: list = None`: program as returned by the parser
-         - `labels: dict = None`: labels positions in the program, as returned by the parser
+    cdef bint _restore(self, bytes data) except *:
+        # restore the counting loops from the encoding dumped by _dump if it
+        # is valid and matches prog, code and threads, that have already
+        # been computed, returning whether it is the case
+        cdef unsigned int i, n = self.prog_len
+        cdef Py_ssize_t pos = 2 * n + 1
+        flat = array.array("i")
+        if len(data) % flat.itemsize:
+            return False
+        flat.frombytes(data)
+        if len(flat) < pos + 1 or flat[0] != n \
+                or any(flat[i + 1] != self.prog[i] for i in range(n)) \
+                or any(flat[n + 1 + i] != self.code[i] for i in range(n)) \
+                or flat[pos] != (self.threads != NULL):
+            return False
+        if self.threads != NULL:
+            if len(flat) < pos + 1 + 3 * n or any(
+                    flat[pos + 1 + 3 * i:pos + 4 + 3 * i]
+                    != array.array("i", [self.threads[i].target,
+                                         self.threads[i].count,
+                                         self.threads[i].last])
+                    for i in range(n)):
+                return False
+            pos += 3 * n
+        pos += 1
+        loop_at = None
+        if len(flat) < pos + 1 or flat[pos] < 0:
+            return False
+        loops = flat[pos + 1:pos + 1 + flat[pos]]
+        pos += flat[pos] + 1
+        if len(flat) > pos and flat[pos] == 1:
+            loop_at = flat[pos + 1:pos + 1 + n]
+            pos += n
+        if len(flat) != pos + 1 \
+                or (loop_at is not None and (len(loop_at) != n or
+                                             not valid_loops(loops, loop_at,
+                                                             self.source.d))):
+            return False
+        if loops:
+            self.loops = <int*> malloc(len(loops) * sizeof(int))
+            if self.loops == NULL:
+                raise MemoryError()
+            for i in range(len(loops)):
+                self.loops[i] = loops[i]
+            self.loops_len = len(loops)
+        if loop_at is not None:
+            self.loop_at = <unsigned int*> calloc(n, sizeof(unsigned int))
+            if self.loop_at == NULL:
+                raise MemoryError()
+            for i in range(n):
+                self.loop_at[i] = loop_at[i]
+        return True
 
-        Return: the length of the loaded program, after encoding
-        """
+    cdef bint _load(self, prog, labels, bytes encoded=None) except *:
+        # encode prog, or restore its encoding from encoded if possible, in
+        # which case True is returned
         cdef unsigned int n
         cdef unsigned int p = 0
         cdef dict lbls = {}
@@ -474,21 +1341,14 @@ cdef class HRMX:
         cdef dict n2l = {}
         cdef object op, k
         cdef list args
-        if 2 * len(prog) > self.capacity:
-            # this is an over approximation but should be DONE in general
-            raise ValueError("program too long")
         for k, n in labels.items():
             if n not in n2l:
                 n2l[n] = [k]
             else:
-                n2l.append(k)
-        self.ip = 0
-        self.inbox_pos = self.inbox_len = 0
-        self.outbox_pos = 0
-        self.labels.d.clear()
-        self.labels_inv.clear()
-        self.source.d.clear()
-        self.lineno.d.clear()
+                n2l[n].append(k)
+        self.prog = <int*> malloc(max(1, 2 * len(prog)) * sizeof(int))
+        if self.prog == NULL:
+            raise MemoryError()
         for n, (op, *args) in enumerate(prog):
             addr[n] = p
             self.lineno.d[p] = op.lineno
@@ -514,152 +1374,208 @@ cdef class HRMX:
             else:
                 raise ValueError("invalid program")
         self.prog_len = addr[len(prog)] = p
+        for k in n2l.get(len(prog), []):
+            self.labels.d[k] = p
+            self.labels_inv[p] = k
         for p, k in lbls.items():
             self.prog[p] = self.labels.d[k]
-        return self.prog_len
+        self._thread()
+        self.code = self._encode(set())
+        if encoded is not None and self._restore(encoded):
+            return True
+        self._loops()
+        return False
 
-    cpdef void boot(self, inbox, tiles=[]):
-        """Start the executor with a given context
+    cdef void _thread(self) except *:
+        # find the jumps to chains of unconditional jumps, that may be
+        # threaded to directly jump to the end of the chain
+        cdef unsigned int a, t, count, last
+        cdef set seen
+        for a in sorted(self.source.d):
+            if self.prog[a] not in (Op.JUMP, Op.JUMPZ, Op.JUMPN) \
+                    or a + 1 >= self.prog_len:
+                continue
+            t, count, last, seen = self.prog[a+1], 1, a, {a}
+            while (t in self.source.d and self.prog[t] == Op.JUMP
+                   and t + 1 < self.prog_len and t not in seen):
+                seen.add(t)
+                t, count, last = self.prog[t+1], count + 1, t
+            if count > 1:
+                if self.threads == NULL:
+                    self.threads = <Thread*> calloc(self.prog_len, sizeof(Thread))
+                    if self.threads == NULL:
+                        raise MemoryError()
+                self.threads[a].target = t
+                self.threads[a].count = count
+                self.threads[a].last = last
 
-        Arguments:
-         - `inbox: list`: inbox to be processed
-         - `tiles: list = []`: initial content of the registers,
-           with `None` where a tile has to be left empty
-        """
+    cdef void _loops(self) except *:
+        # encode the counting loops found by hrm.analysis.loops, in loops,
+        # as a sequence of ints for each loop:
+        #  - steps, last, exit, top, the number of read variables and these
+        #  - the linear expressions test and dtest
+        #  - the number of values, and each as a pair of expressions
+        #  - the number of deltas, and each as a variable and an expression
+        # a linear expression being encoded as its constant, its number
+        # of terms, and a pair (variable, coefficient) for each term,
+        # loop_at[a] being 1 plus the position of the loop whose head is a
+        # in loops, or 0 if there is none
+        cdef list flat = []
         cdef unsigned int i
-        cdef int v
-        cdef object t
-        if self.prog_len == 0:
-            raise ValueError("no program loaded")
-        if len(inbox) > self.capacity:
-            raise ValueError("inbox too large")
-        if len(tiles) > self.capacity:
-            raise ValueError("too many tiles")
-        for i in range(self.capacity):
-            self.tiles_used[i] = False
-        self.hands_used = False
-        for i, v in enumerate(inbox):
-            self.inbox[i] = v
-        self.inbox_len = len(inbox)
-        for i, t in enumerate(tiles):
-            if t is not None:
-                self.tiles[i] = t
-                self.tiles_used[i] = True
-        self.ip = self.inbox_pos = self.outbox_pos = 0
+        from .analysis import loops
+        found = loops(self)
+        if not found:
+            return
 
-    def __call__(self, inbox=None, tiles=[], unsigned int maxsteps=1024):
-        """Execute a program
+        def put(expr):
+            terms = [(v, c) for v, c in expr.items() if v is not None]
+            flat.extend([expr.get(None, 0), len(terms)])
+            for term in terms:
+                flat.extend(term)
+
+        self.loop_at = <unsigned int*> calloc(self.prog_len, sizeof(unsigned int))
+        if self.loop_at == NULL:
+            raise MemoryError()
+        for head, (steps, last, exit, top, read, test, dtest,
+                   values, deltas) in found.items():
+            self.loop_at[head] = len(flat) + 1
+            flat.extend([steps, last, exits[exit], top, len(read), *read])
+            put(test)
+            put(dtest)
+            flat.append(len(values))
+            for value, change in values:
+                put(value)
+                put(change)
+            flat.append(len(deltas))
+            for var, delta in deltas:
+                flat.append(var)
+                put(delta)
+        self.loops = <int*> malloc(len(flat) * sizeof(int))
+        if self.loops == NULL:
+            raise MemoryError()
+        for i in range(len(flat)):
+            self.loops[i] = flat[i]
+        self.loops_len = len(flat)
+
+    cdef int* _encode(self, set unchecked) except NULL:
+        # build the code executed by HRMX from self.prog:
+        #  - the opcode of the first operation of common pairs is replaced
+        #    with a fused operation, the second one being left as is, so it
+        #    can still be jumped to or executed alone
+        #  - the remaining jumps to chains of jumps are threaded
+        #  - the remaining operations at the addresses in unchecked are
+        #    replaced with their unchecked version
+        # saving a dispatch being more profitable than saving checks
+        cdef unsigned int a, b
+        cdef list addrs = sorted(self.source.d)
+        cdef int* code = <int*> malloc(max(1, self.prog_len) * sizeof(int))
+        if code == NULL:
+            raise MemoryError()
+        memcpy(code, self.prog, self.prog_len * sizeof(int))
+        for a, b in zip(addrs, addrs[1:]):
+            if b == a + (1 if opspec[self.prog[a]][1] == ArgSpec.NONE else 2):
+                code[a] = opfuse.get((self.prog[a], self.prog[b]), self.prog[a])
+        if self.threads != NULL:
+            for a in addrs:
+                if code[a] == self.prog[a] and self.threads[a].count > 1:
+                    code[a] = opthread[code[a]]
+        for a in unchecked:
+            if code[a] == self.prog[a]:
+                code[a] = opunchecked[self.prog[a]]
+        return code
+
+    cdef Code _variant(self, tuple key):
+        # code specialised for an initial state described by key, that is
+        # (floor, chars, capacity) as expected by hrm.analysis.unchecked,
+        # or None if it is the same as code
+        cdef Code variant = None
+        if key in self.variants:
+            return self.variants[key]
+        from .analysis import unchecked
+        addrs = unchecked(self, *key)
+        if addrs:
+            variant = Code()
+            variant.code = self._encode(addrs)
+        # executors sharing the program may have computed the same variant
+        # concurrently (the GIL may be released meanwhile), the first one
+        # stored is kept so that the code they run is never freed
+        return self.variants.setdefault(key, variant)
+
+    def aot(self, cache=None, cc=None):
+        """Compile the program to native code.
+
+        The program is translated to C by `hrm.aot`, compiled with the system
+        C compiler into a cached shared object, and loaded. From then on, the
+        executors running this program use the native code instead of the
+        interpreter, except when profiling.
 
-        If not `inbox` is provided, method `boot` has to be called.
-        The program is executed until its end, or `maxsteps` operations have been
-        executed.
-        
         Arguments:
-         - `inbox: list[int] | None = None`: if not `None`, `inbox` is passed to `boot`
-         - `tiles: list[int | None] = []`: is `inbox` is not `None`, `tiles` is also passed to `boot`
-         - `maxsteps: int = 1024`: maximum number of operations that can be executed
+         - `cache: str = None`: directory where shared objects are cached,
+           see `hrm.aot.build`
+         - `cc: str = None`: C compiler to be used, see `hrm.aot.build`
 
-        Return: produced outbox if program executes to its end, or raise `HRMProgramError`
-        if `maxsteps` is reached (or another error occurred).
+        Return: the path of the loaded shared object
         """
-        cdef unsigned int i, ip
-        cdef Stop stop
-        if self.prog_len == 0:
-            raise ValueError("no program loaded")
-        if inbox is not None:
-            self.boot(inbox, tiles)
-        if self.inbox_len == 0:
-            raise ValueError("no inbox given")
-        with nogil:
-            for i in range(maxsteps):
-                ip = self.ip
-                stop = step(self)
-                if stop != Stop.STEPS:
-                    break
-            else:
-                stop = Stop.STEPS
-        if stop == Stop.DONE:
-            return [self.outbox[i] for i in range(self.outbox_pos)]
-        else:
-            raise self._err(stop, ip)
+        from .aot import build
+        path = build(self, cache, cc)
+        self.native = native_load(path)
+        return path
 
-    def __iter__(self):
-        """Execute a programm op-by-op
+    @property
+    def native(self):
+        "Whether native code has been loaded for the program"
+        return self.native != NULL
 
-        Every executed operation is yield as a tuple with:
-         - `name: str`: operation name
-         - `arg: None | int | list[int] | str`: operation argument
-         - `hands: None | int`: value held by worked after the operation is executed
-        """
-        cdef Stop stop
-        cdef unsigned int ip
-        cdef object hands
-        if self.prog_len == 0:
-            raise ValueError("no program loaded")
-        if self.inbox_len == 0:
-            raise ValueError("no inbox given")
-        while True:
-            ip = self.ip
-            stop = step(self)
-            hands = self.hands if self.hands_used else None
-            if stop == Stop.DONE:
-                yield ip, self.lineno[ip], *self.source[ip], hands
-                return
-            elif stop == Stop.STEPS:
-                yield ip, self.lineno[ip], *self.source[ip], hands
-            else:
-                raise self._err(stop, ip)
-
-    cdef object _err(self, stop, ip):
-        cdef int i
-        for i in reversed(range(ip+1)):
-            if i in self.source:
-                return HRMProgramError(stop, self.source[i][0])
-        return HRMProgramError(stop)
-
-    @property
-    def outbox(self):
-        """The produced outbox so far
-        
-        If the program is not fully executed, its outbox may not be complete.
-        """
-        cdef unsigned int i
-        return [self.outbox[i] for i in range(self.outbox_pos)]
-
-    cpdef void patch(self, dict patch):
-        """Replace instructions in the program.
-
-        Arguments:
-         - `patch: dict`: map addresses to new instructions given as token lists
+    cpdef Program patch(self, dict patch):
+        """Replace instructions in the program.
+
+        Arguments:
+         - `patch: dict`: map addresses to new instructions given as token lists
+
+        Return: a new Program instance, the patched one being left unchanged
         """
         cdef unsigned int p
         cdef object op, a
         cdef list args
         cdef str instr
+        cdef Program new = Program()
+        new.prog = <int*> malloc(max(1, self.prog_len) * sizeof(int))
+        if new.prog == NULL:
+            raise MemoryError()
+        memcpy(new.prog, self.prog, self.prog_len * sizeof(int))
+        new.prog_len = self.prog_len
+        new.labels = self.labels
+        new.labels_inv = self.labels_inv
+        new.lineno = self.lineno
+        new.source.d.update(self.source.d)
         for p, (op, *args) in patch.items():
-            if p not in self.source.d:
+            if p not in new.source.d:
                 raise ValueError(f"invalid program address: {p}")
             if not args:
-                self.source.d[p] = (op, None)
-                self.prog[p] = opop[op]
+                new.source.d[p] = (op, None)
+                new.prog[p] = opop[op]
             elif isinstance(args[0], str):
-                self.source.d[p] = (op, args[0])
-                self.prog[p] = opop[op]
-                self.prog[p+1] = self.labels.d[args[0]]
+                new.source.d[p] = (op, args[0])
+                new.prog[p] = opop[op]
+                new.prog[p+1] = self.labels.d[args[0]]
             elif isinstance(args[0], int):
-                self.source.d[p] = (op, args[0])
-                self.prog[p] = opop[op][0]
-                self.prog[p+1] = args[0]
+                new.source.d[p] = (op, args[0])
+                new.prog[p] = opop[op][0]
+                new.prog[p+1] = args[0]
             elif isinstance(args[0], list):
-                self.source.d[p] = (op, args[0])
-                self.prog[p] = opop[op][1]
-                self.prog[p+1] = args[0][0]
+                new.source.d[p] = (op, args[0])
+                new.prog[p] = opop[op][1]
+                new.prog[p+1] = args[0][0]
             else:
                 if isinstance(op, Tok):
                     instr = op.line
                 else:
                     instr = f"{op} " + " ".join([str(a) for a in args])
                 raise ValueError(f"invalid instruction: {instr}")
+        new._thread()
+        new._loops()
+        new.code = new._encode(set())
+        return new
 
     cpdef tuple decode(self, unsigned int addr):
         """Decode a single instuction.
@@ -687,6 +1603,1189 @@ cdef class HRMX:
         elif spec == ArgSpec.LABEL:
             return a2l.get(addr, None), mnemo, a2l[self.prog[addr+1]]
 
+#
+# main class
+#
+
+cdef class HRMX:
+    # number of tiles
+    cdef unsigned int capacity
+    # maximum length of the outbox
+    cdef unsigned int max_outbox
+    # encoded program, borrowed from self.program or from self.variant
+    cdef readonly Program program
+    cdef Code variant
+    cdef int* prog
+    cdef unsigned int prog_len
+    # encoded program without fused operations, borrowed from self.program
+    cdef int* orig
+    # threaded jumps, borrowed from self.program
+    cdef Thread* threads
+    # counting loops, borrowed from self.program
+    cdef const int* loops
+    cdef const unsigned int* loop_at
+    # kinds of the initial tiles, as pairs (tile number, kind)
+    cdef tuple floor
+    # floor and chars for which the code variant in use has been looked up,
+    # or None, see _specialise
+    cdef tuple specialised
+    # whether an execution has been started, by boot or restore
+    cdef bint booted
+    # instruction pointer
+    cdef unsigned int ip
+    # inbox
+    cdef int* inbox
+    cdef unsigned char* inbox_kind
+    cdef unsigned int inbox_pos
+    cdef unsigned int inbox_len
+    cdef unsigned int inbox_size
+    # outbox, grown by grow_outbox
+    cdef int* outbox
+    cdef unsigned char* outbox_kind
+    cdef unsigned int outbox_pos
+    cdef unsigned int outbox_size
+    # registers, a tile is used iff its epoch is that of the current run
+    cdef int* tiles
+    cdef unsigned char* tiles_kind
+    cdef unsigned int* tiles_epoch
+    cdef unsigned int epoch
+    # tiles from tiles_top on have not been used during the current run
+    cdef unsigned int tiles_top
+    # hands
+    cdef int hands
+    cdef unsigned char hands_kind
+    # wait for more input instead of stopping when the inbox is empty
+    cdef bint hold
+    # wait for the outbox to be drained instead of growing it when full
+    cdef bint drain
+    # expected outbox, checked by outbox operations if expecting is set
+    cdef bint expecting
+    cdef const int* expect
+    cdef const unsigned char* expect_kind
+    cdef unsigned int expect_len
+    # profiling counters indexed by address, NULL if profiling is disabled
+    cdef unsigned long long* hits
+    cdef unsigned long long* taken
+    cdef array.array hits_array
+    cdef array.array taken_array
+    # infinite loops detection, see detect and looping
+    cdef bint detecting
+    cdef bint cyc_saved
+    cdef unsigned long long cyc_power
+    cdef unsigned long long cyc_lam
+    # saved execution state, with Kind.NOTHING for the empty tiles
+    cdef unsigned int cyc_ip
+    cdef int cyc_hands
+    cdef unsigned char cyc_hands_kind
+    cdef unsigned int cyc_inbox_pos
+    cdef unsigned int cyc_inbox_len
+    cdef unsigned int cyc_outbox_pos
+    cdef unsigned int cyc_top
+    cdef int* cyc_tiles
+    cdef unsigned char* cyc_kind
+
+    def __cinit__(self, prog=None, labels=None, unsigned int capacity=512,
+                  max_outbox=None):
+        self.capacity = capacity
+        self.max_outbox = capacity if max_outbox is None else max_outbox
+        self.inbox = <int*> malloc(BOX_SIZE * sizeof(int))
+        self.inbox_kind = <unsigned char*> malloc(BOX_SIZE * sizeof(unsigned char))
+        self.inbox_size = BOX_SIZE
+        self.outbox = <int*> malloc(BOX_SIZE * sizeof(int))
+        self.outbox_kind = <unsigned char*> malloc(BOX_SIZE * sizeof(unsigned char))
+        # only the first max_outbox slots are used, so that the limit holds
+        # even below the initial size
+        self.outbox_size = min(BOX_SIZE, self.max_outbox)
+        self.tiles = <int*> malloc(capacity * sizeof(int))
+        self.tiles_kind = <unsigned char*> malloc(capacity * sizeof(unsigned char))
+        self.tiles_epoch = <unsigned int*> calloc(capacity, sizeof(unsigned int))
+        self.epoch = 1
+        self.tiles_top = 0
+        self.hands_kind = Kind.NOTHING
+        self.hold = self.drain = False
+        self.expecting = False
+        self.hits = self.taken = NULL
+        self.detecting = False
+        self.cyc_tiles = NULL
+        self.cyc_kind = NULL
+        self._forget()
+        self.floor = ()
+        self.booted = False
+        self._set_program(Program())
+        self.ip = 0
+        self.inbox_len = self.inbox_pos = self.outbox_pos = 0
+
+    cdef void _set_program(self, Program program):
+        if program is not self.program and self.hits != NULL:
+            self._profile(program.prog_len)
+        self.program = program
+        self.variant = None
+        self.specialised = None
+        self.prog = program.code
+        self.orig = program.prog
+        self.threads = program.threads
+        self.loops = program.loops
+        self.loop_at = program.loop_at
+        self.prog_len = program.prog_len
+
+    cdef void _profile(self, unsigned int size):
+        # zeroed counters for a program of the given size
+        self.hits_array = array.array("Q", [0]) * size
+        self.taken_array = array.array("Q", [0]) * size
+        self.hits = self.hits_array.data.as_ulonglongs
+        self.taken = self.taken_array.data.as_ulonglongs
+
+    cpdef void profile(self, bint enable=True):
+        """Enable or disable profiling.
+
+        When profiling is enabled, every executed operation is counted in
+        `hits`, and every jump that is actually taken is counted in `taken`.
+        Counters are accumulated over runs, enabling profiling again resets
+        them, as does changing the program.
+
+        Arguments:
+         - `enable: bool = True`: whether profiling is enabled or disabled
+        """
+        if enable:
+            self._profile(self.prog_len)
+        else:
+            self.hits = self.taken = NULL
+            self.hits_array = self.taken_array = None
+
+    cpdef void detect(self, bint enable=True) except *:
+        """Enable or disable the detection of infinite loops.
+
+        When detection is enabled, every time the execution jumps backward,
+        its state (position, hands, tiles, inbox and outbox positions) is
+        compared to a state saved earlier, following Brent's algorithm. If
+        they are the same, the program would loop forever, so it is stopped
+        at once with errno `CYCLE`, instead of running until `maxsteps`.
+        Native code is not used while detection is enabled.
+
+        Arguments:
+         - `enable: bool = True`: whether detection is enabled or disabled
+        """
+        if enable and self.cyc_tiles == NULL:
+            self.cyc_tiles = <int*> malloc(max(1, self.capacity) * sizeof(int))
+            self.cyc_kind = <unsigned char*> malloc(max(1, self.capacity))
+            if self.cyc_tiles == NULL or self.cyc_kind == NULL:
+                raise MemoryError()
+        self.detecting = enable
+        self._forget()
+
+    cdef inline void _forget(self) noexcept nogil:
+        # drop the state saved for infinite loops detection
+        self.cyc_saved = False
+        self.cyc_power = 1
+        self.cyc_lam = 0
+
+    @property
+    def hits(self):
+        """Profiling counters: how many times each operation was executed
+
+        This is a `memoryview` indexed by addresses (see `lineno` to map them
+        to source lines), or `None` if profiling is disabled.
+        """
+        if self.hits_array is not None:
+            return memoryview(self.hits_array)
+
+    @property
+    def taken(self):
+        """Profiling counters: how many times each jump was taken
+
+        Like `hits` but only counting jumps to their targets.
+        """
+        if self.taken_array is not None:
+            return memoryview(self.taken_array)
+
+    def profile_lines(self):
+        """Profiling counters mapped back to the source lines.
+
+        Return: a `dict` that maps the line numbers of every operation to a
+        pair `(hits, taken)` as counted for this operation
+        """
+        if self.hits_array is None:
+            raise ValueError("profiling is disabled")
+        return {self.program.lineno[addr]: (self.hits[addr], self.taken[addr])
+                for addr in self.program.lineno}
+
+    cpdef HRMX copy(self):
+        """Copy an HRMX instance.
+
+        The copy shares its program with the original instance, only the
+        execution state is actually copied.
+        """
+        copy = HRMX(self.program, capacity=self.capacity,
+                    max_outbox=self.max_outbox)
+        if self.hits != NULL:
+            copy.profile()
+        if self.detecting:
+            copy.detect()
+        copy._assign(self)
+        return copy
+
+    cpdef HRMX snapshot(self):
+        """Save the execution state.
+
+        Return: an HRMX instance holding a copy of the current state, that
+        may be passed later to `restore`
+        """
+        return self.copy()
+
+    cpdef HRMX fork(self):
+        """Fork the execution.
+
+        Return: an HRMX instance that continues the execution from the
+        current state, independently of this instance
+        """
+        return self.copy()
+
+    cpdef void restore(self, HRMX snapshot) except *:
+        """Restore an execution state saved by `snapshot`.
+
+        Arguments:
+         - `snapshot: HRMX`: the instance whose state is copied
+        """
+        if (snapshot.outbox_pos > self.max_outbox
+                or snapshot.tiles_top > self.capacity):
+            raise ValueError("snapshot does not fit into capacity")
+        self._assign(snapshot)
+
+    cdef void _assign(self, HRMX other) except *:
+        # copy the state of other, tiles are copied into a new epoch so that
+        # only those below other.tiles_top have to be considered
+        cdef unsigned int i
+        self._fit_inbox(other.inbox_len)
+        if other.outbox_pos > self.outbox_size:
+            if not resize_box(&self.outbox, &self.outbox_kind, other.outbox_pos):
+                raise MemoryError()
+            self.outbox_size = other.outbox_pos
+        self._set_program(other.program)
+        self.ip = other.ip
+        memcpy(self.inbox, other.inbox, other.inbox_len * sizeof(int))
+        memcpy(self.inbox_kind, other.inbox_kind, other.inbox_len)
+        self.inbox_pos = other.inbox_pos
+        self.inbox_len = other.inbox_len
+        memcpy(self.outbox, other.outbox, other.outbox_pos * sizeof(int))
+        memcpy(self.outbox_kind, other.outbox_kind, other.outbox_pos)
+        self.outbox_pos = other.outbox_pos
+        self._new_epoch()
+        for i in range(other.tiles_top):
+            if other.tiles_epoch[i] == other.epoch:
+                self.tiles[i] = other.tiles[i]
+                self.tiles_kind[i] = other.tiles_kind[i]
+                self.tiles_epoch[i] = self.epoch
+        self.tiles_top = other.tiles_top
+        self.hands = other.hands
+        self.hands_kind = other.hands_kind
+        self.hold = other.hold
+        self.drain = other.drain
+        self.floor = other.floor
+        self.booted = other.booted
+        self._forget()
+        if self.capacity == other.capacity:
+            self.variant = other.variant
+            self.prog = other.prog
+            self.specialised = other.specialised
+
+    def __dealloc__(self):
+        free(self.inbox)
+        free(self.inbox_kind)
+        free(self.outbox)
+        free(self.outbox_kind)
+        free(self.tiles)
+        free(self.tiles_kind)
+        free(self.tiles_epoch)
+        free(self.cyc_tiles)
+        free(self.cyc_kind)
+
+    @classmethod
+    def parse(cls, src, unsigned int capacity=512, max_outbox=None,
+              cache=False):
+        """Create an HRMX instance from parsed source.
+
+        Arguments:
+         - `src`: program source as expected by parser
+         - `capacity: int = 512`: like for `__init__`
+         - `max_outbox: int | None = None`: like for `__init__`
+         - `cache: str | bool = False`: like for `Program.parse`
+
+        Return: a new HRMX instance
+        """
+        if cache:
+            return cls(Program.parse(src, cache), None, capacity, max_outbox)
+        return cls(*hrmparse(src), capacity, max_outbox)
+
+    def __init__(self, prog=None, labels=None, unsigned int capacity=512,
+                 max_outbox=None):
+        """Create a new HRM executor
+
+        If `prog` and `labels` are passed, the program is directly loaded,
+        otherwise method `load` has to be used to do so. If `prog` is a
+        `Program` instance, it is used (and shared) as is.
+
+        Arguments:
+         - `prog: list | Program = None`: program as returned by the parser
+         - `labels: dict = None`: labels positions in the program, as returned by the parser
+         - `capacity: int = 512`: number of registers
+         - `max_outbox: int | None = None`: maximum length of the outbox,
+           defaulting to `capacity`, beyond which the execution stops with
+           errno `CAPACITY`
+
+        The inbox and outbox are allocated on demand, so that their memory
+        follows their actual lengths.
+        """
+        if isinstance(prog, Program):
+            if labels is not None:
+                raise ValueError("unexpected argument 'labels' with a Program")
+            self._set_program(prog)
+        elif prog is not None:
+            self.load(prog, labels)
+        elif labels is not None:
+            raise ValueError("unexpected argument 'labels' when 'prog' is None")
+
+    @property
+    def labels(self):
+        "Labels positions in the encoded program"
+        return self.program.labels
+
+    @property
+    def source(self):
+        "Original operation at each address of the encoded program"
+        return self.program.source
+
+    @property
+    def lineno(self):
+        "Source line number of each address of the encoded program"
+        return self.program.lineno
+
+    cpdef unsigned int load(self, prog, labels):
+        """Load a program into the executor
+
+        Arguments:
+         - `prog: list = None`: program as returned by the parser
+         - `labels: dict = None`: labels positions in the program, as returned by the parser
+
+        Return: the length of the loaded program, after encoding
+        """
+        self._set_program(Program(prog, labels))
+        self.ip = 0
+        self.inbox_pos = self.inbox_len = 0
+        self.outbox_pos = 0
+        return self.prog_len
+
+    cpdef void boot(self, inbox, tiles=[]):
+        """Start the executor with a given context
+
+        Both `inbox` and `tiles` may also be given as contiguous buffers of
+        C `int` (`array("i")`, NumPy arrays of dtype `intc`, `memoryview`,
+        etc.), holding only numbers, that are copied at once without
+        converting their items to Python objects.
+
+        Arguments:
+         - `inbox: list | buffer`: inbox to be processed, with integers or letters
+         - `tiles: list | dict | buffer = []`: initial content of the registers,
+           with `None` where a tile has to be left empty, or as a `dict`
+           that maps tile numbers to values
+        """
+        cdef unsigned int i, used = 0
+        cdef object v
+        cdef bint chars = False
+        cdef const int[::1] buf
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        self._fit_inbox(len(inbox))
+        self._reset()
+        if is_buffer(inbox):
+            buf = inbox
+            if len(buf) > 0:
+                memcpy(self.inbox, &buf[0], len(buf) * sizeof(int))
+                memset(self.inbox_kind, Kind.NUM, len(buf))
+        else:
+            for i, v in enumerate(inbox):
+                encode(v, &self.inbox[i], &self.inbox_kind[i])
+                chars = chars or self.inbox_kind[i] == Kind.CHAR
+        self.inbox_len = len(inbox)
+        if is_buffer(tiles):
+            buf = tiles
+            if len(buf) > self.capacity:
+                raise ValueError("too many tiles")
+            if len(buf) > 0:
+                memcpy(self.tiles, &buf[0], len(buf) * sizeof(int))
+                memset(self.tiles_kind, Kind.NUM, len(buf))
+                self.tiles_top = len(buf)
+            for i in range(len(buf)):
+                self.tiles_epoch[i] = self.epoch
+            used = len(buf)
+        else:
+            for i, v in floor_items(tiles):
+                if i >= self.capacity:
+                    raise ValueError("too many tiles")
+                if v is not None:
+                    encode(v, &self.tiles[i], &self.tiles_kind[i])
+                    self.tiles_epoch[i] = self.epoch
+                    if i >= self.tiles_top:
+                        self.tiles_top = i + 1
+                    used += 1
+        if not self._same_floor(used):
+            self.floor = tuple([(i, self.tiles_kind[i]) for i in range(self.tiles_top)
+                                if self.tiles_epoch[i] == self.epoch])
+        self._specialise(chars)
+        self.booted = True
+
+    cdef void _fit_inbox(self, unsigned int size) except *:
+        # grow the inbox so that it can hold at least size values
+        if size > self.inbox_size:
+            size = max(size, 2 * self.inbox_size)
+            if not resize_box(&self.inbox, &self.inbox_kind, size):
+                raise MemoryError()
+            self.inbox_size = size
+
+    cdef bint _same_floor(self, unsigned int used) except -1:
+        # whether the kinds of the used tiles just set by boot are those
+        # described by floor, that can then be kept as is
+        cdef unsigned int i
+        cdef unsigned char kind
+        if len(self.floor) != used:
+            return False
+        for i, kind in self.floor:
+            if (i >= self.tiles_top or self.tiles_epoch[i] != self.epoch
+                    or self.tiles_kind[i] != kind):
+                return False
+        return True
+
+    cdef void _specialise(self, bint chars) except *:
+        # use the code specialised for the initial tiles and for an inbox
+        # that holds letters or not, see hrm.analysis, it is looked up only
+        # when they have changed since the previous run, since boot keeps
+        # floor as is in this case
+        if (self.specialised is not None and self.specialised[0] is self.floor
+                and self.specialised[1] == chars):
+            return
+        self.variant = self.program._variant((self.floor, chars, self.capacity))
+        self.specialised = (self.floor, chars)
+        if self.variant is None:
+            self.prog = self.program.code
+        else:
+            self.prog = self.variant.code
+
+    cdef inline void _new_epoch(self) noexcept nogil:
+        # empty every tile by starting a new epoch, which is O(1) except
+        # when the epoch counter wraps around
+        self.epoch += 1
+        if self.epoch == 0:
+            memset(self.tiles_epoch, 0, self.capacity * sizeof(unsigned int))
+            self.epoch = 1
+        self.tiles_top = 0
+
+    cdef inline void _reset(self) noexcept nogil:
+        self._new_epoch()
+        self._forget()
+        self.hands_kind = Kind.NOTHING
+        self.ip = self.inbox_pos = self.outbox_pos = 0
+
+    def __call__(self, inbox=None, tiles=[], unsigned int maxsteps=1024,
+                 expected=None, out=None):
+        """Execute a program
+
+        If not `inbox` is provided, method `boot` has to be called.
+        The program is executed until its end, or `maxsteps` operations have been
+        executed. If `expected` is provided, the execution is also stopped as
+        soon as the outbox differs from it.
+        
+        Arguments:
+         - `inbox: list[int | str] | buffer | None = None`: if not `None`, `inbox` is passed to `boot`
+         - `tiles: list[int | str | None] | buffer = []`: is `inbox` is not `None`, `tiles` is also passed to `boot`
+         - `maxsteps: int = 1024`: maximum number of operations that can be executed,
+           `0` meaning no limit
+         - `expected: list[int | str] | None = None`: expected outbox, if
+           the program outputs another value, or too many or too few values,
+           `HRMProgramError` is raised with errno `MISMATCH`
+         - `out: buffer | tuple[buffer, buffer] | None = None`: if not `None`,
+           a writable buffer of C `int` where the outbox is copied instead of
+           being returned as a list, or a pair of such a buffer and a buffer
+           of `unsigned char` where the kinds of values are also copied (see
+           `Batch`), letters being otherwise copied as their code points
+
+        Return: produced outbox if program executes to its end, or its length
+        if `out` is given, or raise `HRMProgramError` if `maxsteps` is reached
+        (or another error occurred).
+        """
+        cdef unsigned int i, ip, steps
+        cdef Stop stop
+        cdef array.array exp_values, exp_kinds
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        if inbox is not None:
+            self.boot(inbox, tiles)
+        if not self.booted:
+            raise ValueError("no inbox given")
+        if expected is not None:
+            exp_values, _, exp_kinds = flatten([expected])
+            self.expecting = True
+            self.expect = exp_values.data.as_ints
+            self.expect_kind = exp_kinds.data.as_uchars
+            self.expect_len = len(exp_values)
+        with nogil:
+            stop = self._run(maxsteps, &steps, &ip)
+        self.expecting = False
+        if stop == Stop.DONE and out is not None:
+            return self._outbox_into(out)
+        elif stop == Stop.DONE:
+            return self._outbox()
+        elif stop == Stop.MISMATCH:
+            raise _error(self.program.source, stop, ip, self.outbox_pos)
+        else:
+            raise self._err(stop, ip)
+
+    def run(self, unsigned int steps=1024):
+        """Execute a slice of the program
+
+        The execution continues from the current state, as set by `boot` or
+        left by a previous call, for at most `steps` operations. Unlike with
+        `__call__`, reaching this limit is not an error but pauses the
+        execution, that may be resumed later by calling `run` again, so that
+        long runs may be interleaved with others (see `round_robin`).
+
+        Arguments:
+         - `steps: int = 1024`: maximum number of operations to be executed
+           in this slice, `0` meaning no limit
+
+        Return: `True` if the program has executed to its end, its outbox
+        being then available as `outbox`, `False` if it has been paused, or
+        raise `HRMProgramError` if an error occurred
+        """
+        cdef unsigned int done, ip
+        cdef Stop stop
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        with nogil:
+            stop = self._run(steps, &done, &ip)
+        if stop == Stop.DONE:
+            return True
+        elif stop == Stop.STEPS:
+            return False
+        raise self._err(stop, ip)
+
+    cdef Stop _native(self, unsigned int maxsteps,
+                      unsigned int* steps, unsigned int* ip) noexcept nogil:
+        # like _run but using the native code of the program, which may
+        # return Stop.NATIVE to hand over the execution to the interpreter
+        cdef NativeState state
+        cdef Stop stop
+        state.inbox = self.inbox
+        state.inbox_kind = self.inbox_kind
+        state.inbox_pos = self.inbox_pos
+        state.inbox_len = self.inbox_len
+        state.outbox = self.outbox
+        state.outbox_kind = self.outbox_kind
+        state.outbox_pos = self.outbox_pos
+        state.outbox_size = self.outbox_size
+        state.tiles = self.tiles
+        state.tiles_kind = self.tiles_kind
+        state.tiles_epoch = self.tiles_epoch
+        state.epoch = self.epoch
+        state.tiles_top = self.tiles_top
+        state.hands = self.hands
+        state.hands_kind = self.hands_kind
+        state.ip = self.ip
+        state.capacity = self.capacity
+        state.hold = self.hold
+        state.expecting = self.expecting
+        state.expect = self.expect
+        state.expect_kind = self.expect_kind
+        state.expect_len = self.expect_len
+        stop = <Stop> self.program.native(&state, maxsteps, steps, ip)
+        self.inbox_pos = state.inbox_pos
+        self.outbox_pos = state.outbox_pos
+        self.tiles_top = state.tiles_top
+        self.hands = state.hands
+        self.hands_kind = state.hands_kind
+        self.ip = state.ip
+        return stop
+
+    cdef Stop _run(self, unsigned int maxsteps,
+                   unsigned int* steps, unsigned int* ip) noexcept nogil:
+        # run at most maxsteps operations (without limit if maxsteps is 0),
+        # storing into steps how many were successfully executed, and into
+        # ip the address of the last one, if an outbox is expected, reaching
+        # the end of the program before it is complete is a mismatch
+        cdef unsigned int i = 0
+        cdef Stop stop
+        cdef bint fuse = self.hits == NULL
+        if self.program.native != NULL and fuse and not self.detecting:
+            stop = self._native(maxsteps, steps, ip)
+            if stop != Stop.NATIVE:
+                return stop
+            # otherwise the interpreter finishes the run
+            i = steps[0]
+        while maxsteps == 0 or i < maxsteps:
+            ip[0] = self.ip
+            # fused operations and threaded jumps are not executed when
+            # profiling, nor when they would exceed maxsteps
+            stop = step(self, (maxsteps - i if maxsteps else UINT_MAX) if fuse else 1)
+            if stop == Stop.STEPS:
+                if self.hits != NULL:
+                    self.hits[ip[0]] += 1
+                i += 1
+            elif stop == Stop.FUSED or stop & HALF:
+                # the first operation of a fused one was successful
+                i += 1
+                ip[0] += 1 if self.orig[ip[0]] == Op.INBOX else 2
+                if stop == Stop.FUSED:
+                    i += 1
+                    stop = Stop.STEPS
+                else:
+                    stop = <Stop> (stop - HALF)
+            elif stop == Stop.THREADED:
+                i += self.threads[ip[0]].count
+                ip[0] = self.threads[ip[0]].last
+                stop = Stop.STEPS
+            if stop == Stop.STEPS:
+                if self.ip > ip[0]:
+                    continue
+                # the execution has jumped backward, counting loops are
+                # not accelerated when profiling, like fused operations,
+                # nor when detecting infinite loops, like native code
+                if self.detecting:
+                    if looping(self):
+                        stop = Stop.CYCLE
+                    else:
+                        continue
+                else:
+                    if self.loop_at != NULL and fuse:
+                        i += accelerate(self, (maxsteps if maxsteps
+                                               else UINT_MAX) - i, ip)
+                    continue
+            if stop == Stop.CYCLE:
+                # report the operation where the state repeats
+                ip[0] = self.ip
+            steps[0] = i
+            if (stop == Stop.DONE and self.expecting
+                    and self.outbox_pos < self.expect_len):
+                return Stop.MISMATCH
+            return stop
+        steps[0] = maxsteps
+        return Stop.STEPS
+
+    def run_batch(self, inboxes, tiles=[], unsigned int maxsteps=1024,
+                  expected=None):
+        """Execute the program on many inboxes at once
+
+        All the runs are performed without holding the GIL, and the outboxes
+        are not converted to Python objects, which avoids most of the overhead
+        of calling the executor repeatedly.
+
+        Arguments:
+         - `inboxes: list[list[int | str]] | tuple[array, ...]`: the inboxes
+           to be processed, either as a list of inboxes, or as buffers
+           `(values, offsets)` where inbox `i` is `values[offsets[i]:offsets[i+1]]`,
+           optionally followed by a buffer `kinds` like in `Batch` (`values`
+           and `kinds` must be contiguous)
+         - `tiles: list[int | str | None] | buffer = []`: initial content
+           of the registers, the same for every run, like in `boot`
+         - `maxsteps: int = 1024`: maximum number of operations for each run,
+           `0` meaning no limit
+         - `expected: list[list[int | str]] | tuple[array, ...] | None = None`:
+           expected outboxes, one for each inbox, given like `inboxes`, each
+           run is stopped as soon as its outbox differs from the expected one,
+           with error `MISMATCH`, in which case its outbox in the batch ends
+           right before the mismatch
+
+        Return: a `Batch` instance holding the results of every run
+        """
+        cdef const int[::1] values
+        cdef const unsigned int[:] offsets
+        cdef const unsigned char[::1] kinds = None
+        cdef const int[::1] exp_values
+        cdef const unsigned int[:] exp_offsets
+        cdef const unsigned char[::1] exp_kinds
+        cdef bint has_kinds, has_expected = expected is not None
+        cdef unsigned int count, run, start, stop_, steps, ip, i
+        cdef unsigned int out_len = 0, out_cap = BOX_SIZE
+        cdef unsigned int longest = 0
+        cdef unsigned int init_len = 0
+        cdef bint nomem = False
+        cdef int* out
+        cdef unsigned char* out_kind
+        cdef void* more
+        cdef unsigned int* init_idx
+        cdef int* init_val
+        cdef unsigned char* init_kind
+        cdef Stop stop
+        cdef array.array res_values, res_kinds, res_offsets
+        cdef array.array res_steps, res_errors, res_ips
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        values, offsets, kinds_ = buffers(inboxes)
+        if kinds_ is not None:
+            kinds = kinds_
+        has_kinds = kinds is not None
+        if has_kinds and len(kinds) != len(values):
+            raise ValueError("values and kinds have distinct lengths")
+        count = len(offsets) - 1 if len(offsets) else 0
+        for run in range(count):
+            if offsets[run+1] < offsets[run] or offsets[run+1] > len(values):
+                raise ValueError(f"invalid offsets for inbox {run}")
+            longest = max(longest, offsets[run+1] - offsets[run])
+        if has_expected:
+            exp_values, exp_offsets, exp_kinds_ = buffers(expected)
+            if exp_kinds_ is None:
+                exp_kinds_ = array.array("B", [Kind.NUM]) * len(exp_values)
+            exp_kinds = exp_kinds_
+            if len(exp_kinds) != len(exp_values):
+                raise ValueError("expected values and kinds have distinct lengths")
+            if (len(exp_offsets) - 1 if len(exp_offsets) else 0) != count:
+                raise ValueError("not as many expected outboxes as inboxes")
+            for run in range(count):
+                if (exp_offsets[run+1] < exp_offsets[run]
+                        or exp_offsets[run+1] > len(exp_values)):
+                    raise ValueError(f"invalid offsets for expected outbox {run}")
+        self.boot([], tiles)
+        self._specialise(has_kinds and Kind.CHAR in bytes(kinds_))
+        self._fit_inbox(longest)
+        used = [i for i in range(self.tiles_top) if self.tiles_epoch[i] == self.epoch]
+        res_offsets = array.array("I", [0] * (count + 1))
+        res_steps = array.array("I", [0] * count)
+        res_errors = array.array("I", [0] * count)
+        res_ips = array.array("I", [0] * count)
+        out = <int*> malloc(out_cap * sizeof(int))
+        out_kind = <unsigned char*> malloc(out_cap * sizeof(unsigned char))
+        init_idx = <unsigned int*> malloc(max(1, len(used)) * sizeof(unsigned int))
+        init_val = <int*> malloc(max(1, len(used)) * sizeof(int))
+        init_kind = <unsigned char*> malloc(max(1, len(used)) * sizeof(unsigned char))
+        try:
+            if out == NULL or out_kind == NULL or init_idx == NULL \
+                    or init_val == NULL or init_kind == NULL:
+                raise MemoryError()
+            for i in used:
+                init_idx[init_len] = i
+                init_val[init_len] = self.tiles[i]
+                init_kind[_pp(init_len)] = self.tiles_kind[i]
+            with nogil:
+                for run in range(count):
+                    start, stop_ = offsets[run], offsets[run+1]
+                    if stop_ > start:
+                        memcpy(self.inbox, &values[start],
+                               (stop_ - start) * sizeof(int))
+                        if has_kinds:
+                            memcpy(self.inbox_kind, &kinds[start], stop_ - start)
+                        else:
+                            memset(self.inbox_kind, Kind.NUM, stop_ - start)
+                    self.inbox_len = stop_ - start
+                    self._reset()
+                    if has_expected:
+                        start, stop_ = exp_offsets[run], exp_offsets[run+1]
+                        self.expecting = True
+                        self.expect_len = stop_ - start
+                        if stop_ > start:
+                            self.expect = &exp_values[start]
+                            self.expect_kind = &exp_kinds[start]
+                    for i in range(init_len):
+                        self.tiles[init_idx[i]] = init_val[i]
+                        self.tiles_kind[init_idx[i]] = init_kind[i]
+                        self.tiles_epoch[init_idx[i]] = self.epoch
+                        if init_idx[i] >= self.tiles_top:
+                            self.tiles_top = init_idx[i] + 1
+                    stop = self._run(maxsteps, &steps, &ip)
+                    if out_len + self.outbox_pos > out_cap:
+                        while out_len + self.outbox_pos > out_cap:
+                            out_cap *= 2
+                        more = realloc(out, out_cap * sizeof(int))
+                        if more == NULL:
+                            nomem = True
+                            break
+                        out = <int*> more
+                        more = realloc(out_kind, out_cap * sizeof(unsigned char))
+                        if more == NULL:
+                            nomem = True
+                            break
+                        out_kind = <unsigned char*> more
+                    memcpy(out + out_len, self.outbox,
+                           self.outbox_pos * sizeof(int))
+                    memcpy(out_kind + out_len, self.outbox_kind,
+                           self.outbox_pos)
+                    out_len += self.outbox_pos
+                    res_offsets.data.as_uints[run+1] = out_len
+                    res_steps.data.as_uints[run] = steps
+                    res_errors.data.as_uints[run] = \
+                        0 if stop == Stop.DONE else <unsigned int> stop
+                    res_ips.data.as_uints[run] = ip
+            self.expecting = False
+            if nomem:
+                raise MemoryError()
+            res_values = array.array("i", [0] * out_len)
+            memcpy(res_values.data.as_ints, out, out_len * sizeof(int))
+            res_kinds = array.array("B", [0] * out_len)
+            memcpy(res_kinds.data.as_uchars, out_kind, out_len)
+        finally:
+            free(out)
+            free(out_kind)
+            free(init_idx)
+            free(init_val)
+            free(init_kind)
+        return Batch(self.program.source, res_values, res_kinds, res_offsets,
+                     res_steps, res_errors, res_ips)
+
+    def run_parallel(self, inboxes, tiles=[], unsigned int maxsteps=1024,
+                     expected=None, workers=None, chunk=None):
+        """Execute the program on many inboxes using several threads
+
+        Inboxes are split into chunks that are processed by `run_batch` on
+        copies of the executor, one for each thread. Since `run_batch` does
+        not hold the GIL, the chunks are actually processed in parallel.
+
+        Arguments:
+         - `inboxes`, `tiles`, `maxsteps`, `expected`: like for `run_batch`
+         - `workers: int = None`: number of threads, defaults to the number
+           of CPUs
+         - `chunk: int = None`: number of inboxes in each chunk, defaults to
+           spread the inboxes evenly on 4 chunks per thread
+
+        Return: a `Batch` instance holding the results of every run, in the
+        same order as `inboxes` regardless of how the runs were scheduled
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        values, offsets, kinds = buffers(inboxes)
+        if expected is not None:
+            exp_values, exp_offsets, exp_kinds = buffers(expected)
+        count = len(offsets) - 1 if len(offsets) else 0
+        if chunk is None:
+            chunk = max(1, -(-count // (4 * workers)))
+        if workers <= 1 or count <= chunk:
+            return self.run_batch((values, offsets, kinds), tiles, maxsteps,
+                                  expected)
+        clones = queue.SimpleQueue()
+        for _ in range(min(workers, -(-count // chunk))):
+            clones.put(self.copy())
+
+        def work(start):
+            hrm = clones.get()
+            if expected is None:
+                exp = None
+            else:
+                exp = (exp_values, exp_offsets[start:start+chunk+1], exp_kinds)
+            try:
+                return hrm.run_batch((values, offsets[start:start+chunk+1],
+                                      kinds), tiles, maxsteps, exp)
+            finally:
+                clones.put(hrm)
+
+        with ThreadPoolExecutor(workers) as pool:
+            batch = Batch.concat(pool.map(work, range(0, count, chunk)))
+        if self.hits != NULL:
+            while not clones.empty():
+                self._add_profile(clones.get())
+        return batch
+
+    cdef void _add_profile(self, HRMX other):
+        # accumulate the profiling counters of other, running the same program
+        cdef unsigned int i
+        for i in range(self.prog_len):
+            self.hits[i] += other.hits[i]
+            self.taken[i] += other.taken[i]
+
+    def run_trie(self, inboxes, tiles=[], unsigned int maxsteps=1024):
+        """Execute the program on many inboxes sharing common prefixes
+
+        Inboxes are organised as a trie, which is explored depth-first: the
+        execution is suspended when the inbox is exhausted, and then forked
+        for each possible next value. This way, the operations executed while
+        processing a common prefix are executed only once for all the inboxes
+        that share it. Results are the same as with `run_batch`.
+
+        Arguments:
+         - `inboxes: list[list[int | str]]`: the inboxes to be processed
+         - `tiles: list[int | str | None] | buffer = []`: initial content
+           of the registers, the same for every run, like in `boot`
+         - `maxsteps: int = 1024`: maximum number of operations for each run,
+           `0` meaning no limit
+
+        Return: a `Batch` instance holding the results of every run, in the
+        same order as `inboxes`
+        """
+        cdef HRMX hrm, fork
+        cdef unsigned int steps, ip, total, i
+        cdef list node, child, branches
+        cdef dict children
+        cdef int num
+        cdef unsigned char kind
+        cdef bint chars = False
+        cdef Stop stop
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        # a trie node is a list [indexes of the inboxes ending here, children]
+        root = [[], {}]
+        for n, inbox in enumerate(inboxes):
+            node = root
+            for v in inbox:
+                children = node[1]
+                child = children.get(v)
+                if child is None:
+                    encode(v, &num, &kind)
+                    chars = chars or kind == Kind.CHAR
+                    child = children[v] = [[], {}]
+                node = child
+            node[0].append(n)
+        results = [None] * len(inboxes)
+        # executors that are not used anymore, recycled for the next forks
+        spare = []
+        hrm = HRMX(self.program, capacity=self.capacity,
+                   max_outbox=self.max_outbox)
+        hrm.boot([], tiles)
+        hrm._specialise(chars)
+        hrm.hold = True
+        todo = [(hrm, root, 0)]
+        while todo:
+            hrm, node, total = todo.pop()
+            with nogil:
+                stop = hrm._run(maxsteps - total if maxsteps else 0, &steps, &ip)
+            total += steps
+            if stop != Stop.INPUT:
+                # every inbox below this node stops the same way
+                res = (hrm._outbox_arrays(), total,
+                       0 if stop == Stop.DONE else <unsigned int> stop, ip)
+                nodes = [node]
+                while nodes:
+                    ends, children = nodes.pop()
+                    for n in ends:
+                        results[n] = res
+                    nodes.extend(children.values())
+                spare.append(hrm)
+                continue
+            if node[0]:
+                res = (hrm._outbox_arrays(), total, 0, ip)
+                for n in node[0]:
+                    results[n] = res
+            branches = list(node[1].items())
+            if not branches:
+                spare.append(hrm)
+            for i, (v, child) in enumerate(branches):
+                if i == len(branches) - 1:
+                    fork = hrm
+                elif spare:
+                    fork = spare.pop()
+                    fork._assign(hrm)
+                else:
+                    fork = hrm.snapshot()
+                encode(v, &num, &kind)
+                fork._fit_inbox(fork.inbox_len + 1)
+                fork.inbox[fork.inbox_len] = num
+                fork.inbox_kind[fork.inbox_len] = kind
+                fork.inbox_len += 1
+                todo.append((fork, child, total))
+        values = array.array("i")
+        kinds = array.array("B")
+        offsets = array.array("I", [0])
+        res_steps = array.array("I")
+        res_errors = array.array("I")
+        res_ips = array.array("I")
+        for (out, out_kind), steps, err, ip in results:
+            values.extend(out)
+            kinds.extend(out_kind)
+            offsets.append(len(values))
+            res_steps.append(steps)
+            res_errors.append(err)
+            res_ips.append(ip)
+        return Batch(self.program.source, values, kinds, offsets,
+                     res_steps, res_errors, res_ips)
+
+    def stream(self, inbox, tiles=[], unsigned int maxsteps=0,
+               unsigned int chunk=1024):
+        """Execute the program on a stream of values
+
+        The inbox is pulled lazily from `inbox`, by chunks, and the outbox
+        is delivered by chunks, each time it is full or the program waits
+        for more input, so that the memory used is bounded whatever the
+        lengths of the inbox and outbox, and that results flow out while the
+        program is still running. The outbox is thus not limited by
+        `max_outbox`.
+
+        Arguments:
+         - `inbox: Iterable[int | str | buffer]`: the values of the inbox,
+           or buffers of C `int` (like in `boot`) that hold chunks of values
+         - `tiles: list[int | str | None] | buffer = []`: initial content of
+           the registers, like in `boot`
+         - `maxsteps: int = 0`: maximum number of operations for the whole
+           stream, `0` meaning no limit
+         - `chunk: int = 1024`: number of values pulled at once from
+           `inbox`, and maximum number of values in a chunk of the outbox
+
+        Return: a generator of the chunks of the outbox, as lists of values,
+        `HRMProgramError` being raised when the program fails, after the
+        values output before the error have been delivered
+        """
+        cdef unsigned int steps, ip, total = 0
+        cdef Stop stop
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        if chunk == 0:
+            raise ValueError("invalid chunk size")
+        values = iter(inbox)
+        self.boot([], tiles)
+        # letters may come later
+        self._specialise(True)
+        if not resize_box(&self.outbox, &self.outbox_kind, chunk):
+            raise MemoryError()
+        self.outbox_size = chunk
+        self.hold = self.drain = True
+        try:
+            while True:
+                if self.hold and self.inbox_pos == self.inbox_len:
+                    self.hold = self._pull(values, chunk)
+                    self._forget()
+                with nogil:
+                    stop = self._run(maxsteps - total if maxsteps else 0,
+                                     &steps, &ip)
+                total += steps
+                if self.outbox_pos > 0:
+                    out = self._outbox()
+                    self.outbox_pos = 0
+                    self._forget()
+                    yield out
+                if stop == Stop.DONE:
+                    return
+                elif stop != Stop.INPUT and stop != Stop.OUTPUT:
+                    raise self._err(stop, ip)
+        finally:
+            self.hold = self.drain = False
+            self.outbox_size = min(self.outbox_size, self.max_outbox)
+
+    cdef bint _pull(self, object values, unsigned int chunk) except *:
+        # replace the consumed inbox with at least chunk values pulled from
+        # values (or less if it is exhausted), return whether it may hold more
+        cdef const int[::1] buf
+        self.inbox_pos = self.inbox_len = 0
+        self._fit_inbox(chunk)
+        for v in values:
+            if is_buffer(v):
+                buf = v
+                self._fit_inbox(self.inbox_len + len(buf))
+                if len(buf) > 0:
+                    memcpy(self.inbox + self.inbox_len, &buf[0],
+                           len(buf) * sizeof(int))
+                    memset(self.inbox_kind + self.inbox_len, Kind.NUM, len(buf))
+                    self.inbox_len += len(buf)
+            else:
+                self._fit_inbox(self.inbox_len + 1)
+                encode(v, &self.inbox[self.inbox_len],
+                       &self.inbox_kind[self.inbox_len])
+                self.inbox_len += 1
+            if self.inbox_len >= chunk:
+                return True
+        return False
+
+    def __iter__(self):
+        """Execute a programm op-by-op
+
+        Every executed operation is yield as a tuple with:
+         - `addr: int`: operation address
+         - `lineno: int`: operation line number in the source
+         - `name: str`: operation name
+         - `arg: None | int | list[int] | str`: operation argument
+         - `hands: None | int | str`: value held by worked after the operation is executed
+        """
+        cdef Stop stop
+        cdef unsigned int ip
+        cdef object hands
+        if self.prog_len == 0:
+            raise ValueError("no program loaded")
+        if not self.booted:
+            raise ValueError("no inbox given")
+        while True:
+            ip = self.ip
+            stop = step(self, 1)
+            hands = decode(self.hands, self.hands_kind)
+            if stop == Stop.DONE:
+                # unless the program ends with an inbox, its end is reached
+                # without executing an operation
+                if ip != self.prog_len:
+                    yield ip, self.program.lineno[ip], *self.program.source[ip], hands
+                return
+            elif stop == Stop.STEPS:
+                if self.hits != NULL:
+                    self.hits[ip] += 1
+                yield ip, self.program.lineno[ip], *self.program.source[ip], hands
+            else:
+                raise self._err(stop, ip)
+
+    cdef object _err(self, stop, ip):
+        return _error(self.program.source, stop, ip)
+
+    @property
+    def outbox(self):
+        """The produced outbox so far
+        
+        If the program is not fully executed, its outbox may not be complete.
+        """
+        return self._outbox()
+
+    cdef tuple _outbox_arrays(self):
+        # outbox as arrays of values and kinds, like in Batch
+        cdef array.array values = array.array("i", [0] * self.outbox_pos)
+        cdef array.array kinds = array.array("B", [0] * self.outbox_pos)
+        memcpy(values.data.as_ints, self.outbox, self.outbox_pos * sizeof(int))
+        memcpy(kinds.data.as_uchars, self.outbox_kind, self.outbox_pos)
+        return values, kinds
+
+    cdef unsigned int _outbox_into(self, object out) except? 0:
+        # copy the outbox into caller-provided buffers, see __call__
+        cdef int[::1] values
+        cdef unsigned char[::1] kinds = None
+        if isinstance(out, tuple):
+            values, kinds = out
+        else:
+            values = out
+        if len(values) < self.outbox_pos \
+                or (kinds is not None and len(kinds) < self.outbox_pos):
+            raise ValueError("outbox buffer too small")
+        if self.outbox_pos > 0:
+            memcpy(&values[0], self.outbox, self.outbox_pos * sizeof(int))
+            if kinds is not None:
+                memcpy(&kinds[0], self.outbox_kind, self.outbox_pos)
+        return self.outbox_pos
+
+    cdef list _outbox(self):
+        cdef unsigned int i
+        return [decode(self.outbox[i], self.outbox_kind[i])
+                for i in range(self.outbox_pos)]
+
+    cpdef void patch(self, dict patch):
+        """Replace instructions in the program.
+
+        The program is not changed in place, but replaced with a patched
+        copy, so that other executors sharing it are not affected.
+
+        Arguments:
+         - `patch: dict`: map addresses to new instructions given as token lists
+        """
+        self._set_program(self.program.patch(patch))
+
+    def aot(self, cache=None, cc=None):
+        """Compile the program to native code.
+
+        See `Program.aot`, the native code is shared with the other
+        executors running the same program, a patched program has to be
+        compiled again.
+
+        Return: the path of the loaded shared object
+        """
+        return self.program.aot(cache, cc)
+
+    cpdef tuple decode(self, unsigned int addr):
+        """Decode a single instuction.
+
+        Arguments:
+         - `pos: int`: address to be decoded
+
+        Return: a tuple with
+         - `label: str|None` the label pointing to the instruction, if any
+         - `op: str` the operation
+         - `arg: int|list[int]|str|None` the argument if any
+        """
+        return self.program.decode(addr)
+
     def dump(self):
         """Dump every program instruction.
 
@@ -701,7 +2800,7 @@ cdef class HRMX:
         cdef object lbl, op, arg
         while p < self.prog_len:
             lbl, op, arg = self.decode(p)
-            yield p, self.lineno[p], lbl, op, arg
+            yield p, self.program.lineno[p], lbl, op, arg
             if arg is None:
                 p += 1
             else:
@@ -738,3 +2837,48 @@ cdef class HRMX:
             if arg is not None:
                 txt.extend([" ", (str(arg), colors[op])])
             rprint(Text.assemble(*txt))
+
+#
+# time-sliced execution
+#
+
+def round_robin(executors, unsigned int steps=1024, unsigned int maxsteps=0):
+    """Execute several programs in turn, by slices
+
+    Every executor, that has to be booted already, runs at most `steps`
+    operations before the next one gets its turn (see `HRMX.run`), so that
+    long runs cannot starve the short ones.
+
+    Arguments:
+     - `executors: Iterable[HRMX]`: the executors to be run
+     - `steps: int = 1024`: number of operations in each slice
+     - `maxsteps: int = 0`: maximum number of operations for each run,
+       `0` meaning no limit, beyond which a run fails with errno `STEPS`
+
+    Yield: a tuple for each executor, as soon as it has finished, with
+     - `index: int`: its position in `executors`
+     - `outbox: list[int | str]`: the produced outbox
+     - `error: HRMProgramError | None`: the error that stopped the run if any
+    """
+    cdef HRMX hrm
+    cdef unsigned int total, slice_, done, ip
+    cdef Stop stop
+    todo = collections.deque((n, hrm, 0) for n, hrm in enumerate(executors))
+    for _, hrm, _ in todo:
+        if hrm.prog_len == 0:
+            raise ValueError("no program loaded")
+    while todo:
+        n, hrm, total = todo.popleft()
+        if maxsteps and (steps == 0 or maxsteps - total < steps):
+            slice_ = maxsteps - total
+        else:
+            slice_ = steps
+        with nogil:
+            stop = hrm._run(slice_, &done, &ip)
+        total += done
+        if stop == Stop.STEPS and not (maxsteps and total >= maxsteps):
+            todo.append((n, hrm, total))
+        elif stop == Stop.DONE:
+            yield n, hrm._outbox(), None
+        else:
+            yield n, hrm._outbox(), hrm._err(stop, ip)
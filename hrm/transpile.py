@@ -0,0 +1,542 @@
+"""Translate HRM programs into specialised Python functions
+
+A program is split into basic blocks whose operations are translated into
+straight-line Python code, with the hands and tiles held in local variables
+(tiles are kept in a `dict` only if the program uses pointers). When the
+control-flow graph is reducible, its structure is recovered as nested
+`while`/`if` statements, following Ramsey's "Beyond Relooper" (ICFP 2022).
+Otherwise, blocks are selected by a binary jump-table in a single loop.
+
+The generated functions behave exactly like `HRM.__call__` in non-verbose
+mode: same outbox, same errors (types and messages) and same handling of
+`maxsteps`. Counting steps is only performed when `maxsteps` is not zero,
+using a separate version of the function.
+"""
+
+import functools
+
+from . import HRMError, HRMStepsError, _deref
+
+# number of translated functions that are kept
+_CACHED = 256
+
+_NOHANDS = "you don't hold any value"
+
+
+def _floor(floor):
+    # initial tiles as in HRM.iter
+    if isinstance(floor, dict):
+        return {int(k): v for k, v in floor.items()}
+    return dict(enumerate(floor))
+
+
+def _key(prog, labels):
+    # hashable version of a program
+    ops = []
+    for op, *args in prog:
+        ops.append((str(op).lower(),
+                    *(tuple(int(a) for a in arg) if isinstance(arg, list)
+                      else (str(arg) if isinstance(arg, str) else int(arg))
+                      for arg in args)))
+    return tuple(ops), tuple(sorted((str(k), v) for k, v in labels.items()))
+
+
+class _Code:
+    "source code writer"
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def __call__(self, *lines):
+        self.lines.extend("    " * self.depth + line for line in lines)
+
+    def indent(self):
+        self.depth += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.depth -= 1
+
+    def __str__(self):
+        return "\n".join(self.lines) + "\n"
+
+
+class Block:
+    """A basic block
+
+    Attributes:
+     - `num: int`: block number, which is also its position in the list of blocks
+     - `start`, `stop`: positions in the program of the block operations
+     - `cond: str | None`: the conditional jump that ends the block, if any
+     - `succ: list[int]`: the targets positions of the block, that is the
+       jump target (if any), followed by the next operation (if reached)
+     - `error: str | None`: an error that is raised by the final jump
+    """
+
+    def __init__(self, num, start, stop):
+        self.num = num
+        self.start = start
+        self.stop = stop
+        self.cond = None
+        self.succ = []
+        self.error = None
+
+
+class Transpiler:
+    """Translate a program into Python source code
+
+    Attributes:
+     - `prog`, `labels`: the program as returned by the parser
+     - `blocks: list[Block]`: the basic blocks of the program
+     - `structured: bool`: whether the control-flow structure was recovered
+     - `source: str`: the generated source code, defining three functions
+       `fast(inbox, floor)`, `counted(inbox, floor, maxsteps)`, and `run`
+       that chooses one of them depending on `maxsteps`
+    """
+
+    def __init__(self, prog, labels):
+        self.prog = [(str(op).lower(), *args) for op, *args in prog]
+        self.labels = dict(labels)
+        self.size = len(self.prog)
+        self._check()
+        self.pointers = any(args and isinstance(args[0], list)
+                            for _, *args in self.prog)
+        self.tiles = sorted({int(args[0]) for op, *args in self.prog
+                             if args and not op.startswith("jump")
+                             and not isinstance(args[0], list)})
+        self._split()
+        self._analyse()
+        self.structured = self.reducible
+        try:
+            self.source = self._generate()
+            compile(self.source, "<hrm>", "exec")
+        except (SyntaxError, RecursionError):
+            # too deeply nested code
+            self.structured = False
+            self.source = self._generate()
+
+    def _check(self):
+        for op, *args in self.prog:
+            if op in ("inbox", "outbox"):
+                ok = not args
+            elif op.startswith("jump"):
+                ok = len(args) == 1 and isinstance(args[0], str)
+            elif op in ("copyfrom", "copyto", "add", "sub", "bumpup", "bumpdn"):
+                ok = len(args) == 1 and (
+                    isinstance(args[0], int)
+                    or (isinstance(args[0], list) and len(args[0]) == 1
+                        and isinstance(args[0][0], int)))
+            else:
+                ok = False
+            if not ok:
+                raise ValueError(f"cannot transpile {op} {' '.join(map(str, args))}")
+
+    def _target(self, lbl):
+        # position of label, or None if it cannot be reached by a jump
+        pos = self.labels.get(lbl)
+        if isinstance(pos, int) and 0 <= pos <= self.size:
+            return pos
+
+    def _split(self):
+        leaders = {0}
+        for pos, (op, *args) in enumerate(self.prog):
+            if op.startswith("jump"):
+                leaders.add(pos + 1)
+                if (target := self._target(args[0])) is not None:
+                    leaders.add(target)
+        leaders = sorted(p for p in leaders if p < self.size)
+        self.blocks = [Block(n, start, stop) for n, (start, stop)
+                       in enumerate(zip(leaders, leaders[1:] + [self.size]))]
+        self.at = {b.start: b.num for b in self.blocks}
+        for block in self.blocks:
+            op, *args = self.prog[block.stop - 1]
+            if op.startswith("jump"):
+                target = self._target(args[0])
+                if args[0] not in self.labels:
+                    block.error = f"labels {args[0]} is not defined"
+                elif target is None:
+                    block.error = "invalid program position"
+                else:
+                    block.succ.append(target)
+                if op != "jump":
+                    block.cond = op
+                    if not block.error:
+                        block.succ.append(block.stop)
+            else:
+                block.succ.append(block.stop)
+
+    def _edges(self, block):
+        # successors blocks, the end of the program is not a block
+        return [self.at[p] for p in block.succ if p < self.size]
+
+    def _analyse(self):
+        # reverse postorder
+        seen, order = {0}, []
+        stack = [(0, iter(self._edges(self.blocks[0])))]
+        while stack:
+            node, succ = stack[-1]
+            for nxt in succ:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append((nxt, iter(self._edges(self.blocks[nxt]))))
+                    break
+            else:
+                order.append(node)
+                stack.pop()
+        self.rpo = order[::-1]
+        self.rank = {n: r for r, n in enumerate(self.rpo)}
+        preds = {n: [] for n in self.rpo}
+        for n in self.rpo:
+            for s in self._edges(self.blocks[n]):
+                preds[s].append(n)
+        # dominators (Cooper, Harvey & Kennedy)
+        idom = {0: 0}
+        changed = True
+        while changed:
+            changed = False
+            for n in self.rpo[1:]:
+                new = None
+                for p in preds[n]:
+                    if p not in idom:
+                        continue
+                    if new is None:
+                        new = p
+                        continue
+                    a, b = p, new
+                    while a != b:
+                        while self.rank[a] > self.rank[b]:
+                            a = idom[a]
+                        while self.rank[b] > self.rank[a]:
+                            b = idom[b]
+                    new = a
+                if idom.get(n) != new:
+                    idom[n] = new
+                    changed = True
+        self.idom = idom
+        self.children = {n: [] for n in self.rpo}
+        for n in self.rpo[1:]:
+            self.children[idom[n]].append(n)
+        # loops and merge nodes, checking that the graph is reducible
+        self.reducible = True
+        self.headers = set()
+        forward = {n: 0 for n in self.rpo}
+        for n in self.rpo:
+            for s in self._edges(self.blocks[n]):
+                if self.rank[s] <= self.rank[n]:
+                    self.headers.add(s)
+                    if not self._dominates(s, n):
+                        self.reducible = False
+                else:
+                    forward[s] += 1
+        self.merges = {n for n, count in forward.items() if count > 1}
+
+    def _dominates(self, a, b):
+        while b != a and b != 0:
+            b = self.idom[b]
+        return a == b
+
+    def _generate(self):
+        code = _Code()
+        for counted in (False, True):
+            self.counted = counted
+            self.jumps = False
+            body = _Code()
+            body.depth = 1
+            if self.structured:
+                self._tree(body, 0, [])
+            else:
+                self._table(body)
+            if counted:
+                code("def counted(inbox, floor, steps):")
+            else:
+                code("def fast(inbox, floor):")
+            with code.indent():
+                code("T = _floor(floor)",
+                     "inbox = list(inbox)",
+                     "size = len(inbox)",
+                     "out = []",
+                     "push = out.append",
+                     "h = None",
+                     "i = _j = 0")
+                code(*(f"t{t} = T.get({t})" for t in self.tiles
+                       if not self.pointers))
+            code.lines.extend(body.lines)
+            code("")
+        code("def run(inbox, floor=[], maxsteps=0):")
+        with code.indent():
+            code("if maxsteps:")
+            with code.indent():
+                code("return counted(inbox, floor, maxsteps)")
+            code("return fast(inbox, floor)")
+        return str(code)
+
+    # structured control-flow (for reducible graphs)
+
+    def _tree(self, code, node, ctx):
+        merges = sorted((c for c in self.children[node] if c in self.merges),
+                        key=self.rank.get)
+        if node in self.headers:
+            code("while True:")
+            with code.indent():
+                self._within(code, node, merges, [("loop", node)] + ctx)
+            self._propagate(code, ctx)
+        else:
+            self._within(code, node, merges, ctx)
+
+    def _within(self, code, node, merges, ctx):
+        if not merges:
+            block = self.blocks[node]
+            self._ops(code, block)
+            self._exit(code, block, lambda pos: self._branch(code, node, pos, ctx))
+        else:
+            follow = merges[-1]
+            code("while True:")
+            with code.indent():
+                self._within(code, node, merges[:-1], [("block", follow)] + ctx)
+            self._propagate(code, ctx)
+            self._tree(code, follow, ctx)
+
+    def _branch(self, code, src, pos, ctx):
+        if pos == self.size:
+            code("return out")
+            return
+        dst = self.at[pos]
+        if self.rank[dst] <= self.rank[src] or dst in self.merges:
+            for level, (kind, node) in enumerate(ctx):
+                if node == dst and (kind == "loop") == (self.rank[dst] <= self.rank[src]):
+                    break
+            else:
+                raise AssertionError("no enclosing context")
+            if level == 0:
+                code("continue" if kind == "loop" else "break")
+            else:
+                self.jumps = True
+                code(f"_j = {2 * (level - 1) + (1 if kind == 'loop' else 2)}",
+                     "break")
+        else:
+            self._tree(code, dst, ctx)
+
+    def _propagate(self, code, ctx):
+        # forward multi-level jumps through enclosing loops
+        if ctx and self.jumps:
+            code("if _j:")
+            with code.indent():
+                code("if _j == 1:")
+                with code.indent():
+                    code("_j = 0", "continue")
+                code("if _j > 2:")
+                with code.indent():
+                    code("_j -= 2", "break")
+                code("_j = 0", "break")
+
+    # jump-table (for irreducible graphs)
+
+    def _table(self, code):
+        code("b = 0", "while True:")
+        with code.indent():
+            self._dispatch(code, sorted(self.rpo))
+
+    def _dispatch(self, code, nodes):
+        if len(nodes) == 1:
+            block = self.blocks[nodes[0]]
+            self._ops(code, block)
+            self._exit(code, block, lambda pos: self._goto(code, pos))
+        else:
+            mid = len(nodes) // 2
+            code(f"if b < {nodes[mid]}:")
+            with code.indent():
+                self._dispatch(code, nodes[:mid])
+            code("else:")
+            with code.indent():
+                self._dispatch(code, nodes[mid:])
+
+    def _goto(self, code, pos):
+        if pos == self.size:
+            code("return out")
+        else:
+            code(f"b = {self.at[pos]}", "continue")
+
+    # operations
+
+    def _step(self, code):
+        if self.counted:
+            code("steps -= 1",
+                 "if not steps:",
+                 "    raise HRMStepsError('too many steps')")
+
+    def _exit(self, code, block, branch):
+        # translate the end of a block, calling branch(pos) for each target
+        if block.cond is None and block.stop - 1 >= block.start \
+                and self.prog[block.stop - 1][0] == "jump":
+            if block.error:
+                code(f"raise HRMError({block.error!r})")
+            elif block.succ[0] == self.size:
+                code("return out")
+            else:
+                self._step(code)
+                branch(block.succ[0])
+            return
+        if block.cond is not None:
+            op, lbl = self.prog[block.stop - 1]
+            if lbl not in self.labels:
+                code(f"raise HRMError({block.error!r})")
+                return
+            self._hands(code)
+            if block.error:
+                code(f"raise HRMError({block.error!r})")
+                return
+            if block.cond == "jumpz":
+                test = "h == 0"
+            else:
+                test = "isinstance(h, int) and h < 0"
+            target, nxt = block.succ
+            if target == self.size:
+                code(f"if {test}:")
+                with code.indent():
+                    code("return out")
+                self._step(code)
+            else:
+                self._step(code)
+                code(f"if {test}:")
+                with code.indent():
+                    branch(target)
+            branch(nxt)
+        else:
+            branch(block.succ[0])
+
+    def _ops(self, code, block):
+        stop = block.stop
+        if self.prog[stop - 1][0].startswith("jump"):
+            stop -= 1
+        # whether hands are known to hold a value
+        self.held = False
+        for op, *args in self.prog[block.start:stop]:
+            getattr(self, f"_op_{op}")(code, *args)
+            self._step(code)
+
+    def _hands(self, code):
+        # check that hands hold a value, unless this is already known
+        if not self.held:
+            code("if h is None:",
+                 f"    raise HRMError({_NOHANDS!r})")
+            self.held = True
+
+    def _load(self, code, arg):
+        # check and get the value of a tile, returning an expression for it
+        if isinstance(arg, list):
+            code(f"p = _deref(T, {int(arg[0])})",
+                 "v = T.get(p)",
+                 "if v is None:",
+                 "    raise HRMError(f'tile {p} is empty')")
+            return "v"
+        elif self.pointers:
+            code(f"v = T.get({int(arg)})",
+                 "if v is None:",
+                 f"    raise HRMError('tile {int(arg)} is empty')")
+            return "v"
+        else:
+            code(f"if t{int(arg)} is None:",
+                 f"    raise HRMError('tile {int(arg)} is empty')")
+            return f"t{int(arg)}"
+
+    def _store(self, arg, loaded=False):
+        # an expression to assign a tile, pointers being already resolved
+        # if the tile has been loaded before
+        if isinstance(arg, list):
+            return "T[p]" if loaded else f"T[_deref(T, {int(arg[0])})]"
+        elif self.pointers:
+            return f"T[{int(arg)}]"
+        else:
+            return f"t{int(arg)}"
+
+    def _op_inbox(self, code):
+        code("if i == size:",
+             "    return out",
+             "h = inbox[i]",
+             "i += 1")
+        self.held = False
+
+    def _op_outbox(self, code):
+        self._hands(code)
+        code("push(h)",
+             "h = None")
+        self.held = False
+
+    def _op_copyfrom(self, code, arg):
+        code(f"h = {self._load(code, arg)}")
+        self.held = True
+
+    def _op_copyto(self, code, arg):
+        self._hands(code)
+        code(f"{self._store(arg)} = h")
+
+    def _op_add(self, code, arg):
+        self._hands(code)
+        code("if not isinstance(h, int):",
+             "    raise HRMError(f'cannot add to value {h!r}')")
+        val = self._load(code, arg)
+        code(f"if not isinstance({val}, int):",
+             f"    raise HRMError(f'cannot add value {{{val}!r}}')",
+             f"h += {val}")
+
+    def _op_sub(self, code, arg):
+        self._hands(code)
+        val = self._load(code, arg)
+        code(f"if isinstance(h, int) and isinstance({val}, int):",
+             f"    h -= {val}",
+             f"elif isinstance(h, str) and isinstance({val}, str):",
+             f"    h = ord(h) - ord({val})",
+             "else:",
+             f"    raise HRMError(f'cannot sub {{{val}!r}} from {{h!r}}')")
+
+    def _bump(self, code, arg, delta, verb):
+        val = self._load(code, arg)
+        code(f"if not isinstance({val}, int):",
+             f"    raise HRMError(f'cannot {verb} value {{h!r}}')",
+             f"h = {self._store(arg, True)} = {val} {delta}")
+        self.held = True
+
+    def _op_bumpup(self, code, arg):
+        self._bump(code, arg, "+ 1", "increment")
+
+    def _op_bumpdn(self, code, arg):
+        self._bump(code, arg, "- 1", "decrement")
+
+
+def transpile(prog, labels):
+    """Translate a program into a Python function
+
+    The latest translations are cached, so that translating the same
+    program again is almost free.
+
+    Arguments:
+     - `prog: list`: program as returned by the parser
+     - `labels: dict`: labels positions in the program, as returned by the parser
+
+    Return: a function `run(inbox, floor=[], maxsteps=0)` that executes the
+    program like `HRM.__call__` and returns the outbox, raising `HRMError`
+    on errors, and `ValueError` if the program cannot be translated (which
+    happens only for ill-formed programs). The generated source code is
+    available as `run.source`.
+    """
+    return _translate(_key(prog, labels))
+
+
+@functools.lru_cache(maxsize=_CACHED)
+def _translate(key):
+    # translated function for the program whose key is given
+    ops, labels = key
+    prog = [(op, *(list(arg) if isinstance(arg, tuple) else arg for arg in args))
+            for op, *args in ops]
+    trans = Transpiler(prog, dict(labels))
+    env = {"HRMError": HRMError, "HRMStepsError": HRMStepsError,
+           "_deref": _deref, "_floor": _floor}
+    exec(compile(trans.source, f"<hrm {hash(key):x}>", "exec"), env)
+    run = env["run"]
+    run.source = trans.source
+    run.structured = trans.structured
+    return run
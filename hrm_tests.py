@@ -1,23 +1,252 @@
 # coding: utf-8
 
+import array
 import collections
+import io
 import json
 import operator
+import os
 import pathlib
+import shutil
 import sys
+import tempfile
 
 import tqdm
 from colorama import Fore as F
 from colorama import Style as S
 from IPython.core import ultratb
+from typer.testing import CliRunner
 
-from hrm import HRM
-from hrm.hrmx import HRMX, HRMProgramError
+from hrm import HRM, HRMCycleError, HRMError, HRMStepsError
+from hrm.__main__ import app
+from hrm.cache import digest
+from hrm.engine import Engine
+from hrm.transpile import transpile
+from hrm.hrmx import ENCODING, HRMX, HRMProgramError, Program, flatten, round_robin
 
 log = tqdm.tqdm(sorted(json.load(open("solutions/solutions.json")),
                        key=operator.itemgetter("levelNumber")))
 pdf_base = pathlib.Path("pdf")
 errors = collections.defaultdict(int)
+cache = tempfile.TemporaryDirectory()
+natives = tempfile.TemporaryDirectory()
+native = shutil.which(os.environ.get("CC", "cc")) is not None
+
+
+def verify(tag, path, expected, run, *args, **kwargs):
+    # check that run(*args, **kwargs) returns expected
+    try:
+        got = run(*args, **kwargs)
+    except HRMError as err:
+        got = err
+    except Exception:
+        errors[f"{F.RED}({tag}) crashed"] = 1
+        log.write(f"{F.RED}{S.BRIGHT}({tag}) crashed:{S.RESET_ALL} {path}")
+        vtb = ultratb.VerboseTB(color_scheme="Linux")
+        log.write("\n".join(vtb.structured_traceback(*sys.exc_info())))
+        return
+    if got != expected:
+        errors[f"{F.YELLOW}({tag}) failed"] += 1
+        log.write(f"{F.YELLOW}({tag}) failed:{S.RESET_ALL} {path}")
+        log.write(f"  😡 {S.DIM}{got!r} instead of {expected!r}{S.RESET_ALL}")
+
+
+def errno(run, *args, **kwargs):
+    # error number raised by run(*args, **kwargs), or None
+    try:
+        run(*args, **kwargs)
+    except HRMProgramError as err:
+        return err.errno
+
+
+def raised(run, *args, **kwargs):
+    # type of the exception raised by run(*args, **kwargs), or None
+    try:
+        run(*args, **kwargs)
+    except Exception as err:
+        return type(err)
+
+
+def outcomes(batch):
+    # outbox of every run of a batch, or its error number
+    return [batch.errors[i] or batch[i] for i in range(len(batch))]
+
+
+def program(src):
+    return HRM.parse(io.StringIO("-- HUMAN RESOURCE MACHINE PROGRAM --\n" + src))
+
+
+def resume(hrmx, inbox, floor, steps):
+    # outboxes of a run paused after steps operations then continued, as
+    # well as continued from a snapshot restored later and from a fork
+    hrmx.boot(inbox, floor)
+    hrmx.run(steps)
+    snapshot, fork = hrmx.snapshot(), hrmx.fork()
+    hrmx.run(0)
+    outboxes = [hrmx.outbox]
+    hrmx.restore(snapshot)
+    hrmx.run(0)
+    fork.run(0)
+    return outboxes + [hrmx.outbox, fork.outbox]
+
+
+def outcome(run, *args, **kwargs):
+    # outbox returned by run(*args, **kwargs), or its error and message
+    try:
+        return run(*args, **kwargs)
+    except HRMError as err:
+        return type(err), str(err)
+
+
+def stepped(hrm, inbox, floor, maxsteps=0):
+    # outbox of HRM executing op-by-op
+    for _ in hrm.iter(inbox, floor, maxsteps=maxsteps):
+        pass
+    return hrm.outbox
+
+
+def stopped(run, hrm, *args, **kwargs):
+    # outcome of run(*args, **kwargs), with the outbox and state of hrm after it
+    return outcome(run, *args, **kwargs), list(hrm.outbox), dict(hrm.state)
+
+
+def tokens(hrm):
+    # operations and labels of hrm, with the positions of their tokens
+    def token(tok):
+        if isinstance(tok, list):
+            return [token(t) for t in tok]
+        return tok, tok.lineno, tok.start, tok.end, tok.line
+    return ([[token(tok) for tok in op] for op in hrm.prog],
+            [(token(lbl), pos) for lbl, pos in hrm.labels.items()])
+
+
+def hits(hrm, inbox, floor):
+    # number of executions of each line, by HRM
+    counts = collections.Counter()
+
+    def count(op, args, hrm, err=None):
+        # stopping on an empty inbox is not counted, unlike jumping to the end
+        if err is None or (err == "STOP" and op != "inbox"):
+            counts[op.lineno] += 1
+    for _ in hrm.iter(inbox, floor, count):
+        pass
+    return dict(counts)
+
+
+def profile(hrmx, run, *args, **kwargs):
+    # like hits, by HRMX for run(*args, **kwargs)
+    hrmx.profile()
+    run(*args, **kwargs)
+    return {num: count for num, (count, _) in hrmx.profile_lines().items() if count}
+
+
+def truncated(hrmx, inbox, floor, maxsteps):
+    # error, steps, last address and outbox of a run stopped after maxsteps
+    batch = hrmx.run_batch([inbox], floor, maxsteps)
+    return (batch.errors[0], batch.steps[0], batch.ips[0],
+            list(batch.values), list(batch.kinds))
+
+
+def failure(hrm, inbox, floor):
+    # outbox of HRM, or the line where it fails, or "steps" if it does not end
+    try:
+        return hrm.run(inbox, floor, 10000)
+    except HRMStepsError:
+        return "steps"
+    except (HRMError, ValueError):
+        # ValueError is raised for pointers that hold letters
+        return hrm.prog[hrm.ip - 1][0].lineno
+
+
+def xfailure(hrmx, inbox, floor):
+    # like failure, by HRMX
+    batch = hrmx.run_batch([inbox], floor, 10000)
+    if batch.errors[0] == HRMProgramError.STEPS:
+        return "steps"
+    elif batch.errors[0]:
+        return hrmx.lineno[batch.ips[0]]
+    return batch[0]
+
+
+def buffered(hrmx, inbox, floor):
+    # outbox of a run whose inbox, floor (when they hold only numbers) and
+    # outbox are buffers
+    if all(isinstance(v, int) for v in inbox):
+        inbox = array.array("i", inbox)
+    if isinstance(floor, list) and all(isinstance(v, int) for v in floor):
+        floor = array.array("i", floor)
+    values, kinds = array.array("i", [0] * 1024), array.array("B", [0] * 1024)
+    count = hrmx(inbox, floor, 100000, out=(values, kinds))
+    return [chr(v) if k == 2 else v for v, k in zip(values[:count], kinds[:count])]
+
+
+def partial(hrm, inbox, floor, maxsteps):
+    # outbox of HRM executing op-by-op, even if it fails, and whether it does
+    try:
+        stepped(hrm, inbox, floor, maxsteps)
+    except (HRMError, ValueError):
+        return hrm.outbox, True
+    return hrm.outbox, False
+
+
+def streamed(stream, inbox, floor, maxsteps, chunk):
+    # like partial, for the chunks delivered by stream, that must not be
+    # empty nor longer than chunk
+    out = []
+    try:
+        for values in stream(iter(inbox), floor, maxsteps, chunk=chunk):
+            if not 0 < len(values) <= chunk:
+                return "chunk", values
+            out.extend(values)
+    except (HRMError, ValueError):
+        return out, True
+    return out, False
+
+
+def sliced(hrmx, inbox, floor, steps):
+    # outbox of a run executed by slices of steps operations
+    hrmx.boot(inbox, floor)
+    while not hrmx.run(steps):
+        pass
+    return hrmx.outbox
+
+
+def interleaved(hrmx, inboxes, floor, steps, maxsteps=0):
+    # outbox and error number of runs executed in turn, by slices
+    executors = []
+    for inbox in inboxes:
+        executors.append(hrmx.fork())
+        executors[-1].boot(inbox, floor)
+    results = [None] * len(executors)
+    for n, out, err in round_robin(executors, steps, maxsteps):
+        results[n] = (out, err and err.errno)
+    return results
+
+
+def looping(run, *args, **kwargs):
+    # outbox returned by run(*args, **kwargs), or how it failed
+    try:
+        return run(*args, **kwargs)
+    except HRMProgramError as err:
+        return {err.CYCLE: "cycle", err.STEPS: "steps"}.get(err.errno, "error")
+    except HRMCycleError:
+        return "cycle"
+    except HRMStepsError:
+        return "steps"
+    except (HRMError, ValueError):
+        return "error"
+
+
+def detecting(hrmx):
+    # hrmx with the detection of infinite loops enabled
+    hrmx.detect()
+    return hrmx
+
+
+def iterate(hrmx, inbox, floor):
+    # execute op-by-op, returning the executed addresses and the outbox
+    hrmx.boot(inbox, floor)
+    return [addr for addr, *_ in hrmx], hrmx.outbox
 
 for sol in log:
     path = f"solutions/{sol['path']}"
@@ -31,6 +260,7 @@ for sol in log:
     # exec code
     num = sol["levelNumber"]
     lvl = hrm.level(num)
+    refs = []
     for ex, example in enumerate(lvl["examples"]):
         try:
             out = hrm.runlevel(lvl, ex)
@@ -50,25 +280,25 @@ for sol in log:
                 and out != example["outbox"]:
             errors[f"{F.YELLOW}failed"] += 1
             log.write(f"{F.YELLOW}failed:{S.RESET_ALL} {sol['path']}")
+        ref = out
+        refs.append(ref)
         # quick execution
         inbox = lvl["examples"][ex]["inbox"]
-        if not all(isinstance(i, int) for i in inbox):
-            continue
         if "floor" in lvl and "tiles" in lvl["floor"]:
             floor = lvl["floor"]["tiles"]
         else:
             floor = []
-        if not all(isinstance(t, (int, type(None))) for t in floor):
-            continue
         try:
             hrmx = HRMX(hrm.prog, hrm.labels)
-            out = hrmx(inbox, floor)
+            out = hrmx(inbox, floor, 100000)
         except HRMProgramError as err:
             errors[f"{F.RED}(quick) failed"] += 1
             log.write(f"{F.RED}{S.BRIGHT}(quick) failed:{S.RESET_ALL} {sol['path']}")
             log.write(f"  😡 {F.RED}{S.DIM}{err}{S.RESET_ALL}")
             log.write(f"  {S.DIM}INBOX: {','.join(str(i) for i in inbox)}{S.RESET_ALL}")
-            if floor:
+            if isinstance(floor, dict):
+                log.write(f"  {S.DIM}TILES: {floor}{S.RESET_ALL}")
+            elif floor:
                 log.write(f"  {S.DIM}TILES: {','.join(str(f) for f in floor)}{S.RESET_ALL}")
             break
         except Exception:
@@ -82,6 +312,407 @@ for sol in log:
                 and out != example["outbox"]:
             errors[f"{F.YELLOW}(quick) failed"] += 1
             log.write(f"{F.YELLOW}(quick) failed:{S.RESET_ALL} {sol['path']}")
+        # with compiled closures or translated into Python, also on
+        # inboxes that may fail
+        for box in (inbox, [-v if isinstance(v, int) else v for v in reversed(inbox)]):
+            for maxsteps in (0, 10000) if box is inbox else (10000,):
+                expected = outcome(stepped, hrm, box, floor, maxsteps)
+                verify("compile", sol["path"], expected,
+                       outcome, hrm.run, box, floor, maxsteps)
+                verify("transpile", sol["path"], expected,
+                       outcome, transpile(hrm.prog, hrm.labels), box, floor, maxsteps)
+        # by basic blocks, also when stopped within one of them
+        total = sum(hits(hrm, inbox, floor).values())
+        for maxsteps in sorted({*range(1, 6), *range(1, total + 2, 1 + total // 12), 0}):
+            verify("blocks", sol["path"], stopped(stepped, hrm, hrm, inbox, floor, maxsteps),
+                   stopped, hrm.run, hrm, inbox, floor, maxsteps, blocks=True)
+        # with hot loops traced, on larger values for loops to get hot
+        box = [30 * v if isinstance(v, int) else v for v in inbox]
+        for maxsteps in (total // 2, 100000):
+            expected = stopped(hrm.run, hrm, box, floor, maxsteps)
+            verify("trace", sol["path"], expected,
+                   stopped, hrm.run, hrm, box, floor, maxsteps, trace=True)
+            verify("trace", sol["path"], expected,
+                   stopped, hrm.run, hrm, box, floor, maxsteps, blocks=True, trace=True)
+        # compiled to native code, that fails like the interpreter
+        if native:
+            compiled = HRMX(hrm.prog, hrm.labels)
+            compiled.aot(natives.name)
+            for box in (inbox, [-v if isinstance(v, int) else v for v in reversed(inbox)]):
+                verify("aot", sol["path"],
+                       outcome(HRMX(hrm.prog, hrm.labels), box, floor, 10000),
+                       outcome, compiled, box, floor, 10000)
+        # op-by-op execution
+        verify("iter", sol["path"], ref,
+               lambda: iterate(HRMX(hrm.prog, hrm.labels), inbox, floor)[1])
+        # operations counted by line
+        counts = hits(hrm, inbox, floor)
+        hrmx = HRMX(hrm.prog, hrm.labels)
+        verify("profile", sol["path"], counts, profile, hrmx, hrmx, inbox, floor, 100000)
+        # stopped at any step, executing fused operations or not (they are
+        # not when profiling)
+        total = sum(counts.values())
+        limits = sorted({*range(1, min(total, 64) + 1), *range(1, total + 2, 1 + total // 32)})
+        fused = HRMX(hrm.prog, hrm.labels)
+        verify("fused", sol["path"],
+               [truncated(hrmx, inbox, floor, maxsteps) for maxsteps in limits],
+               lambda: [truncated(fused, inbox, floor, maxsteps) for maxsteps in limits])
+        box = [-v if isinstance(v, int) else v for v in reversed(inbox)]
+        verify("fused", sol["path"], truncated(hrmx, box, floor, 10000),
+               truncated, fused, box, floor, 10000)
+        # checks skipped by the code specialised for the floor and the
+        # kinds of values do not miss errors
+        swapped = [chr(65 + v % 26) if isinstance(v, int) else ord(v) - 64 for v in inbox]
+        for box, tiles in ((inbox, floor), (inbox, []), (swapped, floor),
+                           ([-v if isinstance(v, int) else v for v in reversed(inbox)], floor)):
+            verify("unchecked", sol["path"], failure(hrm, box, tiles),
+                   xfailure, HRMX(hrm.prog, hrm.labels), box, tiles)
+        # through buffers
+        verify("buffers", sol["path"], ref,
+               buffered, HRMX(hrm.prog, hrm.labels), inbox, floor)
+        # streamed by chunks, also when failing midway
+        for box in (inbox, [-v if isinstance(v, int) else v for v in reversed(inbox)]):
+            expected = partial(hrm, box, floor, 10000)
+            for chunk in (1, 3, 1024):
+                verify("stream", sol["path"], expected,
+                       streamed, hrm.stream, box, floor, 10000, chunk)
+                verify("stream", sol["path"], expected,
+                       streamed, HRMX(hrm.prog, hrm.labels).stream, box, floor, 10000, chunk)
+        # paused and resumed
+        for steps in (1, 7, 0):
+            verify("slices", sol["path"], ref,
+                   sliced, HRMX(hrm.prog, hrm.labels), inbox, floor, steps)
+        # looking for infinite loops, also on inboxes that may fail
+        for box in (inbox, [-v if isinstance(v, int) else v for v in reversed(inbox)]):
+            expected = looping(hrm.run, box, floor, 10000, detect=True)
+            verify("cycle", sol["path"], expected,
+                   looping, detecting(HRMX(hrm.prog, hrm.labels)), box, floor, 10000)
+            verify("cycle", sol["path"], expected,
+                   looping, hrm.run, box, floor, 10000, detect=True, blocks=True)
+        # with counting loops executed at once (they are not when
+        # profiling), on larger values
+        box = [30 * v if isinstance(v, int) else v for v in inbox]
+        hrmx, fast = HRMX(hrm.prog, hrm.labels), HRMX(hrm.prog, hrm.labels)
+        hrmx.profile()
+        total = truncated(hrmx, box, floor, 200000)[1]
+        limits = (total // 3, total - 1, total, 200000)
+        verify("accelerate", sol["path"],
+               [truncated(hrmx, box, floor, maxsteps) for maxsteps in limits],
+               lambda: [truncated(fast, box, floor, maxsteps) for maxsteps in limits])
+        # forked midway
+        verify("snapshot", sol["path"], [ref] * 3,
+               resume, HRMX(hrm.prog, hrm.labels), inbox, floor, 7)
+    # all the examples at once
+    if not refs:
+        continue
+    inboxes = [example["inbox"] for example in lvl["examples"]][:len(refs)]
+    verify("batch", sol["path"], refs,
+           lambda: list(HRMX(hrm.prog, hrm.labels).run_batch(inboxes, floor, 100000)))
+    verify("buffers", sol["path"], refs,
+           lambda: list(HRMX(hrm.prog, hrm.labels).run_batch(flatten(inboxes), floor, 100000)))
+    # on several threads, sharing a program that has never been run
+    verify("parallel", sol["path"], refs * 4,
+           lambda: list(HRMX(hrm.prog, hrm.labels).run_parallel(
+               inboxes * 4, floor, 100000, workers=4, chunk=1)))
+    # with the profiles of all the threads gathered
+    total = collections.Counter()
+    for inbox in inboxes:
+        total.update(hits(hrm, inbox, floor))
+    hrmx = HRMX(hrm.prog, hrm.labels)
+    verify("profile", sol["path"], {num: 4 * count for num, count in total.items()},
+           profile, hrmx, hrmx.run_parallel, inboxes * 4, floor, 100000,
+           workers=4, chunk=1)
+    # run in turn, by slices
+    for steps in (1, 5, 0):
+        verify("round robin", sol["path"], [(ref, None) for ref in refs],
+               interleaved, HRMX(hrm.prog, hrm.labels), inboxes, floor, steps)
+    # executors sharing a program, run in turn
+    shared = Program(hrm.prog, hrm.labels)
+    executors = [HRMX(shared), HRMX(shared, capacity=64)]
+    verify("program", sol["path"], refs * 2,
+           lambda: [executors[i % 2](inbox, floor, 100000)
+                    for i, inbox in enumerate(inboxes * 2)])
+    # an executor reused after runs that were stopped midway
+    hrmx = HRMX(hrm.prog, hrm.labels)
+    verify("reset", sol["path"], refs,
+           lambda: [(errno(hrmx, inbox, floor, 10), hrmx(inbox, floor, 100000))[1]
+                    for inbox in inboxes])
+    # checked against the expected outboxes, that are wrong at their end
+    hrmx = HRMX(hrm.prog, hrm.labels)
+    verify("expected", sol["path"], refs,
+           lambda: [hrmx(inbox, floor, 100000, expected=ref)
+                    for inbox, ref in zip(inboxes, refs)])
+    wrong = [ref[:-1] + [0 if ref[-1] != 0 else 1] if ref else [0] for ref in refs]
+    batch = hrmx.run_batch(inboxes, floor, 100000, wrong)
+    verify("expected", sol["path"],
+           [(HRMProgramError.MISMATCH, max(0, len(ref) - 1)) for ref in refs],
+           lambda: [(batch.errors[i], batch.error(i).position)
+                    for i in range(len(batch))])
+    # with outboxes bounded to their actual lengths
+    verify("max_outbox", sol["path"], refs,
+           lambda: [HRMX(hrm.prog, hrm.labels, max_outbox=len(ref))(inbox, floor, 100000)
+                    for inbox, ref in zip(inboxes, refs)])
+    verify("max_outbox", sol["path"],
+           [HRMProgramError.CAPACITY if ref else [] for ref in refs],
+           lambda: [errno(HRMX(hrm.prog, hrm.labels, max_outbox=len(ref) - 1),
+                          inbox, floor, 100000) if ref else []
+                    for inbox, ref in zip(inboxes, refs)])
+    # sharing common prefixes
+    prefixes = []
+    for inbox in inboxes:
+        try:
+            prefixes.append((inbox[:len(inbox) // 2],
+                             hrm(inbox[:len(inbox) // 2], floor, maxsteps=100000)))
+        except HRMError:
+            pass
+    verify("trie", sol["path"], refs + [out for _, out in prefixes],
+           lambda: list(HRMX(hrm.prog, hrm.labels).run_trie(
+               inboxes + [prefix for prefix, _ in prefixes], floor, 100000)))
+    # parsed from the cache, then into it for the first time
+    for _ in range(2):
+        verify("cache", sol["path"], tokens(hrm), tokens, HRM.parse(path, cache.name))
+        verify("cache", sol["path"], refs,
+               lambda: [HRMX.parse(path, cache=cache.name)(inbox, floor, 100000)
+                        for inbox in inboxes])
+        verify("cache", sol["path"], refs,
+               lambda: [Engine.parse(path, cache=cache.name)(inbox, floor, 100000)
+                        for inbox in inboxes])
+    # whatever the interpreter chosen
+    for detect in (False, True):
+        engine = Engine(hrm.prog, hrm.labels, detect=detect)
+        verify("engine", sol["path"], refs,
+               lambda: [engine(inbox, floor, 100000) for inbox in inboxes])
+
+# end of program reached without executing an operation
+hrm = program("INBOX\nOUTBOX\n")
+verify("iter", "end", ([0, 1], [1]),
+       iterate, HRMX(hrm.prog, hrm.labels), [1, 2], [])
+
+# strided buffers are rejected rather than misread
+hrm = program("a:\nINBOX\nOUTBOX\nJUMP a\n")
+values, offsets = array.array("i", range(8)), array.array("I", [0, 2, 4])
+verify("buffers", "contiguous", [[0, 1], [2, 3]],
+       lambda: list(HRMX(hrm.prog, hrm.labels).run_batch((values, offsets))))
+verify("buffers", "strided", BufferError,
+       raised, HRMX(hrm.prog, hrm.labels).run_batch, (memoryview(values)[::2], offsets))
+verify("buffers", "strided", BufferError,
+       raised, HRMX(hrm.prog, hrm.labels), memoryview(values)[::2])
+
+# a failing run does not affect the others
+hrm = program("a:\nINBOX\nCOPYTO 0\nADD 0\nOUTBOX\nJUMP a\n")
+verify("batch", "errors", [[2, 4], HRMProgramError.BADVALUE, [], [6]],
+       lambda: outcomes(HRMX(hrm.prog, hrm.labels).run_batch(
+           [[1, 2], ["A"], [], [3]], [], 1000)))
+verify("batch", "empty", 0, lambda: len(HRMX(hrm.prog, hrm.labels).run_batch([])))
+verify("parallel", "errors", [[2, 4], HRMProgramError.BADVALUE, [], [6]] * 10,
+       lambda: outcomes(HRMX(hrm.prog, hrm.labels).run_parallel(
+           [[1, 2], ["A"], [], [3]] * 10, [], 1000, workers=3, chunk=7)))
+verify("program", "shared", True, lambda: HRMX(shared).program is shared)
+verify("program", "labels", ValueError, raised, HRMX, shared, hrm.labels)
+
+# inboxes, outboxes and programs are not bounded by the number of tiles
+hrm = program("a:\nINBOX\nCOPYTO 0\nOUTBOX\nJUMP a\n")
+inbox = list(range(-2500, 2500))
+verify("max_outbox", "inbox", hrm(inbox),
+       HRMX(hrm.prog, hrm.labels, capacity=1, max_outbox=len(inbox)), inbox, [], 0)
+verify("max_outbox", "default", HRMProgramError.CAPACITY,
+       errno, HRMX(hrm.prog, hrm.labels, capacity=1), inbox)
+verify("max_outbox", "engine", hrm(inbox), Engine(hrm.prog, hrm.labels, capacity=1), inbox)
+hrm = program("INBOX\n" + "BUMPUP 0\n" * 40 + "OUTBOX\n")
+verify("max_outbox", "program", hrm([1], [0]),
+       HRMX(hrm.prog, hrm.labels, capacity=1), [1], [0])
+
+# streams longer than the outbox can hold, and chunks of buffers
+hrm = program("a:\nINBOX\nOUTBOX\nJUMP a\n")
+verify("stream", "long", (list(range(5000)), False),
+       streamed, HRMX(hrm.prog, hrm.labels, capacity=1).stream, range(5000), [], 0, 100)
+verify("stream", "buffers", [0, 1, 2, "A", 3, 4],
+       lambda: [v for values in HRMX(hrm.prog, hrm.labels).stream(
+           [array.array("i", [0, 1, 2]), "A", array.array("i", [3, 4])])
+                for v in values])
+verify("stream", "chunk", ValueError, raised, lambda: next(hrm.stream([1], chunk=0)))
+
+# long runs do not delay short ones, and are stopped after maxsteps
+hrm = program("a:\nINBOX\nJUMPZ a\nOUTBOX\nb:\nJUMP b\n")
+hrmx = HRMX(hrm.prog, hrm.labels)
+executors = [hrmx.fork() for _ in range(3)]
+for executor, inbox in zip(executors, ([1], [0] * 50 + [2], [])):
+    executor.boot(inbox)
+verify("round robin", "order", [(2, [], None), (0, [1], HRMProgramError.STEPS),
+                                (1, [2], HRMProgramError.STEPS)],
+       lambda: [(n, out, err and err.errno)
+                for n, out, err in round_robin(executors, 10, 500)])
+verify("round robin", "paused", False, lambda: (hrmx.boot([1]), hrmx.run(10))[1])
+verify("slices", "unloaded", ValueError, raised, HRMX().run)
+
+# infinite loops are reported at once, but not loops that make progress
+for src, expected in (("a:\nJUMP a\n", "cycle"),
+                      ("INBOX\nCOPYTO 0\na:\nCOPYFROM 0\nJUMPZ a\nOUTBOX\n", "cycle"),
+                      ("INBOX\nCOPYTO 0\na:\nBUMPUP 0\nJUMP a\n", "steps")):
+    hrm = program(src)
+    verify("cycle", "hrm", expected, looping, hrm.run, [0], [], 100000, detect=True)
+    verify("cycle", "hrmx", expected,
+           looping, detecting(HRMX(hrm.prog, hrm.labels)), [0], [], 100000)
+    verify("cycle", "engine", expected,
+           looping, Engine(hrm.prog, hrm.labels, detect=True), [0], [], 100000)
+    verify("cycle", "disabled", "steps", looping, HRMX(hrm.prog, hrm.labels), [0], [], 100000)
+
+# counting loops run at once with their exact number of steps, unless
+# their values overflow, in which case HRM is used instead
+hrm = program("INBOX\nCOPYTO 0\nINBOX\nCOPYTO 1\nINBOX\nCOPYTO 2\n"
+              "a:\nCOPYFROM 0\nADD 1\nCOPYTO 0\nBUMPDN 2\nJUMPZ b\nJUMP a\n"
+              "b:\nCOPYFROM 0\nOUTBOX\n")
+hrmx, fast = HRMX(hrm.prog, hrm.labels), HRMX(hrm.prog, hrm.labels)
+hrmx.profile()
+for inbox in ([0, 1000, 2000000], [0, -1000, 2000000], [2**31 - 100, 1, 50], [5, 1, 100]):
+    total = truncated(hrmx, inbox, [], 0)[1]
+    limits = (1, total // 2, total - 1, total, 0)
+    verify("accelerate", "steps",
+           [truncated(hrmx, inbox, [], maxsteps) for maxsteps in limits],
+           lambda: [truncated(fast, inbox, [], maxsteps) for maxsteps in limits])
+verify("accelerate", "hrm", hrm.run([5, 3, 1000]), fast, [5, 3, 1000], [], 0)
+for inbox in ([0, 10**6, 3000], [2**31 - 100, 1, 200]):
+    verify("accelerate", "overflow", HRMProgramError.OVERFLOW, errno, fast, inbox, [], 0)
+    verify("accelerate", "engine", hrm.run(inbox), Engine(hrm.prog, hrm.labels), inbox)
+
+# blocks are single-stepped when the inbox runs out or an operation fails
+# within them
+hrm = program("a:\nINBOX\nCOPYTO 0\nINBOX\nADD 0\nOUTBOX\nCOPYFROM 1\nOUTBOX\nJUMP a\n")
+for inbox, floor in (([1, 2, 3], [None, 0]), ([1, 2], []), ([1, "A"], [None, 0]),
+                     ([1, 2], {1: "B"})):
+    verify("blocks", "partial", stopped(stepped, hrm, hrm, inbox, floor),
+           stopped, hrm.run, hrm, inbox, floor, blocks=True)
+
+# traces are left when a jump is not taken as recorded, or when steps run
+# out within them
+hrm = program("a:\nINBOX\nCOPYTO 0\nb:\nCOPYFROM 0\nJUMPN c\nOUTBOX\n"
+              "BUMPDN 0\nJUMP b\nc:\nJUMP a\n")
+for inbox, maxsteps in (([100, 3, 50, -1, 200], 0), ([100, 50], 150), ([300], 1000),
+                        ([100, "A", 3], 0)):
+    expected = stopped(stepped, hrm, hrm, inbox, [], maxsteps)
+    verify("trace", "exit", expected, stopped, hrm.run, hrm, inbox, [], maxsteps, trace=True)
+    verify("trace", "cached", expected, stopped, hrm.run, hrm, inbox, [], maxsteps, trace=True)
+
+# invalid cached data are ignored, and so are caches that cannot be written
+hrm = program("a:\nINBOX\nOUTBOX\nJUMP a\n")
+src = "-- HUMAN RESOURCE MACHINE PROGRAM --\na:\nINBOX\nOUTBOX\nJUMP a\n"
+Engine.parse(io.StringIO(src), cache=cache.name)
+for name in os.listdir(cache.name):
+    pathlib.Path(cache.name, name).write_bytes(b"HRM\x01garbage")
+with tempfile.NamedTemporaryFile() as unwritable:
+    for where in (cache.name, unwritable.name):
+        verify("cache", "invalid", tokens(hrm), tokens, HRM.parse(io.StringIO(src), where))
+        verify("cache", "invalid", [1, 2],
+               HRMX.parse(io.StringIO(src), cache=where), [1, 2])
+        verify("cache", "invalid", [1, 2],
+               Engine.parse(io.StringIO(src), cache=where), [1, 2])
+# as well as truncated encodings, while altered ones never make HRMX read
+# or write out of its bounds
+src = ("-- HUMAN RESOURCE MACHINE PROGRAM --\nINBOX\nCOPYTO 0\nINBOX\nCOPYTO 1\n"
+       "INBOX\nCOPYTO 2\na:\nCOPYFROM 0\nADD 1\nCOPYTO 0\nBUMPDN 2\nJUMPZ b\n"
+       "JUMP a\nb:\nCOPYFROM 0\nOUTBOX\n")
+Program.parse(io.StringIO(src), cache.name)
+encoded = pathlib.Path(cache.name, f"hrm-{digest(src)[:32]}.x{ENCODING}")
+data = encoded.read_bytes()
+
+
+def altered(data):
+    # outcome of the program above with its cached encoding replaced
+    encoded.write_bytes(data)
+    return outcome(HRMX(Program.parse(io.StringIO(src), cache.name)), [0, 1000, 200], [], 0)
+
+
+verify("cache", "truncated", [[200000]] * (len(data) // 4),
+       lambda: [altered(data[:4 * i]) for i in range(len(data) // 4)])
+values = array.array("i", data)
+verify("cache", "altered", True,
+       lambda: all(isinstance(altered(array.array("i", [*values[:i], bad, *values[i + 1:]])
+                                      .tobytes()), (list, tuple))
+                   for i in range(len(values)) for bad in (-10**6, -1, 10**6)))
+cache.cleanup()
+
+# tiles are emptied by boot, and set again from the floor
+hrm = program("INBOX\nCOPYTO 0\nCOPYFROM 1\nOUTBOX\n")
+hrmx = HRMX(hrm.prog, hrm.labels)
+verify("reset", "tiles", [[2], HRMProgramError.EMPTY, [3]],
+       lambda: [hrmx([1], [None, 2]), errno(hrmx, [1]), hrmx([1], [4, 3])])
+# the code specialised for the floor is kept only while it has the same kinds
+hrm = program("BUMPUP 0\nOUTBOX\n")
+hrmx = HRMX(hrm.prog, hrm.labels)
+verify("reset", "kinds", [[2], [2], HRMProgramError.BADVALUE, HRMProgramError.BADVALUE,
+                          [3], HRMProgramError.EMPTY, [5]],
+       lambda: [hrmx([], [1]), hrmx([], {0: 1}), errno(hrmx, [], ["A"]), errno(hrmx, [], {0: "B"}),
+                hrmx([], array.array("i", [2])), errno(hrmx, [], []), hrmx([], [4, "C"])])
+
+# letters are subtracted as their alphabet distance, and are not numbers
+hrm = program("a:\nINBOX\nCOPYTO 0\nINBOX\nSUB 0\nOUTBOX\nCOPYFROM 0\nOUTBOX\nJUMP a\n")
+inbox = ["A", "D", "z", "a", 5, -2]
+verify("letters", "sub", hrm(inbox), HRMX(hrm.prog, hrm.labels), inbox)
+verify("letters", "kinds", HRMProgramError.BADVALUE,
+       errno, HRMX(hrm.prog, hrm.labels), ["A", 1])
+hrm = program("INBOX\nCOPYTO 0\nBUMPUP 0\nOUTBOX\n")
+verify("letters", "bump", HRMProgramError.BADVALUE,
+       errno, HRMX(hrm.prog, hrm.labels), ["A"])
+
+# values that HRMX cannot hold are left to HRM
+hrm = program("a:\nINBOX\nCOPYTO 0\nADD 0\nCOPYTO 0\nADD 0\nOUTBOX\nJUMP a\n")
+verify("overflow", "hrmx", HRMProgramError.OVERFLOW,
+       errno, HRMX(hrm.prog, hrm.labels), [2**29, 1, -2**29])
+for inbox in ([2**29, 1, -2**29], [2**40, -3]):
+    verify("engine", "overflow", hrm(inbox), Engine(hrm.prog, hrm.labels), inbox)
+if native:
+    hrmx = HRMX(hrm.prog, hrm.labels)
+    hrmx.aot(natives.name)
+    verify("overflow", "aot", HRMProgramError.OVERFLOW, errno, hrmx, [2**29, 1, -2**29])
+# empty inboxes are valid, whatever the interpreter
+hrm = program("BUMPUP 0\nOUTBOX\n")
+verify("engine", "empty", hrm([], [5]), Engine(hrm.prog, hrm.labels), [], [5])
+verify("engine", "empty", [[6]], lambda: list(HRMX(hrm.prog, hrm.labels).run_batch([[]], [5])))
+verify("engine", "unbooted", ValueError, raised, HRMX(hrm.prog, hrm.labels))
+hrm = program("a:\nINBOX\nOUTBOX\nJUMP a\n")
+verify("engine", "empty", [], Engine(hrm.prog, hrm.labels), [])
+with tempfile.NamedTemporaryFile("w", suffix=".asm") as src:
+    src.write("-- HUMAN RESOURCE MACHINE PROGRAM --\nBUMPUP 0\nOUTBOX\n")
+    src.flush()
+    verify("hrmi run", "empty", (0, "6\n"),
+           lambda: operator.attrgetter("exit_code", "output")(
+               CliRunner().invoke(app, ["run", src.name, "-i", "", "-t", "5"])))
+# as well as tiles beyond its capacity
+hrm = program("INBOX\nCOPYTO 9\nOUTBOX\n")
+verify("engine", "capacity", [1], Engine(hrm.prog, hrm.labels, capacity=4), [1])
+
+# snapshots are restored only into executors that can hold them
+hrm = program("INBOX\nCOPYTO 9\nOUTBOX\n")
+hrmx = HRMX(hrm.prog, hrm.labels)
+hrmx.boot([1])
+hrmx.run(2)
+verify("snapshot", "capacity", ValueError,
+       raised, HRMX(hrm.prog, hrm.labels, capacity=4).restore, hrmx.snapshot())
+
+# chains of jumps are taken at once, but steps are counted one by one
+hrm = program("a:\nINBOX\nJUMPZ b\nOUTBOX\nJUMP c\nb:\nJUMP c\nc:\nJUMP d\nd:\nJUMP a\n")
+inbox = [1, 0, 2, 0, 0, 3]
+hrmx, threaded = HRMX(hrm.prog, hrm.labels), HRMX(hrm.prog, hrm.labels)
+hrmx.profile()
+verify("threaded", "outbox", hrm(inbox), threaded, inbox)
+verify("threaded", "steps", [truncated(hrmx, inbox, [], maxsteps) for maxsteps in range(40)],
+       lambda: [truncated(threaded, inbox, [], maxsteps) for maxsteps in range(40)])
+
+# hrmi profile runs the examples of a level, or bounded generated inboxes
+hrm, _, floor = HRM.from_level(2)
+examples = HRM.level(2)["examples"]
+steps = sum(sum(hits(hrm, example["inbox"], floor).values()) for example in examples)
+verify("hrmi profile", "level", True,
+       lambda: f"{len(examples)} runs, {steps} steps,"
+       in CliRunner().invoke(app, ["profile", "lvl:2"]).output)
+with tempfile.NamedTemporaryFile("w", suffix=".asm") as src:
+    src.write("-- HUMAN RESOURCE MACHINE PROGRAM --\na:\nJUMP a\n")
+    src.flush()
+    verify("hrmi profile", "maxsteps", True,
+           lambda: "(3 stopped after 50 steps)"
+           in CliRunner().invoke(app, ["profile", src.name, "-r", "3", "-s", "50"]).output)
+
+natives.cleanup()
 
 for err, count in errors.items():
     print(f"=> {err}:{S.RESET_ALL} {count}")